@@ -0,0 +1,94 @@
+"""Measure locating downloaded files in a large output directory.
+
+    python benchmarks/download.py [-n TRACKS] [-j N]
+
+Downloads `n` synthetic tracks (with LocalDownloader, from file:// URLs)
+with the flat layout, which puts them all in one directory, and with the
+album layout. Then times the lookup done before, which globbed the output
+directory for the name of every file once post-processed, over the files
+of the flat download.
+"""
+import argparse
+import contextlib
+import glob
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from musiclib.operations._db import connection
+from musiclib.operations.url import download
+
+import synth
+
+
+def legacy_change_extension(video_filename):
+    name = os.path.splitext(video_filename)[0]
+    return glob.glob(glob.escape(name) + ".*")[0]
+
+
+@contextlib.contextmanager
+def quiet_stderr():
+    """Discard the progress lines (one per track when not on a terminal)."""
+    sys.stderr.flush()
+    saved = os.dup(2)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 2)
+    try:
+        yield
+    finally:
+        sys.stderr.flush()
+        os.dup2(saved, 2)
+        os.close(saved)
+
+
+def largest_directory(top):
+    return max(len(files) for _, _, files in os.walk(top))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=10_000, help="number of tracks")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--legacy-sample", type=int, default=1000,
+        help="files looked up with the legacy glob (it is slow). Default: 1000")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database, _ = synth.make_library(tmp, args.n, urls=True)
+        print(f"{args.n} tracks")
+        for layout in ("flat", "album"):
+            output_dir = os.path.join(tmp, layout)
+            with connection(database) as con, quiet_stderr():
+                start = time.perf_counter()
+                download.download_tracks(
+                    con,
+                    download.LocalDownloader,
+                    args.jobs,
+                    force=True,
+                    output_dir=output_dir,
+                    layout=layout,
+                )
+                elapsed = time.perf_counter() - start
+            print(
+                f"  {layout:6} {elapsed:8.2f} s {args.n / elapsed:8.0f} tracks/s"
+                f"  (largest directory: {largest_directory(output_dir)} files)"
+            )
+
+        flat = os.path.join(tmp, "flat")
+        names = sorted(os.listdir(flat))[: args.legacy_sample]
+        start = time.perf_counter()
+        for name in names:
+            video_filename = os.path.splitext(name)[0] + ".webm"
+            legacy_change_extension(os.path.join(flat, video_filename))
+        per_file = (time.perf_counter() - start) / len(names)
+        print(
+            f"  legacy glob lookup: {per_file * 1000:.2f} ms per file in a directory"
+            f" of {args.n}, {per_file * args.n:.1f} s for all of them"
+        )
+
+
+if __name__ == "__main__":
+    main()
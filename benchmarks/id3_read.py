@@ -0,0 +1,46 @@
+"""Compare the ID3 fast path against a full eyed3 load.
+
+    python benchmarks/id3_read.py [-n FILES] [--version {1,3,4}] [--filler BYTES]
+"""
+import argparse
+import logging
+import tempfile
+import time
+
+from musiclib.operations._id3 import read_tags
+from musiclib.operations._metadata_analyser import get_metadata_eyed3
+
+import synth
+
+
+def timed(func, paths):
+    start = time.perf_counter()
+    result = [func(p) for p in paths]
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=2000, help="number of files")
+    parser.add_argument("--version", type=int, choices=(1, 3, 4), default=3)
+    parser.add_argument("--filler", type=int, default=32768,
+        help="bytes of binary data before the text frames (e.g. cover art)")
+    args = parser.parse_args()
+    logging.getLogger("eyed3").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = synth.make_corpus(tmp, args.n, args.version, args.filler)
+        fast_time, fast = timed(read_tags, paths)
+        eyed3_time, slow = timed(get_metadata_eyed3, paths)
+
+    if None in fast:
+        print(f"fast path fell back on {fast.count(None)} files")
+    mismatches = sum(1 for a, b in zip(fast, slow) if a is not None and a != b)
+    print(f"files:     {args.n} (ID3v{args.version}, {args.filler} filler bytes)")
+    print(f"eyed3:     {eyed3_time:8.3f} s {args.n / eyed3_time:10.0f} files/s")
+    print(f"fast path: {fast_time:8.3f} s {args.n / fast_time:10.0f} files/s")
+    print(f"speedup:   {eyed3_time / fast_time:8.1f}x, {mismatches} mismatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Measure the throughput of the database side of `add`.
+
+Synthetic songs are fed straight to `add.insert_songs` (no files are read),
+and compared with the previous single-transaction ingest, which checked
+duplicates with a tuple IN.
+
+    python benchmarks/ingest.py [-n ROWS ...] [--batch-size N]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from musiclib.operations import add, init
+from musiclib.operations._db import connection
+
+import synth
+
+LEGACY_CHECK_DUPLICATES = """
+    SELECT title, artist FROM to_be_added
+    WHERE (title, artist) IN (
+        SELECT title, artist FROM library
+    );
+    """
+
+
+def legacy_insert(con, songs):
+    with con:
+        con.execute(add.CREATE_TEMP_TABLE)
+        con.executemany(add.INSERT_SONG_TEMP, songs)
+        con.execute(LEGACY_CHECK_DUPLICATES).fetchall()
+        for statement in add.COPY_SONG:
+            con.execute(statement)
+
+
+def batched_insert(batch_size):
+    def insert(con, songs):
+        add.insert_songs(con, songs, warn_duplicates=True, batch_size=batch_size)
+
+    return insert
+
+
+def run(insert, n: int, preloaded: int) -> float:
+    """Time inserting `n` songs into a library that has `preloaded` of them."""
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "library.db")
+        init.init(database)
+        songs = [
+            add.song_dict(f"{i:07d}.mp3", s) for i, s in enumerate(synth.songs(n))
+        ]
+        with connection(database) as con:
+            if preloaded:
+                add.insert_songs(con, songs[:preloaded], warn_duplicates=False)
+            start = time.perf_counter()
+            insert(con, songs)
+            return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--batch-size", type=int, default=add.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--skip-legacy", action="store_true",
+        help="only measure the batched ingest")
+    args = parser.parse_args()
+    # Preloaded songs are reported as duplicates; do not print them
+    logging.disable(logging.WARNING)
+
+    for n in args.n:
+        print(f"{n} rows (10% already in the library)")
+        pipelines = [(f"batched ({args.batch_size})", batched_insert(args.batch_size))]
+        if not args.skip_legacy:
+            pipelines.append(("single transaction", legacy_insert))
+        for name, insert in pipelines:
+            elapsed = run(insert, n, n // 10)
+            print(f"  {name:22} {elapsed:8.2f} s {n / elapsed:10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compare the memory taken by `SongList` and `ColumnarSongList`.
+
+    python benchmarks/memory.py [-n ROWS ...]
+
+Songs are read from a synthetic library, as `list` does, and collected into
+each kind of list. Prints the memory they take once built (and the peak
+while building them, with tracemalloc), and the time to collect and to
+render them as JSON.
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+from musiclib.operations import list as op_list
+
+from search import populate
+
+
+def measure(database, columnar):
+    tracemalloc.start()
+    start = time.perf_counter()
+    song_list = op_list.do_list(database, columnar=columnar)
+    collect_time = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    op_list.write_json(song_list.songs, io.StringIO(), compact=True)
+    json_time = time.perf_counter() - start
+    return current, peak, collect_time, json_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    for n in args.n:
+        with tempfile.TemporaryDirectory() as tmp:
+            database = os.path.join(tmp, "library.db")
+            populate(database, n)
+            print(f"{n} rows")
+            results = {}
+            for name, columnar in (("SongList", False), ("columnar", True)):
+                current, peak, collect_time, json_time = measure(database, columnar)
+                results[name] = current
+                print(
+                    f"  {name:9} {current / 2**20:8.1f} MiB"
+                    f" (peak {peak / 2**20:8.1f} MiB, {current / n:6.1f} B/row)"
+                    f"  collect {collect_time:6.2f} s  JSON {json_time:6.2f} s"
+                )
+            print(f"  saved     {1 - results['columnar'] / results['SongList']:8.0%}")
+
+
+if __name__ == "__main__":
+    main()
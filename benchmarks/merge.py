@@ -0,0 +1,76 @@
+"""Measure `merge`, in full and incrementally.
+
+    python benchmarks/merge.py [-n ROWS ...] [--changed PCT]
+
+A synthetic library with a change log gets a URL for every song, and is
+merged into an empty library. Then PCT% of its URLs change, and it is
+merged again, in full and incrementally (from a copy of the merged library
+each time).
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from musiclib.operations import init, merge
+from musiclib.operations._db import connection
+
+from search import populate
+
+SET_URLS = """
+    UPDATE songs
+    SET download_url = 'https://example.com/' || id || '/' || :version,
+        download_url_updated = :version
+    WHERE id % :every = 0;
+    """
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--changed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    for n in args.n:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "source.db")
+            target = os.path.join(tmp, "target.db")
+            populate(source, n)
+            init.init(source, upgrade_existing=True, change_log=True)
+            with connection(source) as con:
+                with con:
+                    con.execute(SET_URLS, {"version": 1, "every": 1})
+            init.init(target)
+            elapsed, result = timed(lambda: merge.merge(target, source))
+            print(f"{n} rows")
+            print(f"  {'first merge':20} {elapsed:8.3f} s ({result.added} added)")
+
+            with connection(source) as con:
+                with con:
+                    con.execute(
+                        SET_URLS, {"version": 2, "every": round(100 / args.changed)}
+                    )
+            merged = os.path.join(tmp, "merged.db")
+            shutil.copyfile(target, merged)
+            for name, incremental in (("full", False), ("incremental", True)):
+                shutil.copyfile(merged, target)
+                elapsed, result = timed(
+                    lambda: merge.merge(
+                        target, source, merge.PREFER_NEWER, incremental
+                    )
+                )
+                print(
+                    f"  {name + ' merge':20} {elapsed:8.3f} s"
+                    f" ({result.songs} read, {result.updated} updated)"
+                )
+
+
+if __name__ == "__main__":
+    main()
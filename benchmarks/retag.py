@@ -0,0 +1,71 @@
+"""Compare writing tags with eyed3 against the retag engine.
+
+    python benchmarks/retag.py [-n FILES] [--version {3,4}] [--filler BYTES] [-j N]
+
+Every file gets a new title (which fits in the padding of its tag), then the
+same tags are written again, which the engine skips.
+"""
+import argparse
+import logging
+import tempfile
+import time
+
+from musiclib.operations import retag
+from musiclib.operations._id3 import read_tags
+from musiclib.operations._metadata_analyser import set_metadata
+
+import synth
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def retitled(paths, n, suffix):
+    return [
+        (p, s._replace(title=f"{s.title} ({suffix})"))
+        for p, s in zip(paths, synth.songs(n))
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=2000, help="number of files")
+    parser.add_argument("--version", type=int, choices=(3, 4), default=3)
+    parser.add_argument("--filler", type=int, default=32768,
+        help="bytes of binary data before the text frames (e.g. cover art)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="workers for the engine")
+    args = parser.parse_args()
+    logging.getLogger("eyed3").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = synth.make_corpus(tmp, args.n, args.version, args.filler)
+        eyed3_items = retitled(paths, args.n, "eyed3")
+        engine_items = retitled(paths, args.n, "retag")
+
+        eyed3_time = timed(lambda: [set_metadata(p, s) for p, s in eyed3_items])
+        outcomes = []
+        engine_time = timed(
+            lambda: outcomes.extend(
+                r.outcome for r in retag.tag_files(engine_items, args.jobs)
+            )
+        )
+        skip_time = timed(lambda: list(retag.tag_files(engine_items, args.jobs)))
+        wrong = sum(1 for p, s in engine_items if read_tags(p) != s)
+
+    print(f"files:      {args.n} (ID3v2.{args.version}, {args.filler} filler bytes)")
+    for name, t in (
+        ("eyed3", eyed3_time),
+        ("retag", engine_time),
+        ("unchanged", skip_time),
+    ):
+        print(f"{name + ':':11} {t:8.3f} s {args.n / t:10.0f} files/s")
+    print(f"speedup:    {eyed3_time / engine_time:8.1f}x", end=", ")
+    print(f"{outcomes.count(retag.IN_PLACE)} in place, {wrong} wrong tags")
+
+
+if __name__ == "__main__":
+    main()
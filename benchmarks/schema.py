@@ -0,0 +1,122 @@
+"""Compare the normalized schema against the single `library` table it replaced.
+
+    python benchmarks/schema.py [-n ROWS ...] [--repeat N]
+
+A library in the first schema is filled with synthetic songs, then copied
+and upgraded in place (timed). Prints the size of the songs and their
+indexes in both (from the `dbstat` table, so the search index, which both
+have, is left out), and the time to list the songs of an artist and of an
+album.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from musiclib.operations import init
+from musiclib.operations import list as op_list
+from musiclib.operations._db import connect
+
+import synth
+
+LEGACY_SCHEMA = """
+    CREATE TABLE library (
+        title TEXT,
+        artist TEXT,
+        album TEXT,
+        download_url TEXT DEFAULT NULL,
+        download_status TEXT DEFAULT NULL,
+        download_path TEXT DEFAULT NULL,
+        download_hash TEXT DEFAULT NULL,
+        download_attempts INTEGER NOT NULL DEFAULT 0,
+        download_last_attempt REAL DEFAULT NULL,
+        download_error TEXT DEFAULT NULL,
+        path TEXT DEFAULT NULL,
+        audio_hash TEXT DEFAULT NULL,
+        PRIMARY KEY (title, artist)
+    );
+    CREATE INDEX library_artist ON library (artist, title);
+    CREATE INDEX library_album ON library (album, title);
+    CREATE INDEX library_audio_hash ON library (audio_hash);
+    """
+
+LEGACY_INSERT = """
+    INSERT INTO library (title, artist, album, path) VALUES (?, ?, ?, ?);
+    """
+
+SONGS_SIZE = """
+    SELECT SUM(pgsize) FROM dbstat
+    WHERE name NOT LIKE 'library_fts%' AND name NOT LIKE '%scan_state%';
+    """
+
+
+def make_legacy(database, n):
+    con = connect(database)
+    con.executescript(LEGACY_SCHEMA)
+    with con:
+        con.executemany(
+            LEGACY_INSERT,
+            (
+                (s.title, s.artist, s.album, f"/music/{i // 1000:04d}/{i:07d}.mp3")
+                for i, s in enumerate(synth.songs(n))
+            ),
+        )
+    con.close()
+
+
+def songs_size(con):
+    con.execute("VACUUM;")
+    return con.execute(SONGS_SIZE).fetchone()[0]
+
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.n:
+        with tempfile.TemporaryDirectory() as tmp:
+            legacy = os.path.join(tmp, "legacy.db")
+            current = os.path.join(tmp, "library.db")
+            make_legacy(legacy, n)
+            shutil.copyfile(legacy, current)
+            con = connect(current)
+            start = time.perf_counter()
+            with con:
+                init.upgrade(con)
+            print(f"{n} rows (upgraded in {time.perf_counter() - start:.1f} s)")
+            cons = {"single table": connect(legacy), "normalized": con}
+            for name, c in cons.items():
+                print(f"  {name:14} songs and indexes {songs_size(c) / 2**20:8.1f} MiB")
+            queries = {
+                "artist": op_list.Query(artist="Artist 00042"),
+                "album": op_list.Query(album="Album 00042-1"),
+            }
+            for field, query in queries.items():
+                times = {
+                    name: best_of(
+                        args.repeat, lambda: list(op_list.query_songs(c, query))
+                    )
+                    for name, c in cons.items()
+                }
+                print(
+                    f"  list --{field:7}"
+                    + "".join(f"  {name} {t * 1000:7.3f} ms" for name, t in times.items())
+                )
+            for c in cons.values():
+                c.close()
+
+
+if __name__ == "__main__":
+    main()
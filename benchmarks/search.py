@@ -0,0 +1,76 @@
+"""Compare `search` (FTS5) against a LIKE '%word%' scan.
+
+    python benchmarks/search.py [-n ROWS ...] [--repeat N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from musiclib.operations import add, init, search
+from musiclib.operations._db import connect, connection
+
+import synth
+
+LIKE_SEARCH = """
+    SELECT title, artist, album, download_url FROM library
+    WHERE title LIKE :pattern OR artist LIKE :pattern OR album LIKE :pattern;
+    """
+
+# Distinctive words: every synthetic song matches "Song", which measures
+# ranking the whole table rather than searching it
+QUERIES = ("0001234", "00042", "00123")
+
+
+def populate(database: str, n: int) -> None:
+    init.init(database)
+    with connection(database) as con:
+        add.insert_songs(
+            con,
+            ({**s.as_dict(), "path": None, "audio_hash": None} for s in synth.songs(n)),
+            warn_duplicates=False,
+        )
+
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = func()
+        times.append(time.perf_counter() - start)
+    return min(times), count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for n in args.n:
+        with tempfile.TemporaryDirectory() as tmp:
+            database = os.path.join(tmp, "library.db")
+            start = time.perf_counter()
+            populate(database, n)
+            print(f"{n} rows (populated in {time.perf_counter() - start:.1f} s)")
+            con = connect(database)
+            for text in QUERIES:
+                like_time, like_count = best_of(
+                    args.repeat,
+                    lambda: len(
+                        con.execute(LIKE_SEARCH, {"pattern": f"%{text}%"}).fetchall()
+                    ),
+                )
+                fts_time, fts_count = best_of(
+                    args.repeat, lambda: len(list(search.search(database, text)))
+                )
+                print(
+                    f"  {text!r:18} LIKE {like_time * 1000:9.2f} ms ({like_count} rows)"
+                    f"  FTS5 {fts_time * 1000:9.2f} ms ({fts_count} rows)"
+                    f"  {like_time / fts_time:6.1f}x"
+                )
+            con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compare a lookup through the daemon against running the CLI.
+
+    python benchmarks/serve.py [-n ROWS] [--requests N] [--spawns N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from musiclib.operations import serve
+
+from search import populate
+
+RUN_CLI = "from musiclib._main import main; main()"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=100_000, help="rows in the library")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--spawns", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "library.db")
+        path = os.path.join(tmp, "library.sock")
+        populate(database, args.n)
+        library = serve.Library(database)
+        server = serve.Server(path, library)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        lookup = {"artist": "Artist 00042", "limit": 10}
+        times = []
+        with serve.Client(path) as client:
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                client.request("list", **lookup)
+                times.append(time.perf_counter() - start)
+        daemon_ms = statistics.median(times) * 1000
+
+        times = []
+        for _ in range(args.spawns):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-c", RUN_CLI, "-d", database, "list", "--ndjson",
+                 "--artist", lookup["artist"], "--limit", str(lookup["limit"])],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            times.append(time.perf_counter() - start)
+        spawn_ms = statistics.median(times) * 1000
+
+        server.shutdown()
+        server.server_close()
+        library.close()
+
+    print(f"{args.n} rows, list --artist ... --limit 10 (median)")
+    print(f"  daemon request   {daemon_ms:8.3f} ms")
+    print(f"  CLI process      {spawn_ms:8.3f} ms")
+    print(f"  speedup          {spawn_ms / daemon_ms:8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
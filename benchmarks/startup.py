@@ -0,0 +1,91 @@
+"""Measure the import time of CLI commands with `python -X importtime`.
+
+    python benchmarks/startup.py [-r RUNS] [--max-ms MS]
+
+For every command, prints the median time spent importing modules once the
+CLI starts (interpreter startup excluded) and the slow dependencies it
+loaded. Exits with status 1 if a command takes more than MS milliseconds,
+or if a command that does not need them loads eyed3 or pkg_resources.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RUN_CLI = "from musiclib._main import main; main()"
+
+# (arguments, modules it must not import)
+COMMANDS = (
+    (["--help"], ("eyed3", "pkg_resources", "attr", "multiprocessing")),
+    (["list"], ("eyed3", "pkg_resources", "multiprocessing")),
+    (["list", "--ndjson"], ("eyed3", "pkg_resources", "multiprocessing")),
+    (["url", "get"], ("eyed3", "pkg_resources", "multiprocessing")),
+    (["search", "x"], ("eyed3", "pkg_resources", "multiprocessing")),
+    (["add", "--help"], ("eyed3", "pkg_resources")),
+)
+
+# Reported when loaded
+SLOW_MODULES = ("eyed3", "pkg_resources", "attr", "multiprocessing", "importlib.metadata")
+
+
+def import_times(args, database):
+    """Run the CLI with `args` and return `(microseconds, modules)`: the time
+    spent importing from `musiclib._main` on, and every module imported."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", RUN_CLI, "-d", database, *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    total = 0
+    counting = False
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # Header
+        module = name.strip()
+        modules.add(module)
+        top_level = not name[1:].startswith(" ")
+        counting = counting or module == "musiclib._main"
+        if counting and top_level:
+            total += int(cumulative)
+    return total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-r", "--runs", type=int, default=7)
+    parser.add_argument("--max-ms", type=float, default=150.0,
+        help="fail if a command spends more than this importing. Default: 150")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "library.db")
+        subprocess.run(
+            [sys.executable, "-c", RUN_CLI, "-d", database, "init"], check=True
+        )
+        for command, forbidden in COMMANDS:
+            runs = [import_times(command, database) for _ in range(args.runs)]
+            ms = statistics.median(t for t, _ in runs) / 1000
+            modules = runs[0][1]
+            slow = [m for m in SLOW_MODULES if m in modules]
+            bad = [m for m in forbidden if m in modules]
+            status = "ok"
+            if ms > args.max_ms or bad:
+                status = "FAIL"
+                failed = True
+            print(
+                f"{' '.join(command):16} {ms:7.1f} ms  {status:4}"
+                f"  slow imports: {', '.join(slow) or '-'}"
+            )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Measure how the main operations scale with the size of the library.
+
+    python benchmarks/suite.py [-n FILES ...] [-j N] [--repeat N] [--only OP ...]
+                               [-o RESULTS.json] [--compare OLD.json]
+                               [--max-regression PCT]
+
+For every size, a synthetic library is generated (see synth.py), then every
+operation runs in its own process, on its own copy of the library, so that
+its peak RSS is its own. Records the wall time of the operation (setup
+excluded, best of `--repeat`), the rows (songs or files) per second, and
+the peak RSS of the process, and writes them as JSON. With `--compare`, the
+results are compared with an earlier run; with `--max-regression`, exits
+with status 1 if an operation got slower by more than PCT percent.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from musiclib._main import get_version
+from musiclib.operations import add, init, remove, url
+from musiclib.operations import list as op_list
+from musiclib.operations.url import download
+
+import synth
+
+
+def setup_add(library, scratch, jobs):
+    database = os.path.join(scratch, "library.db")
+    init.init(database)
+    return lambda: add.add(database, *library.paths, warn_duplicates=False, jobs=jobs)
+
+
+def setup_add_cached(library, scratch, jobs):
+    database = library.copy(scratch)
+    return lambda: add.add(database, *library.paths, warn_duplicates=False, jobs=jobs)
+
+
+def setup_list(library, scratch, jobs):
+    database = library.copy(scratch)
+
+    def run():
+        with open(os.devnull, "w") as f:
+            op_list.write_json(op_list.iter_songs(database), f)
+
+    return run
+
+
+def setup_list_aligned(library, scratch, jobs):
+    database = library.copy(scratch)
+
+    def run():
+        op_list.to_json(op_list.do_list(database, columnar=True))
+
+    return run
+
+
+def setup_url_template(library, scratch, jobs):
+    database = library.copy(scratch)
+
+    def run():
+        with open(os.devnull, "w") as f:
+            url.template(database, f)
+
+    return run
+
+
+def setup_url_set(library, scratch, jobs):
+    database = library.copy(scratch)
+    urls = os.path.join(library.directory, "urls.txt")
+
+    def run():
+        with open(urls) as f:
+            url.set_from_file(database, f)
+
+    return run
+
+
+def setup_remove(library, scratch, jobs):
+    database = library.copy(scratch)
+    return lambda: remove.remove(database, *library.paths, jobs=jobs)
+
+
+def setup_download(library, scratch, jobs):
+    database = library.copy(scratch)
+    os.chdir(scratch)  # Downloads are written to the working directory
+    download.RETRY_BACKOFF = 0
+
+    def run():
+        download.do_download(
+            database, jobs, downloader=download.LocalDownloader, force=True
+        )
+
+    return run
+
+
+# Name: function preparing the operation on a copy of the library (in a
+# scratch directory) and returning it
+OPERATIONS = {
+    "add": setup_add,
+    "add-cached": setup_add_cached,
+    "list": setup_list,
+    "list-aligned": setup_list_aligned,
+    "url-template": setup_url_template,
+    "url-set": setup_url_set,
+    "remove": setup_remove,
+    "download": setup_download,
+}
+
+
+class Library:
+    """A synthetic library in `directory`: its database, stubs and a file of
+    URLs for `url set`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.database = os.path.join(directory, "library.db")
+        with open(os.path.join(directory, "paths.txt")) as f:
+            self.paths = f.read().splitlines()
+
+    @classmethod
+    def create(cls, directory, n):
+        database, paths = synth.make_library(directory, n, urls=True)
+        with open(os.path.join(directory, "paths.txt"), "w") as f:
+            f.writelines(f"{p}\n" for p in paths)
+        with open(os.path.join(directory, "urls.txt"), "w") as f:
+            for path, song in zip(paths, synth.songs(n)):
+                f.write(
+                    f"{shlex.quote(song.title)} {shlex.quote(song.artist)}"
+                    f" {shlex.quote('file://' + path)}\n"
+                )
+        return cls(directory)
+
+    def copy(self, scratch):
+        database = os.path.join(scratch, "library.db")
+        shutil.copyfile(self.database, database)
+        return database
+
+
+def peak_rss_kib():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss  # Bytes on macOS
+
+
+def run_child(operation, directory, jobs):
+    """Run `operation` once on the library in `directory` and print its
+    measurements as JSON."""
+    library = Library(directory)
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        func = OPERATIONS[operation](library, scratch, jobs)
+        baseline = peak_rss_kib()
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+        os.chdir(directory)
+    measurements = {
+        "seconds": seconds,
+        "peak_rss_kib": peak_rss_kib(),
+        "baseline_rss_kib": baseline,
+    }
+    json.dump(measurements, sys.stdout)
+
+
+def measure(operation, directory, n, jobs, repeat):
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", operation, directory, "-j", str(jobs)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        )
+        runs.append(json.loads(proc.stdout))
+    best = min(runs, key=lambda r: r["seconds"])
+    return {
+        "operation": operation,
+        "n": n,
+        "jobs": jobs,
+        "seconds": best["seconds"],
+        "rows_per_second": n / best["seconds"],
+        "peak_rss_kib": max(r["peak_rss_kib"] for r in runs),
+        "baseline_rss_kib": min(r["baseline_rss_kib"] for r in runs),
+    }
+
+
+def git_revision():
+    try:
+        proc = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+    except OSError:
+        return None
+    return proc.stdout.strip() or None
+
+
+def compare(results, old, max_regression):
+    """Print the change of every result from `old`, and return whether an
+    operation got slower by more than `max_regression` percent."""
+    previous = {(r["operation"], r["n"]): r for r in old["results"]}
+    print(f"compared with {old.get('revision') or old.get('version')} ({old['date']})")
+    regressed = False
+    for r in results:
+        o = previous.get((r["operation"], r["n"]))
+        if o is None:
+            continue
+        time_change = r["seconds"] / o["seconds"] - 1
+        rss_change = r["peak_rss_kib"] / o["peak_rss_kib"] - 1
+        flag = ""
+        if max_regression is not None and time_change * 100 > max_regression:
+            flag = "  REGRESSION"
+            regressed = True
+        print(
+            f"  {r['operation']:13} {r['n']:>9}  time {time_change:+7.1%}"
+            f"  peak RSS {rss_change:+7.1%}{flag}"
+        )
+    return regressed
+
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--child", choices=OPERATIONS)
+        parser.add_argument("directory")
+        parser.add_argument("-j", "--jobs", type=int, default=1)
+        args = parser.parse_args()
+        run_child(args.child, args.directory, args.jobs)
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, nargs="+", default=[1000, 10_000],
+        help="library sizes (number of files)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="jobs of the operations that take them")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", choices=OPERATIONS, default=list(OPERATIONS),
+        metavar="OP", help=f"operations to run: {', '.join(OPERATIONS)}")
+    parser.add_argument("-o", "--output", help="write the results to this file")
+    parser.add_argument("--compare", metavar="OLD", help="results of an earlier run")
+    parser.add_argument("--max-regression", type=float, metavar="PCT",
+        help="with --compare, fail if an operation got slower by more than PCT%%")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.n:
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            Library.create(tmp, n)
+            print(
+                f"{n} files (generated in {time.perf_counter() - start:.1f} s)",
+                file=sys.stderr,
+            )
+            for operation in args.only:
+                r = measure(operation, tmp, n, args.jobs, args.repeat)
+                results.append(r)
+                print(
+                    f"  {operation:13} {r['seconds']:8.3f} s"
+                    f" {r['rows_per_second']:10.0f} rows/s"
+                    f" {r['peak_rss_kib'] / 1024:8.1f} MiB peak RSS",
+                    file=sys.stderr,
+                )
+
+    report = {
+        "version": get_version(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(results, old, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
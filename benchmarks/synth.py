@@ -0,0 +1,150 @@
+"""Synthetic library generator for the benchmarks.
+
+Writes small MP3 stubs (a hand-built ID3 tag followed by a few silent MPEG
+frames), so no encoder or tagging library is needed.
+
+    python benchmarks/synth.py DIR [-n FILES] [--urls]
+
+writes `n` stubs under DIR/files and a library of them in DIR/library.db.
+"""
+import argparse
+import os
+import random
+from typing import Iterator, List, Optional, Tuple
+
+from musiclib.operations import add, init
+from musiclib.operations._db import connection
+from musiclib.operations._types import Song
+
+# MPEG-1 Layer III, 128 kbit/s, 44.1 kHz, no padding: 417 bytes per frame
+MPEG_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def _syncsafe(n: int) -> bytes:
+    return bytes(((n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F))
+
+
+def _frame(fid: bytes, data: bytes, version: int) -> bytes:
+    if version == 4:
+        size = _syncsafe(len(data))
+    else:
+        size = len(data).to_bytes(4, "big")
+    return fid + size + b"\x00\x00" + data
+
+
+def _text_frame(fid: bytes, text: str, version: int) -> bytes:
+    if version == 4:
+        data = b"\x03" + text.encode("utf_8")
+    else:
+        data = b"\x01" + text.encode("utf_16")
+    return _frame(fid, data, version)
+
+
+def id3v2_tag(
+    song: Song, version: int = 3, filler: int = 0, padding: int = 256
+) -> bytes:
+    """Render an ID3v2.`version` tag. `filler` bytes of binary data are put
+    before the text frames, like the cover art of a real file."""
+    frames = b""
+    if filler:
+        frames += _frame(b"PRIV", b"musiclib-bench\x00" + bytes(filler), version)
+    frames += _text_frame(b"TIT2", song.title, version)
+    frames += _text_frame(b"TPE1", song.artist, version)
+    if song.album:
+        frames += _text_frame(b"TALB", song.album, version)
+    frames += b"\x00" * padding
+    return b"ID3" + bytes((version, 0, 0)) + _syncsafe(len(frames)) + frames
+
+
+def id3v1_tag(song: Song) -> bytes:
+    def field(s: Optional[str]) -> bytes:
+        return (s or "").encode("latin_1", "replace")[:30].ljust(30, b"\x00")
+
+    return (
+        b"TAG"
+        + field(song.title)
+        + field(song.artist)
+        + field(song.album)
+        + b"\x00" * 34
+        + b"\xff"
+    )
+
+
+def write_stub(
+    path: str, song: Song, version: int = 3, filler: int = 0, frames: int = 20
+) -> None:
+    """Write a tagged MP3 stub. `version` 1 writes an ID3v1 tag only."""
+    with open(path, "wb") as f:
+        if version != 1:
+            f.write(id3v2_tag(song, version, filler))
+        f.write(MPEG_FRAME * frames)
+        if version == 1:
+            f.write(id3v1_tag(song))
+
+
+def songs(n: int, seed: int = 0) -> Iterator[Song]:
+    """Yield `n` distinct songs. Artists and albums repeat, like in a real
+    library."""
+    rng = random.Random(seed)
+    artists = max(1, n // 50)
+    for i in range(n):
+        artist = rng.randrange(artists)
+        album = rng.randrange(5)
+        yield Song(
+            title=f"Song {i:07d}",
+            artist=f"Artist {artist:05d}",
+            album=f"Album {artist:05d}-{album}" if album else None,
+        )
+
+
+def make_corpus(
+    directory: str, n: int, version: int = 3, filler: int = 0, per_dir: int = 1000
+) -> List[str]:
+    """Write `n` stubs under `directory`, `per_dir` files per subdirectory."""
+    paths = []
+    for i, song in enumerate(songs(n)):
+        subdir = os.path.join(directory, f"{i // per_dir:04d}")
+        if i % per_dir == 0:
+            os.makedirs(subdir, exist_ok=True)
+        path = os.path.join(subdir, f"{i:07d}.mp3")
+        write_stub(path, song, version, filler)
+        paths.append(path)
+    return paths
+
+
+SET_FILE_URL = """
+    UPDATE songs SET download_url = 'file://' || path;
+    """
+
+
+def make_library(
+    directory: str, n: int, urls: bool = False, version: int = 3
+) -> Tuple[str, List[str]]:
+    """Write `n` stubs under `directory`/files and add them to a new library,
+    `directory`/library.db. With `urls`, the download URL of every song is
+    its own file (as a file:// URL). Returns the database and the stubs."""
+    paths = make_corpus(os.path.join(directory, "files"), n, version)
+    database = os.path.join(directory, "library.db")
+    init.init(database)
+    add.add(database, *paths, warn_duplicates=False)
+    if urls:
+        with connection(database) as con:
+            with con:
+                con.execute(SET_FILE_URL)
+    return database, paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("-n", type=int, default=10_000, help="number of files")
+    parser.add_argument("--urls", action="store_true",
+        help="set the download URL of every song to its own file")
+    args = parser.parse_args()
+    os.makedirs(args.directory, exist_ok=True)
+    database, _ = make_library(args.directory, args.n, args.urls)
+    print(f"{args.n} files in {os.path.join(args.directory, 'files')}, library {database}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Compare `url set` against the previous one UPDATE per line.
+
+    python benchmarks/url_import.py [-n LINES ...]
+
+Every song of a synthetic library gets a new URL, from a file in each
+format (the shlex template, TSV and NDJSON). 1% of the lines name no song.
+"""
+import argparse
+import io
+import json
+import os
+import shlex
+import tempfile
+import time
+
+from musiclib.operations import url
+from musiclib.operations._db import connection
+
+import synth
+from search import populate
+
+LEGACY_SET_URL = """
+    UPDATE songs
+    SET download_url = :url,
+        download_status = CASE
+            WHEN download_url IS :url THEN download_status ELSE NULL
+        END,
+        download_attempts = CASE
+            WHEN download_url IS :url THEN download_attempts ELSE 0
+        END
+    WHERE title = :title
+    AND artist_id = (SELECT id FROM artists WHERE name = :artist);
+    """
+
+
+def make_files(n):
+    """The same URLs as a template, TSV and NDJSON file."""
+    rows = []
+    for i, song in enumerate(synth.songs(n)):
+        title = song.title if i % 100 else f"Missing {i}"
+        rows.append((title, song.artist, f"https://example.com/watch?v={i:011d}"))
+    template = "".join(" ".join(map(shlex.quote, r)) + "\n" for r in rows)
+    tsv = url.TSV_HEADER + "\n" + "".join("\t".join(r) + "\n" for r in rows)
+    ndjson = "".join(
+        json.dumps({"title": t, "artist": a, "download_url": u}) + "\n"
+        for t, a, u in rows
+    )
+    return {url.TEMPLATE: template, url.TSV: tsv, url.NDJSON: ndjson}
+
+
+def legacy_lines(text):
+    for line in io.StringIO(text):
+        parsed_line = shlex.split(line, comments=True)
+        if parsed_line:
+            title, artist, download_url = parsed_line
+            yield {"title": title, "artist": artist, "url": download_url or None}
+
+
+def legacy_set(con, text):
+    with con:
+        con.executemany(LEGACY_SET_URL, legacy_lines(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, nargs="+", default=[100_000])
+    args = parser.parse_args()
+
+    for n in args.n:
+        files = make_files(n)
+        print(f"{n} lines")
+        with tempfile.TemporaryDirectory() as tmp:
+            database = os.path.join(tmp, "library.db")
+            populate(database, n)
+            with connection(database) as con:
+                start = time.perf_counter()
+                legacy_set(con, files[url.TEMPLATE])
+                elapsed = time.perf_counter() - start
+                print(f"  {'legacy (template)':18} {elapsed:7.2f} s {n / elapsed:9.0f} lines/s")
+                for format, text in files.items():
+                    start = time.perf_counter()
+                    result = url.set_urls(con, io.StringIO(text), format)
+                    elapsed = time.perf_counter() - start
+                    print(
+                        f"  {format:18} {elapsed:7.2f} s {n / elapsed:9.0f} lines/s"
+                        f"  ({result.updated} updated, {len(result.unmatched)} unmatched)"
+                    )
+
+
+if __name__ == "__main__":
+    main()
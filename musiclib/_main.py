@@ -1,46 +1,267 @@
 import argparse
-import pkg_resources
 import logging
+import os
+import sys
 
-from .operations import init as op_init
-from .operations import add as op_add
-from .operations import list as op_list
-from .operations import remove as op_remove
-from .operations import url as op_url
+# Operations are imported by the commands that use them, so that a command
+# does not pay for the dependencies of the others (e.g. eyed3) at startup.
+# Only light modules are imported here.
+from .operations._db import DEFAULT_BATCH_SIZE
+from .operations._pool import IO_JOBS
+from .operations._progress import Progress
 
 from .exceptions import CommandError, UnexpectedValueError, RequiresYtdlError
 
+# `operations.url.FORMATS`, without importing it
+URL_FILE_FORMATS = ("template", "tsv", "ndjson")
 
-def not_implemented(parser, args):
-    parser.error("not yet implemented\n")
+
+def request(args, op, **op_args):
+    """Send a request to the daemon (see `serve`) and return its result."""
+    from .operations.serve import Client
+
+    with Client(args.socket) as client:
+        return client.request(op, **op_args)
+
+
+def request_songs(args, op, **op_args):
+    from .operations._types import Song
+
+    return [Song(**song) for song in request(args, op, **op_args)]
 
 
 def init(parser, args):
-    op_init.init(args.database, args.force)
+    from .operations import init as op_init
+
+    op_init.init(args.database, args.force, args.upgrade, args.change_log)
 
 
 def add(parser, args):
-    op_add.add(args.database, *args.music_files, warn_duplicates=args.warn_duplicates)
+    from .operations import add as op_add
+
+    if not args.music_files and args.from_file is None:
+        parser.error("no music files given")
+    if args.socket:
+        files = list(args.music_files)
+        if args.from_file is not None:
+            files.extend(op_add.read_file_list(args.from_file))
+        stats = request(
+            args,
+            "add",
+            files=[os.path.abspath(f) for f in files],
+            warn_duplicates=args.warn_duplicates,
+            use_cache=args.use_cache,
+            extensions=args.extensions,
+            audio_hash=args.audio_hash,
+        )
+        print_add_stats(stats["total"], stats["cached"], stats.get("unreadable", 0))
+        return
+    progress = Progress(unit="files")
+    stats = op_add.add(
+        args.database,
+        *args.music_files,
+        warn_duplicates=args.warn_duplicates,
+        jobs=args.jobs,
+        use_cache=args.use_cache,
+        from_file=args.from_file,
+        extensions=args.extensions,
+        batch_size=args.batch_size,
+        progress=progress,
+        audio_hash=args.audio_hash,
+    )
+    progress.close()
+    print_add_stats(stats.total, stats.cached, stats.unreadable)
+
+
+def print_add_stats(total: int, cached: int, unreadable: int):
+    message = f"processed {total} files, {cached} unchanged (cache hits)"
+    if unreadable:
+        message += f", {unreadable} skipped (unreadable)"
+    print(message, file=sys.stderr)
 
 
 def do_list(parser, args):
-    song_list = op_list.do_list(args.database, not args.json)
+    from .operations import list as op_list
+
+    try:
+        sort = op_list.parse_sort(args.sort) if args.sort else op_list.DEFAULT_SORT
+    except ValueError as err:
+        parser.error(str(err))
+    query = op_list.Query(
+        title=args.title,
+        artist=args.artist,
+        album=args.album,
+        has_url=args.has_url,
+        sort=sort,
+        limit=args.limit,
+        offset=args.offset,
+    )
+    if args.socket:
+        songs = request_songs(
+            args,
+            "list",
+            title=query.title,
+            artist=query.artist,
+            album=query.album,
+            has_url=query.has_url,
+            sort=",".join(query.sort),
+            limit=query.limit,
+            offset=query.offset,
+        )
+    else:
+        songs = op_list.iter_songs(args.database, query)
     if args.json:
-        print(op_list.to_json(song_list, args.compact))
+        op_list.write_json(songs, sys.stdout, args.compact)
+        sys.stdout.write("\n")
+    elif args.ndjson:
+        op_list.write_ndjson(songs, sys.stdout)
+    elif not args.align:
+        op_list.format_list_unaligned(songs)
     else:
-        op_list.format_list(song_list)
+        op_list.format_list(op_list.collect(songs, columnar=True))
+
+
+def search(parser, args):
+    from .operations import list as op_list
+    from .operations import search as op_search
+
+    if args.rebuild:
+        op_search.rebuild(args.database)
+    if not args.query:
+        if not args.rebuild:
+            parser.error("no search query given")
+        return
+    text = " ".join(args.query)
+    if args.socket:
+        songs = request_songs(args, "search", text=text, limit=args.limit, raw=args.raw)
+    else:
+        songs = op_search.search(args.database, text, limit=args.limit, raw=args.raw)
+    if args.json:
+        op_list.write_json(songs, sys.stdout, args.compact)
+        sys.stdout.write("\n")
+    elif args.ndjson:
+        op_list.write_ndjson(songs, sys.stdout)
+    else:
+        op_list.format_list(op_list.collect(songs, columnar=True))
 
 
 def remove(parser, args):
-    op_remove.remove(args.database, *args.music_files, warn_missing=args.warn_missing)
+    from .operations import remove as op_remove
+
+    op_remove.remove(
+        args.database,
+        *args.music_files,
+        warn_missing=args.warn_missing,
+        jobs=args.jobs
+    )
+
+
+def purge(parser, args):
+    from .operations import purge as op_purge
+
+    progress = Progress(unit="files")
+    missing = op_purge.purge(
+        args.database,
+        jobs=args.jobs,
+        dry_run=args.dry_run,
+        force=args.force,
+        progress=progress,
+    )
+    progress.close()
+    action = "would remove" if args.dry_run else "removed"
+    for song in missing:
+        print(f'{action}: "{song.title}" from "{song.artist}" ({song.path})')
+    print(f"{action} {len(missing)} missing songs", file=sys.stderr)
+
+
+def dupes(parser, args):
+    from .operations import dupes as op_dupes
+
+    groups = 0
+    for group in op_dupes.find_duplicates(args.database):
+        if groups:
+            print()
+        groups += 1
+        print(group[0].audio_hash)
+        for f in group:
+            print(f'  {f.path}: "{f.title}" from "{f.artist}"')
+    print(f"found {groups} groups of files with the same audio", file=sys.stderr)
+
+
+def retag(parser, args):
+    from .operations import retag as op_retag
+
+    progress = Progress(unit="files")
+    outcomes = op_retag.retag(args.database, jobs=args.jobs, progress=progress)
+    progress.close()
+    print(
+        f"{outcomes[op_retag.IN_PLACE]} tagged in place,"
+        f" {outcomes[op_retag.REWRITTEN]} rewritten,"
+        f" {outcomes[op_retag.UNCHANGED]} unchanged,"
+        f" {outcomes[op_retag.FAILED]} failed",
+        file=sys.stderr,
+    )
+
+
+def interrupt_on_sigterm():
+    """Make SIGTERM raise KeyboardInterrupt, so that long-running commands
+    stop as cleanly when terminated as when interrupted."""
+    import signal
+
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, interrupt)
+
+
+def watch(parser, args):
+    from .operations import watch as op_watch
+
+    interrupt_on_sigterm()
+    op_watch.watch(
+        args.database,
+        *args.directories,
+        extensions=args.extensions,
+        poll=args.poll,
+        delay=args.delay,
+        jobs=args.jobs,
+        warn_duplicates=args.warn_duplicates,
+        audio_hash=args.audio_hash,
+        progress=Progress(unit="files"),
+    )
+
+
+def merge(parser, args):
+    from .operations import merge as op_merge
+
+    result = op_merge.merge(
+        args.database, args.other, prefer=args.prefer, incremental=args.incremental
+    )
+    print(
+        f"{result.songs} {'changed ' if result.incremental else ''}songs read:"
+        f" {result.added} added, {result.updated} URLs updated,"
+        f" {result.conflicting} conflicting",
+        file=sys.stderr,
+    )
+
+
+def serve(parser, args):
+    from .operations import serve as op_serve
+
+    interrupt_on_sigterm()
+    op_serve.serve(args.database, args.socket or f"{args.database}.sock")
 
 
 def url(parser, args):
+    from .operations import url as op_url
+
     if 'url_mode' not in args:
         parser.print_usage()
         parser.exit(1)
     elif args.url_mode == 'get':
-        if args.format == 'youtube-dl':
+        if args.socket:
+            args.dest.write(request(args, 'url.get', format=args.format))
+        elif args.format == 'youtube-dl':
             op_url.get_ytdl(args.database, args.dest)
         elif args.format == 'raw':
             op_url.get_raw(args.database, args.dest)
@@ -48,22 +269,140 @@ def url(parser, args):
             raise UnexpectedValueError('format', args.format, args)
     elif args.url_mode == 'set':
         try:
-            op_url.set_from_file(args.database, args.url_file)
+            if args.socket:
+                result = request(
+                    args, 'url.set', text=args.url_file.read(), format=args.format
+                )
+                result = op_url.ImportResult(
+                    result['lines'],
+                    result['updated'],
+                    [op_url.LineRef(*r) for r in result['unmatched']],
+                    [op_url.LineRef(*r) for r in result['conflicting']],
+                )
+            else:
+                result = op_url.set_from_file(args.database, args.url_file, args.format)
         except op_url.MalformedFile as err:
             parser.error(f'failed to parse file: {err}')
+        op_url.report_import(result)
+        print(
+            f"{result.lines} lines: {result.updated} songs updated,"
+            f" {len(result.unmatched)} unmatched, {len(result.conflicting)} conflicting",
+            file=sys.stderr,
+        )
     elif args.url_mode == 'template':
-        op_url.template(args.database, args.template_file)
+        op_url.template(args.database, args.template_file, args.align, args.format)
     elif args.url_mode == 'download':
-        op_url.download.do_download(args.database)
+        from .operations.url import download as op_download
+
+        try:
+            op_download.resolve_layout(args.layout)
+        except ValueError as err:
+            parser.error(str(err))
+        op_download.do_download(
+            args.database,
+            jobs=args.jobs,
+            only_missing=args.only_missing,
+            force=args.force,
+            retries=args.retries,
+            output_dir=args.output_dir,
+            layout=args.layout,
+        )
     else:
         raise UnexpectedValueError('url_mode', args.url_mode, args)
 
 
+def int_at_least(minimum: int):
+    """An argparse type for integers of at least `minimum`."""
+
+    def convert(text: str) -> int:
+        try:
+            value = int(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid int value: {text!r}")
+        if value < minimum:
+            raise argparse.ArgumentTypeError(
+                f"must be at least {minimum}, not {value}"
+            )
+        return value
+
+    return convert
+
+
+positive_int = int_at_least(1)
+non_negative_int = int_at_least(0)
+
+
+def add_jobs_argument(parser, task="read metadata", default=1):
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=default,
+        type=non_negative_int,
+        metavar="N",
+        help=f"{task} using N parallel workers (0: one per CPU). Default: {default}",
+    )
+
+
+def get_version():
+    try:
+        from importlib.metadata import version
+    except ImportError:  # Python < 3.8
+        import pkg_resources
+
+        return pkg_resources.require("musiclib")[0].version
+    return version("musiclib")
+
+
+class VersionAction(argparse.Action):
+    """Like the "version" action, but the version is only looked up (which
+    is slow) when the option is used."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, **kwargs):
+        super().__init__(option_strings, dest, nargs=0, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(f"{parser.prog} {get_version()}")
+        parser.exit()
+
+
+def run(parser, args):
+    """Run the command, with the --stats and --profile of `args`."""
+    collecting = args.stats or args.stats_json
+    if not collecting and not args.profile:
+        args.func(parser, args)
+        return
+    import contextlib
+
+    with contextlib.ExitStack() as stack:
+        if collecting:
+            from .operations._stats import collect
+
+            stats = stack.enter_context(collect())
+        if args.profile:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            stack.callback(profiler.dump_stats, args.profile)
+            stack.callback(profiler.disable)
+            profiler.enable()
+        args.func(parser, args)
+    if args.stats:
+        print(stats.format(), file=sys.stderr)
+    if args.stats_json:
+        import json
+
+        with open(args.stats_json, "w") as f:
+            json.dump(stats.as_dict(), f, indent=2)
+            f.write("\n")
+
+
 def main():
-    version = pkg_resources.require("musiclib")[0].version
     parser = argparse.ArgumentParser(description="Music library organizer")
     parser.add_argument(
-        "-V", "--version", action="version", version=f"%(prog)s {version}"
+        "-V",
+        "--version",
+        action=VersionAction,
+        help="show program's version number and exit",
     )
     parser.add_argument(
         "-d",
@@ -72,6 +411,32 @@ def main():
         type=str,
         help="specify database file. Default: library.db",
     )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        metavar="PATH",
+        default=os.environ.get("MUSICLIB_SOCKET"),
+        help="send list, search, add and url get/set to the daemon listening"
+        " on PATH (see serve) instead of opening the database."
+        " Default: $MUSICLIB_SOCKET",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print the time spent in every stage of the command (reading tags,"
+        " database statements, downloads...) once it is done",
+    )
+    parser.add_argument(
+        "--stats-json",
+        metavar="FILE",
+        help="write the time spent in every stage to FILE, as JSON",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="profile the command with cProfile and write the profile to FILE"
+        " (to be read with pstats)",
+    )
     subparsers = parser.add_subparsers(title="commands")
 
     init_parser = subparsers.add_parser("init", help="initialize library database")
@@ -83,6 +448,21 @@ def main():
         action="store_true",
         help="erase the database if it exists",
     )
+    init_parser.add_argument(
+        "-u",
+        "--upgrade",
+        default=False,
+        action="store_true",
+        help="if the database exists, update it to the current version"
+        " (keeping its contents)",
+    )
+    init_parser.add_argument(
+        "--change-log",
+        default=False,
+        action="store_true",
+        help="log the songs changed from now on, so that other libraries can"
+        " merge --incremental from this one",
+    )
 
     add_parser = subparsers.add_parser(
         "add", aliases=["+"], help="add a song to the library database"
@@ -97,22 +477,161 @@ def main():
         help="do not check duplicates (they will be silently ignored)",
     )
     add_parser.add_argument(
-        "music_files", metavar="MUSIC-FILE", nargs="+", help="music file to be added"
+        "--rescan",
+        dest="use_cache",
+        default=True,
+        action="store_false",
+        help="read the metadata of every file, even if it has not changed",
+    )
+    add_jobs_argument(add_parser)
+    add_parser.add_argument(
+        "--hash",
+        dest="audio_hash",
+        default=False,
+        action="store_true",
+        help="also hash the audio data of every file (excluding its tags),"
+        " to find copies with the dupes command",
+    )
+    add_parser.add_argument(
+        "--batch-size",
+        default=DEFAULT_BATCH_SIZE,
+        type=positive_int,
+        metavar="N",
+        help="commit every N files, so an interrupted run keeps the files"
+        f" added so far. Default: {DEFAULT_BATCH_SIZE}",
+    )
+    add_parser.add_argument(
+        "--from-file",
+        metavar="FILE",
+        type=argparse.FileType("r"),
+        help="also add the files or directories listed in FILE, one per line"
+        " (- for standard input)",
+    )
+    add_parser.add_argument(
+        "--ext",
+        dest="extensions",
+        metavar="EXT",
+        action="append",
+        help="only add files with this extension when walking directories."
+        " Can be repeated. Default: mp3",
+    )
+    add_parser.add_argument(
+        "music_files",
+        metavar="MUSIC-FILE",
+        nargs="*",
+        help="music file to be added, or directory to be added recursively",
     )
 
     list_parser = subparsers.add_parser(
         "list", aliases=["ls"], help="list all songs from the database"
     )
     list_parser.set_defaults(func=do_list, parser=list_parser)
-    list_parser.add_argument(
+    list_format_group = list_parser.add_mutually_exclusive_group()
+    list_format_group.add_argument(
         "--json", default=False, action="store_true", help="output as JSON"
     )
+    list_format_group.add_argument(
+        "--ndjson",
+        default=False,
+        action="store_true",
+        help="output as newline-delimited JSON, one song per line",
+    )
     list_parser.add_argument(
+        "--no-align",
+        dest="align",
+        default=True,
+        action="store_false",
+        help="do not pad the table columns, so songs are printed as they are read",
+    )
+    list_parser.add_argument(
+        "--compact",
+        default=False,
+        action="store_true",
+        help="output a compact representation. Only significant with JSON output",
+    )
+    list_filter_group = list_parser.add_argument_group(
+        "filters",
+        "TEXT matches values starting with it, or the whole value as a glob"
+        " pattern if it contains any of *?[ (case-sensitive)",
+    )
+    for field in ("title", "artist", "album"):
+        list_filter_group.add_argument(
+            f"--{field}", metavar="TEXT", help=f"only list songs with this {field}"
+        )
+    list_url_group = list_filter_group.add_mutually_exclusive_group()
+    list_url_group.add_argument(
+        "--has-url",
+        dest="has_url",
+        default=None,
+        action="store_true",
+        help="only list songs with a download URL",
+    )
+    list_url_group.add_argument(
+        "--no-url",
+        dest="has_url",
+        default=None,
+        action="store_false",
+        help="only list songs without a download URL",
+    )
+    list_filter_group.add_argument(
+        "--sort",
+        metavar="KEYS",
+        help="comma-separated sort keys (title, artist, album, download_url),"
+        " prefixed with ~ for descending order (or -, as in --sort=-title)."
+        " Default: title,artist",
+    )
+    list_filter_group.add_argument(
+        "--limit", type=positive_int, metavar="N", help="list at most N songs"
+    )
+    list_filter_group.add_argument(
+        "--offset",
+        type=non_negative_int,
+        default=0,
+        metavar="N",
+        help="skip the first N songs",
+    )
+
+    search_parser = subparsers.add_parser(
+        "search", aliases=["s"], help="search songs by words in their title, artist or album"
+    )
+    search_parser.set_defaults(func=search, parser=search_parser)
+    search_format_group = search_parser.add_mutually_exclusive_group()
+    search_format_group.add_argument(
+        "--json", default=False, action="store_true", help="output as JSON"
+    )
+    search_format_group.add_argument(
+        "--ndjson",
+        default=False,
+        action="store_true",
+        help="output as newline-delimited JSON, one song per line",
+    )
+    search_parser.add_argument(
         "--compact",
         default=False,
         action="store_true",
         help="output a compact representation. Only significant with JSON output",
     )
+    search_parser.add_argument(
+        "--limit", type=positive_int, metavar="N", help="show at most N songs"
+    )
+    search_parser.add_argument(
+        "--raw",
+        default=False,
+        action="store_true",
+        help="use QUERY as an SQLite FTS5 query as is",
+    )
+    search_parser.add_argument(
+        "--rebuild",
+        default=False,
+        action="store_true",
+        help="rebuild the search index first, from the songs of the library",
+    )
+    search_parser.add_argument(
+        "query",
+        metavar="QUERY",
+        nargs="*",
+        help="words the songs must contain. Partial words match their beginning",
+    )
 
     remove_parser = subparsers.add_parser(
         "remove", aliases=["rm", "del"], help="remove a song from the database"
@@ -126,6 +645,7 @@ def main():
         action="store_false",
         help="do not warn about files not in the database"
     )
+    add_jobs_argument(remove_parser)
     remove_parser.add_argument(
         "music_files", metavar="MUSIC-FILE", nargs="+", help="music file to be removed (the disk file will not be deleted)"
     )
@@ -133,7 +653,109 @@ def main():
     purge_parser = subparsers.add_parser(
         "purge", help="remove all missing songs from the database"
     )
-    purge_parser.set_defaults(func=not_implemented, parser=purge_parser)
+    purge_parser.set_defaults(func=purge, parser=purge_parser)
+    purge_parser.add_argument(
+        "-n",
+        "--dry-run",
+        default=False,
+        action="store_true",
+        help="only print the songs that would be removed",
+    )
+    purge_parser.add_argument(
+        "-f",
+        "--force",
+        default=False,
+        action="store_true",
+        help="remove the songs even if all the files are missing",
+    )
+    add_jobs_argument(purge_parser, task="check files", default=IO_JOBS)
+
+    dupes_parser = subparsers.add_parser(
+        "dupes", help="list files with the same audio data (see add --hash)"
+    )
+    dupes_parser.set_defaults(func=dupes, parser=dupes_parser)
+
+    retag_parser = subparsers.add_parser(
+        "retag", help="write the metadata in the database to the music files"
+    )
+    retag_parser.set_defaults(func=retag, parser=retag_parser)
+    add_jobs_argument(retag_parser, task="write tags")
+
+    watch_parser = subparsers.add_parser(
+        "watch", help="keep the library in sync with directories as files change"
+    )
+    watch_parser.set_defaults(func=watch, parser=watch_parser)
+    watch_parser.add_argument(
+        "--poll",
+        type=float,
+        metavar="SECONDS",
+        help="look for changes every SECONDS instead of using inotify"
+        " (e.g. on network filesystems)",
+    )
+    watch_parser.add_argument(
+        "--delay",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="apply changes once there has been none for SECONDS. Default: 1",
+    )
+    watch_parser.add_argument(
+        "-Wd",
+        "--no-warn-duplicates",
+        dest="warn_duplicates",
+        default=True,
+        action="store_false",
+        help="do not check duplicates (they will be silently ignored)",
+    )
+    watch_parser.add_argument(
+        "--hash",
+        dest="audio_hash",
+        default=False,
+        action="store_true",
+        help="also hash the audio data of every file (see add --hash)",
+    )
+    watch_parser.add_argument(
+        "--ext",
+        dest="extensions",
+        metavar="EXT",
+        action="append",
+        help="only watch files with this extension. Can be repeated. Default: mp3",
+    )
+    add_jobs_argument(watch_parser)
+    watch_parser.add_argument(
+        "directories", metavar="DIR", nargs="+", help="directory to watch"
+    )
+
+    merge_parser = subparsers.add_parser(
+        "merge", help="add the songs of another library database to this one"
+    )
+    merge_parser.set_defaults(func=merge, parser=merge_parser)
+    merge_parser.add_argument(
+        "--prefer",
+        # `operations.merge.RULES`, without importing it
+        choices=("keep", "newer"),
+        default="keep",
+        help="for songs in both libraries with different download URLs, keep"
+        " the URL of this one, or take the one set most recently. Songs"
+        " without a URL always take the other one. Default: keep",
+    )
+    merge_parser.add_argument(
+        "--incremental",
+        default=False,
+        action="store_true",
+        help="only read the songs changed since the last merge from OTHER,"
+        " which needs a change log (see init --change-log)",
+    )
+    merge_parser.add_argument(
+        "other", metavar="OTHER", help="library database to merge from"
+    )
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="answer requests (JSON lines) on a Unix socket, keeping the database"
+        " open. The socket is --socket, or the database path followed by .sock",
+    )
+    serve_parser.set_defaults(func=serve, parser=serve_parser)
 
     url_parser = subparsers.add_parser("url", help="manage URLs")
     url_parser.set_defaults(func=url, parser=url_parser, do_mapping=True)
@@ -151,15 +773,40 @@ def main():
     url_set_parser.set_defaults(url_mode='set')
     url_set_parser.add_argument('url_file', nargs='?', type=argparse.FileType('r'), default='-',
         help='read URLs from this file. Standard input by default')
+    url_set_parser.add_argument('--format', '-f', choices=URL_FILE_FORMATS, default='template',
+        help="format of the file: template (the default), tsv (title, artist and URL"
+        " separated by tabs) or ndjson (objects with a title, artist and download_url"
+        " per line, like the output of `list --ndjson`)")
 
     url_template_parser = url_subparsers.add_parser('template', aliases=['tpl'],
         help="write a template of URLs to be filled and passed to `set`")
     url_template_parser.set_defaults(url_mode='template')
     url_template_parser.add_argument('template_file', nargs='?', type=argparse.FileType('w'), default='-')
+    url_template_parser.add_argument('--no-align', dest='align', default=True, action='store_false',
+        help="do not pad the columns, so lines are written as they are read")
+    url_template_parser.add_argument('--format', '-f', choices=URL_FILE_FORMATS, default='template',
+        help="write a template (the default), tsv or ndjson file, see `set`")
 
     url_download_parser = url_subparsers.add_parser('download', aliases=['dl'],
         help="download all URLs and apply the metadata")
     url_download_parser.set_defaults(url_mode='download')
+    add_jobs_argument(url_download_parser, task="download")
+    url_download_group = url_download_parser.add_mutually_exclusive_group()
+    url_download_group.add_argument('--only-missing', default=False, action='store_true',
+        help="only download songs that have not been downloaded yet; do not retry"
+        " failed downloads")
+    url_download_group.add_argument('--force', '-f', default=False, action='store_true',
+        help="download every song again, even if it was already downloaded")
+    url_download_parser.add_argument('--retries', default=2, type=non_negative_int, metavar='N',
+        help="retry a failed download N times before giving up on it. Default: 2")
+    url_download_parser.add_argument('--output-dir', '-o', metavar='DIR',
+        help="write the files under DIR. Default: the working directory")
+    url_download_parser.add_argument('--layout', default='flat', metavar='LAYOUT',
+        help="where to write every file under the output directory: 'flat'"
+        " (TITLE-ID.EXT, from the video), 'artist' (ARTIST/TITLE.EXT),"
+        " 'album' (ARTIST/ALBUM/TITLE.EXT), or a youtube-dl output template"
+        " which may also use the {title}, {artist} and {album} of the library."
+        " Default: flat")
 
     args = parser.parse_args()
     try:
@@ -170,8 +817,13 @@ def main():
         p.print_usage()
         parser.exit(1)
     try:
-        args.func(p, args)
+        run(p, args)
     except CommandError as ce:
         p.error(ce)
     except RequiresYtdlError:
         p.error("this feature requires youtube-dl. Please install musiclib[download]")
+    except BrokenPipeError:
+        # Output is streamed, so the reader (e.g. `head`) may go away early
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
@@ -4,6 +4,10 @@ class CommandError(Exception):
 class RequiresYtdlError(Exception):
     pass
 
+class MetadataError(CommandError):
+    """A music file without the tags needed to identify its song."""
+    pass
+
 class UnexpectedValueError(Exception):
     def __init__(self, variable, value, context=None):
         if context:
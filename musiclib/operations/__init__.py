@@ -1 +1 @@
-__all__ = ["init", "add", "list", "url", "remove"]
+__all__ = ["init", "add", "list", "url", "remove", "search", "purge", "dupes", "retag", "serve", "watch", "merge"]
@@ -0,0 +1,64 @@
+"""Database connections shared by all operations."""
+import sqlite3
+import logging
+import contextlib
+from typing import Iterator
+from ..exceptions import CommandError
+
+# Upserts (INSERT ... ON CONFLICT DO UPDATE) need SQLite 3.24. Newer
+# features are only used when available (see `url set`).
+MIN_SQLITE_VERSION = (3, 24, 0)
+
+# Seconds to wait for a lock held by another process before failing
+BUSY_TIMEOUT = 30.0
+
+# Write-ahead logging lets readers (e.g. `list`) run next to a writer (e.g.
+# `add`) without blocking each other, and with `synchronous = NORMAL` commits
+# do not wait for an fsync. WAL needs shared memory, so it does not work with
+# databases on network filesystems; set JOURNAL_MODE to "DELETE" for those.
+JOURNAL_MODE = "WAL"
+
+# Rows written per transaction by bulk operations (e.g. `add`)
+DEFAULT_BATCH_SIZE = 50000
+
+PRAGMAS = (
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA cache_size = -65536;",  # 64 MiB
+    "PRAGMA mmap_size = 268435456;",  # 256 MiB
+    "PRAGMA temp_store = MEMORY;",
+)
+
+
+def connect(database: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    """Open `database` with the settings used by every operation.
+
+    The caller must close it; prefer `connection`. Without
+    `check_same_thread`, it can be used from several threads, one at a time.
+    """
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise CommandError(
+            f"SQLite {sqlite3.sqlite_version} is too old: musiclib needs"
+            f" {'.'.join(map(str, MIN_SQLITE_VERSION))} or later"
+        )
+    con = sqlite3.connect(
+        database, timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread
+    )
+    try:
+        con.execute(f"PRAGMA journal_mode = {JOURNAL_MODE};")
+    except sqlite3.OperationalError as err:
+        # E.g. a read-only database; it is still usable
+        logging.debug("cannot set journal mode: %s", err)
+    for pragma in PRAGMAS:
+        con.execute(pragma)
+    return con
+
+
+@contextlib.contextmanager
+def connection(database: str) -> Iterator[sqlite3.Connection]:
+    """Context manager that opens `database` (see `connect`) and always
+    closes it. It does not commit: use `with con:` for transactions."""
+    con = connect(database)
+    try:
+        yield con
+    finally:
+        con.close()
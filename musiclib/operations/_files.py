@@ -0,0 +1,101 @@
+import os
+import logging
+from typing import Iterable, Iterator, Optional, Set, TextIO, Tuple
+
+DEFAULT_EXTENSIONS = (".mp3",)
+
+
+def normalize_extensions(extensions: Optional[Iterable[str]]) -> Tuple[str, ...]:
+    """Lowercase `extensions` and make sure they start with a dot."""
+    if not extensions:
+        return DEFAULT_EXTENSIONS
+    return tuple(
+        ext.lower() if ext.startswith(".") else f".{ext.lower()}" for ext in extensions
+    )
+
+
+def read_file_list(file: TextIO) -> Iterator[str]:
+    """Yield the paths in `file`, one per line. Blank lines are ignored."""
+    for line in file:
+        path = line.rstrip("\r\n")
+        if path:
+            yield path
+
+
+def walk(
+    top: str,
+    extensions: Tuple[str, ...] = DEFAULT_EXTENSIONS,
+    visited: Optional[Set[Tuple[int, int]]] = None,
+) -> Iterator[str]:
+    """Recursively yield the files under `top` whose extension is in `extensions`.
+
+    Directories are read with `os.scandir` as the walk goes, so the first file
+    is yielded right away. Directories whose `(device, inode)` is in `visited`
+    are skipped, and every directory walked is added to it. Symbolic links to
+    directories are not followed.
+    """
+    if visited is None:
+        visited = set()
+    stack = [top]
+    while stack:
+        directory = stack.pop()
+        try:
+            st = os.stat(directory)
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            with os.scandir(directory) as it:
+                subdirs = []
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in extensions:
+                        yield entry.path
+        except OSError as err:
+            logging.warning("cannot read directory %s: %s", directory, err)
+            continue
+        stack.extend(reversed(subdirs))
+
+
+def iter_music_files(
+    paths: Iterable[str], extensions: Optional[Iterable[str]] = None
+) -> Iterator[str]:
+    """Expand `paths` lazily: directories are walked, files are yielded as is.
+
+    Duplicates are dropped (and reported) as they are found, including files
+    given both directly and through a directory. Only the given files and the
+    directories walked are remembered, not every file found inside them, so
+    memory does not grow with the size of the trees.
+    """
+    extensions = normalize_extensions(extensions)
+    visited_dirs: Set[Tuple[int, int]] = set()
+    seen_files: Set[str] = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for found in walk(path, extensions, visited_dirs):
+                if seen_files and os.path.abspath(found) in seen_files:
+                    logging.warning(
+                        "found and ignored duplicate in files list: %s", found
+                    )
+                    continue
+                yield found
+        else:
+            key = os.path.abspath(path)
+            if key in seen_files or _in_walked_dir(key, extensions, visited_dirs):
+                logging.warning("found and ignored duplicate in files list: %s", path)
+                continue
+            seen_files.add(key)
+            yield path
+
+
+def _in_walked_dir(
+    path: str, extensions: Tuple[str, ...], visited_dirs: Set[Tuple[int, int]]
+) -> bool:
+    """Whether `walk` already yielded `path`, from one of `visited_dirs`."""
+    if not visited_dirs or os.path.splitext(path)[1].lower() not in extensions:
+        return False
+    try:
+        st = os.stat(os.path.dirname(path))
+    except OSError:
+        return False
+    return (st.st_dev, st.st_ino) in visited_dirs
@@ -0,0 +1,280 @@
+"""Minimal ID3 reader for the title, artist and album of a file.
+
+It only reads the ID3v2 header and frame headers, seeking over frames that are
+not needed, or the 128 bytes of an ID3v1 tag. Anything it does not fully
+understand (unsynchronisation, compressed or encrypted frames, bad encodings)
+makes it give up, so that the caller can fall back to eyed3.
+
+It can also hash the audio data of the file (everything but the ID3 tags)
+while it has it open, so that copies of the same audio can be found whatever
+their tags, and rewrite the text frames of an ID3v2.3/2.4 tag in place, when
+they fit in it.
+"""
+import hashlib
+import struct
+from typing import BinaryIO, Dict, Optional, Tuple
+from ._types import Song
+
+ID3V2_HEADER = struct.Struct(">3sBBB4s")
+ID3V1_SIZE = 128
+ID3V1_STRIP_CHARS = b" \t\n\r\x0b\x0c\x00"
+
+# Frame IDs by ID3v2 major version
+FRAME_IDS = {
+    2: {b"TT2": "title", b"TP1": "artist", b"TAL": "album"},
+    3: {b"TIT2": "title", b"TPE1": "artist", b"TALB": "album"},
+    4: {b"TIT2": "title", b"TPE1": "artist", b"TALB": "album"},
+}
+
+TEXT_ENCODINGS = {0: "latin_1", 1: "utf_16", 2: "utf_16_be", 3: "utf_8"}
+
+# Tag header flags
+FLAG_UNSYNC = 0x80
+FLAG_EXTENDED = 0x40
+FLAG_FOOTER = 0x10
+
+# The audio data is hashed in blocks of this size, so memory use does not
+# depend on the size of the file
+HASH_BLOCK_SIZE = 1 << 20
+HASH_DIGEST_SIZE = 16
+
+
+class UnsupportedTag(Exception):
+    pass
+
+
+def _syncsafe(data: bytes) -> int:
+    if any(b & 0x80 for b in data):
+        raise UnsupportedTag("invalid syncsafe integer")
+    size = 0
+    for b in data:
+        size = (size << 7) | b
+    return size
+
+
+def _decode_text(data: bytes) -> str:
+    if not data:
+        raise UnsupportedTag("empty text frame")
+    codec = TEXT_ENCODINGS.get(data[0])
+    if codec is None:
+        raise UnsupportedTag("unknown text encoding")
+    text = data[1:]
+    if codec.startswith("utf_16") and len(text) % 2 and text[-1:] == b"\x00":
+        text = text[:-1]
+    try:
+        decoded = str(text, codec).rstrip("\x00")
+    except UnicodeDecodeError as err:
+        raise UnsupportedTag("undecodable text frame") from err
+    if "\x00" in decoded:
+        raise UnsupportedTag("multiple values in text frame")
+    return decoded
+
+
+def _tag_size(header: bytes) -> int:
+    """Size of the ID3v2 tag starting with `header`, footer included."""
+    _, major, _, flags, size = ID3V2_HEADER.unpack(header)
+    footer = ID3V2_HEADER.size if major == 4 and flags & FLAG_FOOTER else 0
+    return ID3V2_HEADER.size + _syncsafe(size) + footer
+
+
+def _read_v2(fp: BinaryIO, header: bytes) -> Song:
+    ident, major, _, flags, size = ID3V2_HEADER.unpack(header)
+    if major not in FRAME_IDS or flags & FLAG_UNSYNC:
+        raise UnsupportedTag("unsupported ID3v2 version or flags")
+    if major == 2 and flags & FLAG_EXTENDED:
+        raise UnsupportedTag("compressed ID3v2.2 tag")
+    end = ID3V2_HEADER.size + _syncsafe(size)
+    if flags & FLAG_EXTENDED:
+        ext = fp.read(4)
+        if len(ext) != 4:
+            raise UnsupportedTag("truncated extended header")
+        if major == 4:
+            fp.seek(_syncsafe(ext) - 4, 1)
+        else:
+            fp.seek(int.from_bytes(ext, "big"), 1)
+
+    wanted = FRAME_IDS[major]
+    header_size = 6 if major == 2 else 10
+    found: Dict[str, str] = {}
+    while len(found) < len(wanted) and fp.tell() + header_size <= end:
+        frame_header = fp.read(header_size)
+        if len(frame_header) != header_size:
+            raise UnsupportedTag("truncated frame header")
+        if frame_header[0] == 0:
+            break  # Padding
+        if major == 2:
+            fid, frame_size, format_flags = frame_header[:3], frame_header[3:6], 0
+            frame_size = int.from_bytes(frame_size, "big")
+        else:
+            fid, frame_size = frame_header[:4], frame_header[4:8]
+            format_flags = frame_header[9]
+            if major == 4:
+                frame_size = _syncsafe(frame_size)
+            else:
+                frame_size = int.from_bytes(frame_size, "big")
+        if not fid.isalnum() or fp.tell() + frame_size > end:
+            raise UnsupportedTag("malformed frame")
+        field = wanted.get(fid)
+        if field is None or field in found:
+            fp.seek(frame_size, 1)
+            continue
+        if format_flags:
+            raise UnsupportedTag("compressed, encrypted or unsynchronised frame")
+        found[field] = _decode_text(fp.read(frame_size))
+    if "title" not in found or "artist" not in found:
+        raise UnsupportedTag("missing title or artist frame")
+    return Song(title=found["title"], artist=found["artist"], album=found.get("album"))
+
+
+def _read_v1(data: bytes) -> Song:
+    if data[:3] != b"TAG":
+        raise UnsupportedTag("no ID3 tag")
+    title, artist, album = (
+        data[start : start + 30].strip(ID3V1_STRIP_CHARS) for start in (3, 33, 63)
+    )
+    if not title or not artist:
+        raise UnsupportedTag("missing title or artist")
+    return Song(
+        title=str(title, "latin_1"),
+        artist=str(artist, "latin_1"),
+        album=str(album, "latin_1") if album else None,
+    )
+
+
+def _hash_range(fp: BinaryIO, start: int, end: int) -> str:
+    h = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    buf = memoryview(bytearray(HASH_BLOCK_SIZE))
+    fp.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        n = fp.readinto(buf[: min(remaining, HASH_BLOCK_SIZE)])
+        if not n:
+            break
+        h.update(buf[:n])
+        remaining -= n
+    return h.hexdigest()
+
+
+def read_file(
+    file: str, audio_hash: bool = False
+) -> Tuple[Optional[Song], Optional[str]]:
+    """Read the title, artist and album of `file` and, with `audio_hash`,
+    hash its audio data in the same pass.
+
+    The song is None if the tag is missing or cannot be read by this module.
+    The hash is None if not requested, or if the ID3v2 header is invalid (so
+    where the audio starts is unknown). Raises OSError if `file` cannot be read.
+    """
+    song: Optional[Song] = None
+    with open(file, "rb") as fp:
+        header = fp.read(ID3V2_HEADER.size)
+        has_v2 = len(header) == ID3V2_HEADER.size and header[:3] == b"ID3"
+        start: Optional[int] = 0
+        if has_v2:
+            try:
+                start = _tag_size(header)
+            except UnsupportedTag:
+                start = None
+            else:
+                try:
+                    song = _read_v2(fp, header)
+                except (UnsupportedTag, ValueError):
+                    pass
+        if has_v2 and not audio_hash:
+            return song, None
+        size = fp.seek(0, 2)
+        trailer = b""
+        if size >= ID3V1_SIZE:
+            fp.seek(-ID3V1_SIZE, 2)
+            trailer = fp.read(ID3V1_SIZE)
+        has_v1 = trailer[:3] == b"TAG"
+        if not has_v2 and has_v1:
+            try:
+                song = _read_v1(trailer)
+            except UnsupportedTag:
+                pass
+        if not audio_hash or start is None:
+            return song, None
+        end = size - ID3V1_SIZE if has_v1 else size
+        return song, _hash_range(fp, start, max(start, end))
+
+
+def _render_text_frame(fid: bytes, text: str, major: int) -> bytes:
+    try:
+        data = b"\x00" + text.encode("latin_1")
+    except UnicodeEncodeError:
+        if major == 4:
+            data = b"\x03" + text.encode("utf_8")
+        else:
+            data = b"\x01" + text.encode("utf_16")
+    if major == 4:
+        size = bytes((len(data) >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    else:
+        size = len(data).to_bytes(4, "big")
+    return fid + size + b"\x00\x00" + data
+
+
+def _other_frames(data: bytes, major: int) -> bytes:
+    """The raw frames of the tag body `data`, except the ones in FRAME_IDS."""
+    wanted = FRAME_IDS[major]
+    kept = []
+    pos = 0
+    while pos + 10 <= len(data) and data[pos] != 0:
+        fid, frame_size = data[pos : pos + 4], data[pos + 4 : pos + 8]
+        if major == 4:
+            frame_size = _syncsafe(frame_size)
+        else:
+            frame_size = int.from_bytes(frame_size, "big")
+        end = pos + 10 + frame_size
+        if not fid.isalnum() or end > len(data):
+            raise UnsupportedTag("malformed frame")
+        if fid not in wanted:
+            kept.append(data[pos:end])
+        pos = end
+    return b"".join(kept)
+
+
+def write_tags(file: str, song: Song) -> bool:
+    """Write the title, artist and album of `song` to the ID3v2 tag of
+    `file`, in place: the audio data is not moved. Other frames are kept.
+
+    Returns False, without changing the file, if it has no ID3v2.3/2.4 tag
+    that this module can rewrite or if the new frames do not fit in it
+    (padding included). The whole file must then be rewritten, e.g. by eyed3.
+    """
+    with open(file, "r+b") as fp:
+        header = fp.read(ID3V2_HEADER.size)
+        if len(header) != ID3V2_HEADER.size or header[:3] != b"ID3":
+            return False
+        _, major, _, flags, size = ID3V2_HEADER.unpack(header)
+        if major not in (3, 4) or flags & (FLAG_UNSYNC | FLAG_EXTENDED | FLAG_FOOTER):
+            return False
+        try:
+            size = _syncsafe(size)
+            data = fp.read(size)
+            if len(data) != size:
+                return False
+            frames = _other_frames(data, major)
+        except UnsupportedTag:
+            return False
+        ids = {field: fid for fid, field in FRAME_IDS[major].items()}
+        frames += _render_text_frame(ids["title"], song.title, major)
+        frames += _render_text_frame(ids["artist"], song.artist, major)
+        if song.album:
+            frames += _render_text_frame(ids["album"], song.album, major)
+        if len(frames) > size:
+            return False
+        fp.seek(ID3V2_HEADER.size)
+        fp.write(frames.ljust(size, b"\x00"))
+    return True
+
+
+def read_tags(file: str) -> Optional[Song]:
+    """Read the title, artist and album of `file`.
+
+    Returns None if the tag is missing or cannot be read by this module.
+    """
+    try:
+        return read_file(file)[0]
+    except OSError:
+        return None
@@ -1,12 +1,51 @@
-import eyed3
+from typing import Iterable, Iterator, Optional, Tuple
 from ._types import Song
+from ._pool import bounded_map
+from ._id3 import read_file, read_tags
+from ..exceptions import MetadataError
 
 def get_metadata(file: str) -> Song:
+    """Read the tags of `file`. Raises MetadataError if it has no title or
+    artist (e.g. it is not an audio file)."""
+    song = read_tags(file)
+    if song is None:
+        song = get_metadata_eyed3(file)
+    return _checked(file, song)
+
+def get_metadata_and_hash(file: str) -> Tuple[Song, Optional[str]]:
+    """Like `get_metadata`, also returning the hash of the audio data of
+    `file` (see `_id3.read_file`), read in the same pass."""
+    song, audio_hash = read_file(file, audio_hash=True)
+    if song is None:
+        song = get_metadata_eyed3(file)
+    return _checked(file, song), audio_hash
+
+def _checked(file: str, song: Song) -> Song:
+    if song.title is None or song.artist is None:
+        raise MetadataError(f"{file}: no title or artist")
+    return song
+
+def get_metadata_eyed3(file: str) -> Song:
+    import eyed3  # Slow to import, and often not needed (see `read_tags`)
+
     meta = eyed3.load(file)
+    if meta is None or meta.tag is None:
+        raise MetadataError(f"{file}: not an audio file, or without tags")
     return Song(title=meta.tag.title, artist=meta.tag.artist, album=meta.tag.album)
 
+def _get_file_metadata(file: str) -> Tuple[str, Song]:
+    return file, get_metadata(file)
+
+def get_metadata_many(files: Iterable[str], jobs: int = 1) -> Iterator[Tuple[str, Song]]:
+    """Yield `(file, metadata)` for every file, in order, using `jobs` workers."""
+    return bounded_map(_get_file_metadata, files, jobs)
+
 def set_metadata(file: str, metadata: Song):
+    import eyed3
+
     meta = eyed3.load(file)
+    if meta.tag is None:
+        meta.initTag()
     meta.tag.title = metadata.title
     meta.tag.artist = metadata.artist
     meta.tag.album = metadata.album
@@ -0,0 +1,87 @@
+import os
+import collections
+import itertools
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from typing import Callable, Deque, Iterable, Iterator, Set, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Tasks queued per worker. Keeps every worker busy while bounding the number
+# of results held in memory at any time.
+BACKLOG_PER_JOB = 4
+
+# Workers for tasks that mostly wait on the filesystem, e.g. checking files
+# on a network mount: many more than the number of CPUs.
+IO_JOBS = 32
+
+
+def effective_jobs(jobs: int) -> int:
+    """Normalize a `--jobs` value: 0 (or less) means one job per CPU."""
+    if jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def make_executor(jobs: int, threads: bool = False) -> Executor:
+    # Imported here: the process pool pulls in multiprocessing, which is slow
+    # to import and not needed with a single job
+    if threads:
+        from concurrent.futures import ThreadPoolExecutor
+
+        return ThreadPoolExecutor(max_workers=jobs)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        return ProcessPoolExecutor(max_workers=jobs)
+
+
+def bounded_map(
+    func: Callable[[T], R], items: Iterable[T], jobs: int = 1, threads: bool = False
+) -> Iterator[R]:
+    """Like `map(func, items)`, but spread over `jobs` workers.
+
+    Results are yielded in the same order as `items`. `items` is consumed
+    lazily and at most `jobs * BACKLOG_PER_JOB` tasks are in flight, so memory
+    does not grow with the length of `items`.
+    With `jobs == 1` this is exactly the serial `map`.
+    """
+    jobs = effective_jobs(jobs)
+    if jobs == 1:
+        yield from map(func, items)
+        return
+    items = iter(items)
+    with make_executor(jobs, threads) as executor:
+        pending: Deque[Future] = collections.deque(
+            executor.submit(func, item)
+            for item in itertools.islice(items, jobs * BACKLOG_PER_JOB)
+        )
+        while pending:
+            result = pending.popleft().result()
+            for item in itertools.islice(items, 1):
+                pending.append(executor.submit(func, item))
+            yield result
+
+
+def bounded_map_unordered(
+    func: Callable[[T], R], items: Iterable[T], jobs: int = 1, threads: bool = False
+) -> Iterator[R]:
+    """Like `bounded_map`, but results are yielded as soon as they are ready,
+    so a slow item does not hold back the ones after it.
+    """
+    jobs = effective_jobs(jobs)
+    if jobs == 1:
+        yield from map(func, items)
+        return
+    items = iter(items)
+    with make_executor(jobs, threads) as executor:
+        pending: Set[Future] = {
+            executor.submit(func, item)
+            for item in itertools.islice(items, jobs * BACKLOG_PER_JOB)
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for item in itertools.islice(items, len(done)):
+                pending.add(executor.submit(func, item))
+            for future in done:
+                yield future.result()
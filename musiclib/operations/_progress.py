@@ -0,0 +1,96 @@
+import sys
+import time
+import threading
+from typing import Optional, TextIO
+
+
+class Progress:
+    """Aggregated progress and throughput of a long operation.
+
+    On a terminal, a single status line is redrawn (at most every
+    `interval` seconds). Otherwise, one line is printed per item.
+    Safe to update from several threads.
+    """
+
+    def __init__(
+        self,
+        total: Optional[int] = None,
+        unit: str = "files",
+        file: TextIO = sys.stderr,
+        interval: float = 0.2,
+    ):
+        self.total = total
+        self.unit = unit
+        self.file = file
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.nbytes = 0
+        self.start = time.monotonic()
+        self._last_draw = 0.0
+        self._tty = file.isatty()
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def status(self) -> str:
+        elapsed = self.elapsed or 1e-9
+        count = f"{self.done}/{self.total}" if self.total is not None else f"{self.done}"
+        s = f"{count} {self.unit}, {self.done / elapsed:.1f} {self.unit}/s"
+        if self.nbytes:
+            s += f", {self.nbytes / elapsed / 2 ** 20:.2f} MiB/s"
+        if self.failed:
+            s += f", {self.failed} failed"
+        if self.skipped:
+            s += f", {self.skipped} skipped"
+        return s
+
+    def add_bytes(self, nbytes: int) -> None:
+        with self._lock:
+            self.nbytes += nbytes
+
+    def update(
+        self,
+        done: int = 1,
+        failed: int = 0,
+        skipped: int = 0,
+        message: Optional[str] = None,
+    ) -> None:
+        """Count `done` more items, of which `failed` failed and `skipped`
+        needed no work."""
+        with self._lock:
+            self.done += done
+            self.failed += failed
+            self.skipped += skipped
+            if self._tty:
+                now = time.monotonic()
+                if now - self._last_draw >= self.interval:
+                    self._last_draw = now
+                    self.file.write(f"\r\x1b[K{self.status()}")
+                    self.file.flush()
+            elif message is not None:
+                if self.total is not None:
+                    self.file.write(f"{self.done} of {self.total}: {message}\n")
+                else:
+                    self.file.write(f"{self.done}: {message}\n")
+
+    def checkpoint(self, message: str) -> None:
+        """Report the status after a milestone (e.g. a commit). Unlike
+        `update`, it is also printed when the output is not a terminal."""
+        with self._lock:
+            if self._tty:
+                self._last_draw = time.monotonic()
+                self.file.write(f"\r\x1b[K{self.status()} ({message})")
+            else:
+                self.file.write(f"{self.status()} ({message})\n")
+            self.file.flush()
+
+    def close(self) -> None:
+        """Print the final totals."""
+        with self._lock:
+            end = "\r\x1b[K" if self._tty else ""
+            self.file.write(f"{end}{self.status()} in {self.elapsed:.1f} s\n")
+            self.file.flush()
@@ -0,0 +1,194 @@
+"""Time spent in the stages of the operations.
+
+Operations time their stages with `stage` and `timed_iter`, which report to
+the hooks added with `add_hook` (and cost next to nothing when there is
+none). A hook is called with the name of the stage, its duration in
+seconds and the number of items it processed. `Stats` is a hook summing
+them, e.g. to export them as JSON:
+
+    with collect() as stats:
+        add.add(database, "Music")
+    json.dumps(stats.as_dict())
+
+Durations exclude the nested stages (of the same thread): the time spent
+reading tags while inserting the songs that need them is only counted
+once. With several workers, a stage of the workers counts the time of
+every worker, and a stage waiting for them counts the time waited.
+"""
+import contextlib
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# (stage, seconds, items)
+Hook = Callable[[str, float, int], None]
+
+_hooks: List[Hook] = []
+_local = threading.local()
+
+
+def add_hook(hook: Hook) -> None:
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    _hooks.remove(hook)
+
+
+def enabled() -> bool:
+    return bool(_hooks)
+
+
+def record(name: str, seconds: float, items: int = 1) -> None:
+    """Report a stage timed by the caller."""
+    for hook in _hooks:
+        hook(name, seconds, items)
+
+
+def _stack() -> List["stage"]:
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+class stage:
+    """Context manager timing the stage `name`, which processed `items`
+    items (which may be set until it exits)."""
+
+    __slots__ = ("name", "items", "_start", "_nested")
+
+    def __init__(self, name: str, items: int = 1):
+        self.name = name
+        self.items = items
+        self._start: Optional[float] = None
+        self._nested = 0.0
+
+    def __enter__(self) -> "stage":
+        if _hooks:
+            _stack().append(self)
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._start is None:
+            return
+        elapsed = time.perf_counter() - self._start
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1]._nested += elapsed
+        record(self.name, elapsed - self._nested, self.items)
+
+
+def timed_iter(name: str, iterable: Iterable[T]) -> Iterator[T]:
+    """Iterate over `iterable`, timing the stage `name` as the time spent
+    getting the items. It is reported once, when the iteration ends."""
+    if not _hooks:
+        return iter(iterable)
+    return _timed_iter(name, iter(iterable))
+
+
+def _timed_iter(name: str, iterator: Iterator[T]) -> Iterator[T]:
+    frame = stage(name, 0)
+    seconds = 0.0
+    try:
+        while True:
+            stack = _stack()
+            frame._nested = 0.0
+            stack.append(frame)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                if stack:
+                    stack[-1]._nested += elapsed
+                seconds += elapsed - frame._nested
+            frame.items += 1
+            yield item
+    finally:
+        record(name, seconds, frame.items)
+
+
+class StageTotals:
+    __slots__ = ("calls", "seconds", "items")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+
+
+class Stats:
+    """Hook summing the stages, by name, since it was created."""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.stages: Dict[str, StageTotals] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, name: str, seconds: float, items: int) -> None:
+        with self._lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = StageTotals()
+            totals.calls += 1
+            totals.seconds += seconds
+            totals.items += items
+
+    @property
+    def wall_seconds(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def as_dict(self) -> Dict[str, object]:
+        """The totals, as JSON-serializable values."""
+        return {
+            "wall_seconds": self.wall_seconds,
+            "stages": [
+                {
+                    "stage": name,
+                    "calls": t.calls,
+                    "seconds": t.seconds,
+                    "items": t.items,
+                    "items_per_second": t.items / t.seconds if t.seconds else None,
+                }
+                for name, t in self.stages.items()
+            ],
+        }
+
+    def format(self) -> str:
+        """The totals as a table, with the time not spent in any stage."""
+        wall = self.wall_seconds or 1e-9
+        lines = [
+            f"{'STAGE':28} {'SECONDS':>9} {'WALL':>6} {'CALLS':>8} {'ITEMS':>9} {'ITEMS/S':>10}"
+        ]
+        for name, t in self.stages.items():
+            rate = f"{t.items / t.seconds:10.0f}" if t.seconds else f"{'-':>10}"
+            lines.append(
+                f"{name:28} {t.seconds:9.3f} {t.seconds / wall:6.1%}"
+                f" {t.calls:8} {t.items:9} {rate}"
+            )
+        other = wall - sum(t.seconds for t in self.stages.values())
+        lines.append(f"{'(other)':28} {max(other, 0.0):9.3f} {max(other, 0.0) / wall:6.1%}")
+        lines.append(f"{'(wall)':28} {wall:9.3f}")
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[Stats]:
+    """Collect the stages run in the block into a `Stats`."""
+    stats = Stats()
+    add_hook(stats)
+    try:
+        yield stats
+    finally:
+        stats.end = time.perf_counter()
+        remove_hook(stats)
@@ -1,5 +1,15 @@
 import attr
-from typing import NamedTuple, Dict, List, Optional, NewType
+from typing import (
+    NamedTuple,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    NewType,
+    Sequence,
+    Union,
+    overload,
+)
 
 SongDict = NewType("SongDict", Dict[str, Optional[str]])
 
@@ -40,3 +50,118 @@ class SongList:
     
     def __len__(self) -> int:
         return len(self.songs)
+
+    def append(self, song: Song) -> None:
+        self.songs.append(song)
+
+
+@attr.s(auto_attribs=True, slots=True)
+class ColumnarSongList:
+    """Same interface as `SongList`, for large lists: every field is kept in
+    its own list, and artists and albums, which repeat a lot, are interned so
+    each distinct value is stored once. Rows are only built (as `Song`s) when
+    read through `songs`."""
+
+    titles: List[str] = attr.Factory(list)
+    artists: List[str] = attr.Factory(list)
+    albums: List[Optional[str]] = attr.Factory(list)
+    download_urls: List[Optional[str]] = attr.Factory(list)
+    max_title: Optional[int] = None
+    max_artist: Optional[int] = None
+    max_album: Optional[int] = None
+    max_dlurl: Optional[int] = None
+    _interned: Dict[str, str] = attr.Factory(dict)
+
+    @property
+    def songs(self) -> "SongRows":
+        return SongRows(self)
+
+    def append(self, song: Song) -> None:
+        interned = self._interned
+        self.titles.append(song.title)
+        self.artists.append(interned.setdefault(song.artist, song.artist))
+        if song.album is None:
+            self.albums.append(None)
+        else:
+            self.albums.append(interned.setdefault(song.album, song.album))
+        self.download_urls.append(song.download_url)
+
+    def as_dict(self) -> Dict[str, List[Optional[str]]]:
+        """The columns, by field name (not copied)."""
+        return {
+            "title": self.titles,
+            "artist": self.artists,
+            "album": self.albums,
+            "download_url": self.download_urls,
+        }
+
+    def has_format_info(self) -> bool:
+        return (
+            self.max_title is not None
+            and self.max_artist is not None
+            and self.max_album is not None
+            and self.max_dlurl is not None
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.titles)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+
+class SongRows(Sequence[Song]):
+    """Read-only view of the rows of a `ColumnarSongList`."""
+
+    __slots__ = ("columns",)
+
+    def __init__(self, columns: ColumnarSongList):
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns.titles)
+
+    @overload
+    def __getitem__(self, index: int) -> Song:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Song]:
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Song, List[Song]]:
+        c = self.columns
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Song(
+            c.titles[index], c.artists[index], c.albums[index], c.download_urls[index]
+        )
+
+    def __iter__(self) -> Iterator[Song]:
+        c = self.columns
+        return map(Song._make, zip(c.titles, c.artists, c.albums, c.download_urls))
+
+
+@attr.s(auto_attribs=True, slots=True)
+class ScanStats:
+    total: int = 0
+    cached: int = 0
+    unreadable: int = 0
+
+
+@attr.s(auto_attribs=True, slots=True)
+class ColumnWidths:
+    """Running maximum length of the columns of a table, so widths are known
+    after a single pass over the rows. None values count as empty."""
+
+    widths: List[int]
+
+    @classmethod
+    def of(cls, *minimums: int) -> "ColumnWidths":
+        return cls(list(minimums))
+
+    def update(self, row: Sequence[Optional[str]]) -> None:
+        widths = self.widths
+        for i, value in enumerate(row[: len(widths)]):
+            if value is not None and len(value) > widths[i]:
+                widths[i] = len(value)
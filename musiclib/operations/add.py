@@ -1,91 +1,384 @@
-from typing import Optional, Iterable, Generator, Dict
+from typing import (
+    Optional,
+    Iterable,
+    Iterator,
+    Generator,
+    NamedTuple,
+    Tuple,
+    TextIO,
+)
+import functools
+import itertools
+import os
 import sqlite3
 import logging
-from ._types import Song, SongDict
-from ._metadata_analyser import get_metadata
+from ._db import DEFAULT_BATCH_SIZE, connection
+from ._types import Song, SongDict, ScanStats
+from ._metadata_analyser import get_metadata, get_metadata_and_hash
+from ._pool import bounded_map
+from ._files import iter_music_files, read_file_list
+from ._progress import Progress
+from ._stats import stage, timed_iter
+from .init import CREATE_SCAN_STATE, upgrade
+from ..exceptions import MetadataError
 
 # [SQL statements]
 
-INSERT_SONG_DIRECT = """
-    INSERT OR IGNORE INTO library (title, artist, album)
-    VALUES (:title, :artist, :album);
-    """
-
 CREATE_TEMP_TABLE = """
     CREATE TEMP TABLE to_be_added (
         title TEXT NOT NULL,
         artist TEXT NOT NULL,
-        album TEXT
+        album TEXT,
+        path TEXT,
+        audio_hash TEXT
     );
     """
 
 INSERT_SONG_TEMP = """
-    INSERT INTO to_be_added (title, artist, album)
-    VALUES (:title, :artist, :album);
+    INSERT INTO to_be_added (title, artist, album, path, audio_hash)
+    VALUES (:title, :artist, :album, :path, :audio_hash);
     """
 
+# Looks every new song up in the unique index of `songs`. The last
+# column tells whether both have an audio hash, and they differ. A song
+# read again from the file it was added from is not a duplicate.
 CHECK_DUPLICATES = """
-    SELECT title, artist FROM to_be_added
-    WHERE (title, artist) IN (
-        SELECT title, artist FROM library
-    );
+    SELECT new.title, new.artist, new.audio_hash != library.audio_hash
+    FROM to_be_added AS new
+    JOIN library
+    ON library.title = new.title AND library.artist = new.artist
+    WHERE library.path IS NOT new.path;
+    """
+
+# New songs with the same audio as a song of the library with other tags,
+# from another file
+CHECK_SAME_AUDIO = """
+    SELECT DISTINCT new.title, new.artist, library.title, library.artist
+    FROM to_be_added AS new
+    JOIN library
+    ON library.audio_hash = new.audio_hash
+    WHERE (library.title != new.title OR library.artist != new.artist)
+    AND library.path IS NOT new.path;
+    """
+
+# The names of the new songs are added first. Songs already in the library
+# only get their path (and audio hash, if computed) updated, to the file
+# they were last seen at.
+COPY_SONG = (
+    """
+    INSERT OR IGNORE INTO artists (name)
+    SELECT artist FROM to_be_added;
+    """,
+    """
+    INSERT OR IGNORE INTO albums (name)
+    SELECT album FROM to_be_added WHERE album IS NOT NULL;
+    """,
     """
+    INSERT INTO songs (title, artist_id, album_id, path, audio_hash)
+    SELECT new.title, artists.id, albums.id, new.path, new.audio_hash
+    FROM to_be_added AS new
+    JOIN artists ON artists.name = new.artist
+    LEFT JOIN albums ON albums.name = new.album
+    WHERE true
+    ON CONFLICT (title, artist_id) DO UPDATE SET
+        path = excluded.path,
+        audio_hash = COALESCE(excluded.audio_hash, audio_hash);
+    """,
+)
 
-COPY_SONG = """
-    INSERT OR IGNORE INTO library (title, artist, album)
-    SELECT title, artist, album FROM to_be_added;
+COUNT_TEMP_TABLE = """
+    SELECT COUNT(*) FROM to_be_added;
+    """
+
+CLEAR_TEMP_TABLE = """
+    DELETE FROM to_be_added;
+    """
+
+DROP_TEMP_TABLE = """
+    DROP TABLE IF EXISTS temp.to_be_added;
+    """
+
+SELECT_SCAN_STATE = """
+    SELECT title, artist, album, audio_hash FROM scan_state
+    WHERE path = :path AND size = :size AND mtime_ns = :mtime_ns;
+    """
+
+UPDATE_SCAN_STATE = """
+    INSERT OR REPLACE INTO scan_state
+        (path, size, mtime_ns, title, artist, album, audio_hash)
+    VALUES (:path, :size, :mtime_ns, :title, :artist, :album, :audio_hash);
     """
 
 # [/SQL statements]
 
+class ScanEntry(NamedTuple):
+    file: str
+    path: str
+    size: int
+    mtime_ns: int
+    cached: Optional[Song] = None
+    audio_hash: Optional[str] = None
+
+
+class ScanResult(NamedTuple):
+    file: str
+    song: Song
+    audio_hash: Optional[str] = None
+
+
+def _read_metadata(
+    entry: ScanEntry, audio_hash: bool = False
+) -> Tuple[ScanEntry, Optional[Song], Optional[str]]:
+    """The song of `entry` is None, and the digest the reason, if the file
+    cannot be read."""
+    if entry.cached is not None:
+        return entry, entry.cached, entry.audio_hash
+    try:
+        if audio_hash:
+            song, digest = get_metadata_and_hash(entry.file)
+            return entry, song, digest
+        return entry, get_metadata(entry.file), None
+    except (MetadataError, OSError) as e:
+        return entry, None, str(e)
+
+
+def scan(
+    con: sqlite3.Connection,
+    music_files: Iterable[str],
+    jobs: int = 1,
+    use_cache: bool = True,
+    stats: Optional[ScanStats] = None,
+    audio_hash: bool = False,
+) -> Iterator[ScanResult]:
+    """Yield the metadata of every file in `music_files`.
 
-def get_generator(music_files: Iterable[str], verbose: int) -> Generator[SongDict, None, None]:
+    Files whose path, size and modification time match the `scan_state`
+    table are not parsed again. The rest are parsed by `jobs` workers and
+    recorded in `scan_state`. Without `use_cache`, every file is parsed.
+    With `audio_hash`, the audio data of every file is hashed too, while its
+    tags are read (cached files without a hash are read again). Files
+    without a title or artist, or that cannot be read, are skipped with a
+    warning, and counted in `stats.unreadable`.
+    """
+
+    def entries() -> Generator[ScanEntry, None, None]:
+        for f in timed_iter("add: find files", music_files):
+            with stage("add: cache lookup"):
+                path = os.path.abspath(f)
+                try:
+                    st = os.stat(path)
+                except OSError as err:
+                    # E.g. deleted since it was listed
+                    logging.warning("skipped %s: %s", f, err.strerror or err)
+                    if stats is not None:
+                        stats.total += 1
+                        stats.unreadable += 1
+                    continue
+                entry = ScanEntry(f, path, st.st_size, st.st_mtime_ns)
+                if use_cache:
+                    row = con.execute(SELECT_SCAN_STATE, entry._asdict()).fetchone()
+                    if row and (row[3] is not None or not audio_hash):
+                        entry = entry._replace(
+                            cached=Song(*row[:3]), audio_hash=row[3]
+                        )
+            yield entry
+
+    read = functools.partial(_read_metadata, audio_hash=audio_hash)
+    con.execute(CREATE_SCAN_STATE)
+    # With workers, the time waiting for them
+    results = timed_iter("add: read tags", bounded_map(read, entries(), jobs))
+    for entry, data, digest in results:
+        if stats is not None:
+            stats.total += 1
+        if data is None:
+            logging.warning("skipped %s", digest)
+            if stats is not None:
+                stats.unreadable += 1
+            continue
+        if entry.cached is None:
+            with stage("add: cache update"):
+                con.execute(
+                    UPDATE_SCAN_STATE,
+                    {**entry._asdict(), **data._asdict(), "audio_hash": digest},
+                )
+        elif stats is not None:
+            stats.cached += 1
+        yield ScanResult(entry.file, data, digest)
+
+
+def song_dict(file: str, data: Song, audio_hash: Optional[str] = None) -> SongDict:
+    """Parameters to insert the song `data`, read from `file`."""
+    return SongDict(
+        {**data.as_dict(), "path": os.path.abspath(file), "audio_hash": audio_hash}
+    )
+
+
+def get_generator(
+    songs: Iterable[ScanResult], verbose: int
+) -> Generator[SongDict, None, None]:
     def gen() -> Generator[SongDict, None, None]:
-        for f in music_files:
-            data = get_metadata(f)
+        for f, data, audio_hash in songs:
             if data.album:
                 s = '%(file)s -> "%(title)s" from "%(artist)s" on "%(album)s"'
             else:
                 s = '%(file)s -> "%(title)s from "%(artist)s"'
             logging.info(
                 f"processing: {s}",
-                file=f,
-                title=data.title,
-                artist=data.artist,
-                album=data.album,
+                {
+                    "file": f,
+                    "title": data.title,
+                    "artist": data.artist,
+                    "album": data.album,
+                },
             )
-            yield data.as_dict()
+            yield song_dict(f, data, audio_hash)
 
     if verbose >= 0:
         return gen()
     else:
-        return (get_metadata(f).as_dict() for f in music_files)
+        return (song_dict(*song) for song in songs)
 
 
-def add(
-    database: str, *music_files: str, verbose: int = 0, warn_duplicates: bool = True
+def _counted(songs: Iterable[SongDict], progress: Progress) -> Iterator[SongDict]:
+    for song in songs:
+        progress.update()
+        yield song
+
+
+def report_duplicates(con: sqlite3.Connection) -> None:
+    """Report the songs of the temporary table already in the library from
+    another file, or with the same audio as a song of the library."""
+    for (title, artist, other_audio) in con.execute(CHECK_DUPLICATES).fetchall():
+        if other_audio:
+            logging.warning(
+                'duplicated: "%s" from "%s" (with different audio)', title, artist
+            )
+        else:
+            logging.warning('duplicated: "%s" from "%s"', title, artist)
+    for (title, artist, old_title, old_artist) in con.execute(
+        CHECK_SAME_AUDIO
+    ).fetchall():
+        logging.warning(
+            'same audio: "%s" from "%s" as "%s" from "%s"',
+            title,
+            artist,
+            old_title,
+            old_artist,
+        )
+
+
+def insert_songs(
+    con: sqlite3.Connection,
+    songs: Iterable[SongDict],
+    warn_duplicates: bool = True,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[Progress] = None,
 ) -> None:
+    """Insert `songs` into the library, committing every `batch_size` songs.
+
+    If it fails, the batches already committed are kept. With
+    `warn_duplicates`, songs already in the library are reported (checked
+    per batch). `songs` is consumed inside the transactions, so it may write
+    to `con` too.
+    """
+    if progress is not None:
+        songs = _counted(songs, progress)
+    songs = iter(songs)
+    # Every batch goes through a temporary table and is copied with a single
+    # statement, which is much cheaper for the full-text index triggers than
+    # one INSERT per song.
+    con.execute(CREATE_TEMP_TABLE)
+    try:
+        while True:
+            with stage("add: commit"), con:
+                with stage("add: stage rows") as staged:
+                    con.executemany(
+                        INSERT_SONG_TEMP, itertools.islice(songs, batch_size)
+                    )
+                    staged.items = con.execute(COUNT_TEMP_TABLE).fetchone()[0]
+                if not staged.items:
+                    break
+                if warn_duplicates:
+                    with stage("add: check duplicates", staged.items):
+                        report_duplicates(con)
+                with stage("add: copy rows", staged.items):
+                    for statement in COPY_SONG:
+                        con.execute(statement)
+                con.execute(CLEAR_TEMP_TABLE)
+            if progress is not None:
+                progress.checkpoint("committed")
+    finally:
+        con.execute(DROP_TEMP_TABLE)
+
+
+def add(
+    database: str,
+    *music_files: str,
+    verbose: int = 0,
+    warn_duplicates: bool = True,
+    jobs: int = 1,
+    use_cache: bool = True,
+    from_file: Optional[TextIO] = None,
+    extensions: Optional[Iterable[str]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[Progress] = None,
+    audio_hash: bool = False,
+) -> ScanStats:
     """Add `music_files` to the database (`database`).
 
+    Directories in `music_files` are walked recursively for files with one of
+    `extensions` (by default, `.mp3`). More paths, one per line, can be read
+    from `from_file`. Paths are consumed lazily, as metadata is read.
+
     With `warn_duplicates`, duplicates will be checked.
-    Else, duplicates will be silently ignored (this may improve performance).
+    Else, duplicates will be silently ignored.
     Regardless of `warn_duplicates`, duplicates on `music_files` will be ignored
     and reported, as it is likely to be a programming error.
+    Metadata is read by `jobs` parallel workers (0 means one per CPU).
+    Files unchanged since they were last added are not read again unless
+    `use_cache` is False.
+    Songs are committed every `batch_size` files, and reported to `progress`.
+    With `audio_hash`, the audio data of every file is hashed, for `dupes`.
+    Returns how many files were processed and how many came from the cache.
     """
 
-    music_files_clean = set(music_files)
-    if len(music_files_clean) != len(music_files_clean):
-        logging.warning("found and ignored duplicates in files list")
-    gen = get_generator(music_files_clean, verbose)
-    con = sqlite3.connect(database)
+    paths: Iterable[str] = music_files
+    if from_file is not None:
+        paths = itertools.chain(paths, read_file_list(from_file))
+    with connection(database) as con:
+        return add_files(
+            con,
+            paths,
+            verbose,
+            warn_duplicates,
+            jobs,
+            use_cache,
+            extensions,
+            batch_size,
+            progress,
+            audio_hash,
+        )
+
+
+def add_files(
+    con: sqlite3.Connection,
+    paths: Iterable[str],
+    verbose: int = 0,
+    warn_duplicates: bool = True,
+    jobs: int = 1,
+    use_cache: bool = True,
+    extensions: Optional[Iterable[str]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[Progress] = None,
+    audio_hash: bool = False,
+) -> ScanStats:
+    """Like `add`, on an open connection, for the files and directories
+    in `paths`."""
+    music_files = iter_music_files(paths, extensions)
+    stats = ScanStats()
     with con:
-        if warn_duplicates:
-            con.execute(CREATE_TEMP_TABLE)
-            con.executemany(INSERT_SONG_TEMP, gen)
-            cur = con.execute(CHECK_DUPLICATES)
-            for (title, artist) in cur.fetchall():
-                logging.warning('duplicated: "%s" from "%s"', title, artist)
-            con.execute(COPY_SONG)
-        else:
-            con.executemany(INSERT_SONG_DIRECT, gen)
-    con.close()
+        upgrade(con)
+    songs = scan(con, music_files, jobs, use_cache, stats, audio_hash)
+    gen = get_generator(songs, verbose)
+    insert_songs(con, gen, warn_duplicates, batch_size, progress)
+    return stats
@@ -0,0 +1,39 @@
+import itertools
+from typing import Iterator, List, NamedTuple, Optional
+from ._db import connection
+from .init import upgrade
+
+# Every scanned file whose audio hash is shared with another file. The
+# subquery is answered from the `scan_state_audio_hash` index.
+SELECT_DUPLICATES = """
+    SELECT audio_hash, path, title, artist, album FROM scan_state
+    WHERE audio_hash IN (
+        SELECT audio_hash FROM scan_state
+        WHERE audio_hash IS NOT NULL
+        GROUP BY audio_hash
+        HAVING COUNT(*) > 1
+    )
+    ORDER BY audio_hash, path;
+    """
+
+
+class ScannedFile(NamedTuple):
+    audio_hash: str
+    path: str
+    title: Optional[str]
+    artist: Optional[str]
+    album: Optional[str]
+
+
+def find_duplicates(database: str) -> Iterator[List[ScannedFile]]:
+    """Yield the groups of files with the same audio data.
+
+    Only the files added with `audio_hash` are considered, as they were when
+    last added.
+    """
+    with connection(database) as con:
+        with con:
+            upgrade(con)
+        files = (ScannedFile(*row) for row in con.execute(SELECT_DUPLICATES))
+        for _, group in itertools.groupby(files, key=lambda f: f.audio_hash):
+            yield list(group)
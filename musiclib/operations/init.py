@@ -1,37 +1,525 @@
+"""The schema of the library, and its migrations.
+
+Songs are stored in `songs`, with their artist and album in `artists` and
+`albums`, and read through the `library` view, which joins them back into
+one row per song. The version of the schema is kept in `PRAGMA
+user_version`: `upgrade` brings a database created by an older version up
+to SCHEMA_VERSION, in place, by running the MIGRATIONS it is missing.
+"""
 import sqlite3
+import logging
+from typing import Callable, Iterable, Tuple
+from ._db import connection
 from ..exceptions import CommandError
 
+# [SQL statements]
+
+GET_VERSION = """
+    PRAGMA user_version;
+    """
+
+SET_VERSION = """
+    PRAGMA user_version = {version};
+    """
+
 CHECK_EXISTANCE = """
+    SELECT type FROM sqlite_master
+    WHERE type IN ('table', 'view') AND name = 'library'
+    LIMIT 1;
+    """
+
+DROP_SCHEMA = (
+    """
+    DROP TABLE IF EXISTS library_fts;
+    """,
+    """
+    DROP TABLE IF EXISTS songs;
+    """,
+    """
+    DROP TABLE IF EXISTS artists;
+    """,
+    """
+    DROP TABLE IF EXISTS albums;
+    """,
+    """
+    DROP TABLE IF EXISTS scan_state;
+    """,
+    """
+    DROP TABLE IF EXISTS song_changes;
+    """,
+    """
+    DROP TABLE IF EXISTS merge_state;
+    """,
+)
+
+CHECK_SEARCH_INDEX = """
+    SELECT 1 FROM sqlite_master
+    WHERE type = 'table' AND name = 'library_fts'
+    LIMIT 1;
+    """
+
+GET_COLUMNS = """
+    PRAGMA table_info({table});
+    """
+
+# Names are stored once, and songs refer to them by id. A song without
+# album has no `album_id`. Artists and albums without songs are deleted
+# along with their last song (see CREATE_TRIGGERS).
+CREATE_TABLES = (
+    """
+    CREATE TABLE artists (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    """,
+    """
+    CREATE TABLE albums (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    """,
+    """
+    CREATE TABLE songs (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        artist_id INTEGER NOT NULL REFERENCES artists (id),
+        album_id INTEGER REFERENCES albums (id),
+        download_url TEXT DEFAULT NULL,
+        download_url_updated REAL DEFAULT NULL,
+        download_status TEXT DEFAULT NULL,
+        download_path TEXT DEFAULT NULL,
+        download_hash TEXT DEFAULT NULL,
+        download_attempts INTEGER NOT NULL DEFAULT 0,
+        download_last_attempt REAL DEFAULT NULL,
+        download_error TEXT DEFAULT NULL,
+        path TEXT DEFAULT NULL,
+        audio_hash TEXT DEFAULT NULL,
+        UNIQUE (title, artist_id)
+    );
+    """,
+)
+
+# The songs with the names of their artist and album, as the single table
+# of the first schema had them. Every read goes through it.
+CREATE_VIEW = """
+    CREATE VIEW library AS
+    SELECT songs.id AS id,
+        songs.title AS title,
+        artists.name AS artist,
+        albums.name AS album,
+        songs.download_url AS download_url,
+        songs.download_status AS download_status,
+        songs.download_path AS download_path,
+        songs.download_hash AS download_hash,
+        songs.download_attempts AS download_attempts,
+        songs.download_last_attempt AS download_last_attempt,
+        songs.download_error AS download_error,
+        songs.path AS path,
+        songs.audio_hash AS audio_hash
+    FROM songs
+    JOIN artists ON artists.id = songs.artist_id
+    LEFT JOIN albums ON albums.id = songs.album_id;
+    """
+
+# Indexes for filtering and sorting in `list` by artist or album (the
+# unique constraint covers lookups by title and artist), for finding the
+# songs of a file in `watch` and `purge`, and copies of the same audio
+CREATE_INDEXES = (
+    """
+    CREATE INDEX IF NOT EXISTS songs_artist ON songs (artist_id, title);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS songs_album ON songs (album_id, title);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS songs_path ON songs (path);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS songs_audio_hash ON songs (audio_hash);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS scan_state_audio_hash ON scan_state (audio_hash);
+    """,
+)
+
+CREATE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS songs_delete_names AFTER DELETE ON songs
+    BEGIN
+        DELETE FROM artists WHERE id = old.artist_id
+            AND NOT EXISTS (SELECT 1 FROM songs WHERE artist_id = old.artist_id);
+        DELETE FROM albums WHERE id = old.album_id
+            AND NOT EXISTS (SELECT 1 FROM songs WHERE album_id = old.album_id);
+    END;
+    """,
+)
+
+# Full-text index of `library` for `search`, kept in sync by triggers on
+# `songs`. The old names are removed from it before a song is deleted, as
+# its artist and album may be deleted with it.
+CREATE_SEARCH_INDEX = (
+    """
+    CREATE VIRTUAL TABLE library_fts USING fts5(
+        title, artist, album,
+        content = 'library',
+        content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    );
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS songs_fts_insert AFTER INSERT ON songs
+    BEGIN
+        INSERT INTO library_fts (rowid, title, artist, album)
+        VALUES (
+            new.id,
+            new.title,
+            (SELECT name FROM artists WHERE id = new.artist_id),
+            (SELECT name FROM albums WHERE id = new.album_id)
+        );
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS songs_fts_delete BEFORE DELETE ON songs
+    BEGIN
+        INSERT INTO library_fts (library_fts, rowid, title, artist, album)
+        VALUES (
+            'delete',
+            old.id,
+            old.title,
+            (SELECT name FROM artists WHERE id = old.artist_id),
+            (SELECT name FROM albums WHERE id = old.album_id)
+        );
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS songs_fts_update
+    AFTER UPDATE OF title, artist_id, album_id ON songs
+    BEGIN
+        INSERT INTO library_fts (library_fts, rowid, title, artist, album)
+        VALUES (
+            'delete',
+            old.id,
+            old.title,
+            (SELECT name FROM artists WHERE id = old.artist_id),
+            (SELECT name FROM albums WHERE id = old.album_id)
+        );
+        INSERT INTO library_fts (rowid, title, artist, album)
+        VALUES (
+            new.id,
+            new.title,
+            (SELECT name FROM artists WHERE id = new.artist_id),
+            (SELECT name FROM albums WHERE id = new.album_id)
+        );
+    END;
+    """,
+)
+
+REBUILD_SEARCH_INDEX = """
+    INSERT INTO library_fts (library_fts) VALUES ('rebuild');
+    """
+
+# Optional log of the songs added or changed (in what `merge` copies), for
+# incremental merges: the last change of every song, in order. AUTOINCREMENT
+# keeps `seq` from ever going back, even when the last change is replaced.
+CHECK_CHANGE_LOG = """
     SELECT 1 FROM sqlite_master
-    WHERE type = 'table' AND name = 'library'
+    WHERE type = 'table' AND name = 'song_changes'
     LIMIT 1;
     """
 
-DROP_IF_EXISTS = """
-    DROP TABLE IF EXISTS library;
+CREATE_CHANGE_LOG = (
+    """
+    CREATE TABLE IF NOT EXISTS song_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        song_id INTEGER NOT NULL UNIQUE
+    );
+    """,
     """
+    CREATE TRIGGER IF NOT EXISTS songs_log_insert AFTER INSERT ON songs
+    BEGIN
+        INSERT OR REPLACE INTO song_changes (song_id) VALUES (new.id);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS songs_log_update
+    AFTER UPDATE OF title, artist_id, album_id, download_url, audio_hash ON songs
+    WHEN old.title IS NOT new.title
+        OR old.artist_id IS NOT new.artist_id
+        OR old.album_id IS NOT new.album_id
+        OR old.download_url IS NOT new.download_url
+        OR old.audio_hash IS NOT new.audio_hash
+    BEGIN
+        INSERT OR REPLACE INTO song_changes (song_id) VALUES (new.id);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS songs_log_delete AFTER DELETE ON songs
+    BEGIN
+        DELETE FROM song_changes WHERE song_id = old.id;
+    END;
+    """,
+)
 
-CREATE_TABLE = """
-    CREATE TABLE library (
+# Songs from before the log was enabled count as changed when it is
+FILL_CHANGE_LOG = """
+    INSERT OR IGNORE INTO song_changes (song_id) SELECT id FROM songs ORDER BY id;
+    """
+
+# Tags (and audio hash, if computed) of every scanned file, so unchanged
+# files are not read again
+CREATE_SCAN_STATE = """
+    CREATE TABLE IF NOT EXISTS scan_state (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
         title TEXT,
         artist TEXT,
         album TEXT,
-        download_url TEXT DEFAULT NULL,
-        PRIMARY KEY (title, artist)
+        audio_hash TEXT
     );
     """
 
+# Version 3: when the download URL of a song was set (as a Unix time), to
+# tell the newer one in `merge`
+V3_ADDED_COLUMNS = (("download_url_updated", "REAL DEFAULT NULL"),)
+
+# Version 1: the single `library` table, from before versions were recorded.
+# Columns added to it after its first version, and to `scan_state`:
+V1_ADDED_COLUMNS = (
+    ("download_status", "TEXT DEFAULT NULL"),
+    ("download_path", "TEXT DEFAULT NULL"),
+    ("download_hash", "TEXT DEFAULT NULL"),
+    ("download_attempts", "INTEGER NOT NULL DEFAULT 0"),
+    ("download_last_attempt", "REAL DEFAULT NULL"),
+    ("download_error", "TEXT DEFAULT NULL"),
+    ("path", "TEXT DEFAULT NULL"),
+    ("audio_hash", "TEXT DEFAULT NULL"),
+)
+
+SCAN_STATE_ADDED_COLUMNS = (("audio_hash", "TEXT DEFAULT NULL"),)
+
+# Version 2: `library` split into `songs`, `artists` and `albums`. The
+# full-text index and the indexes of `library` are dropped with it.
+DROP_V1 = (
+    """
+    DROP TRIGGER IF EXISTS library_fts_insert;
+    """,
+    """
+    DROP TRIGGER IF EXISTS library_fts_delete;
+    """,
+    """
+    DROP TRIGGER IF EXISTS library_fts_update;
+    """,
+    """
+    DROP TABLE IF EXISTS library_fts;
+    """,
+    """
+    DROP INDEX IF EXISTS library_artist;
+    """,
+    """
+    DROP INDEX IF EXISTS library_album;
+    """,
+    """
+    DROP INDEX IF EXISTS library_audio_hash;
+    """,
+    """
+    ALTER TABLE library RENAME TO library_v1;
+    """,
+)
 
-def init(database: str, force: bool = False) -> None:
-    con = sqlite3.connect(database)
-    with con:
-        if force:
-            con.execute(DROP_IF_EXISTS)
-        else:
-            cur = con.execute(CHECK_EXISTANCE)
-            if cur.fetchone():
+# Titles and artists could be NULL in version 1
+COPY_V1 = (
+    """
+    INSERT OR IGNORE INTO artists (name)
+    SELECT IFNULL(artist, '') FROM library_v1;
+    """,
+    """
+    INSERT OR IGNORE INTO albums (name)
+    SELECT album FROM library_v1 WHERE album IS NOT NULL;
+    """,
+    """
+    INSERT OR IGNORE INTO songs (
+        title, artist_id, album_id, download_url, download_status,
+        download_path, download_hash, download_attempts,
+        download_last_attempt, download_error, path, audio_hash
+    )
+    SELECT IFNULL(old.title, ''), artists.id, albums.id, old.download_url,
+        old.download_status, old.download_path, old.download_hash,
+        old.download_attempts, old.download_last_attempt, old.download_error,
+        old.path, old.audio_hash
+    FROM library_v1 AS old
+    JOIN artists ON artists.name = IFNULL(old.artist, '')
+    LEFT JOIN albums ON albums.name = old.album
+    ORDER BY old.rowid;
+    """,
+    """
+    DROP TABLE library_v1;
+    """,
+)
+
+# [/SQL statements]
+
+
+def init(
+    database: str,
+    force: bool = False,
+    upgrade_existing: bool = False,
+    change_log: bool = False,
+) -> None:
+    """Create the library in `database`.
+
+    If it already exists, it is erased with `force`, or brought up to the
+    current schema with `upgrade_existing`. With `change_log`, the songs
+    changed from now on are logged, for `merge --incremental` from it.
+    """
+    with connection(database) as con:
+        with con:
+            con.execute("BEGIN IMMEDIATE;")
+            exists = not force and library_exists(con)
+            if exists and not upgrade_existing:
                 raise CommandError(
-                    "already initialized. Use --force to recreate anyway"
+                    "already initialized. Use --force to recreate anyway,"
+                    " or --upgrade to update it"
                 )
-        con.execute(CREATE_TABLE)
-    con.close()
+            if force:
+                drop_schema(con)
+            upgrade(con)
+            # Retried, in case SQLite lacked FTS5 when it was migrated
+            if exists and not con.execute(CHECK_SEARCH_INDEX).fetchone():
+                if create_search_index(con):
+                    con.execute(REBUILD_SEARCH_INDEX)
+            if change_log:
+                enable_change_log(con)
+
+
+def library_exists(con: sqlite3.Connection) -> bool:
+    return con.execute(CHECK_EXISTANCE).fetchone() is not None
+
+
+def get_version(con: sqlite3.Connection) -> int:
+    return con.execute(GET_VERSION).fetchone()[0]
+
+
+def set_version(con: sqlite3.Connection, version: int) -> None:
+    con.execute(SET_VERSION.format(version=int(version)))
+
+
+def drop_schema(con: sqlite3.Connection) -> None:
+    """Drop every table of the library, of any version."""
+    row = con.execute(CHECK_EXISTANCE).fetchone()
+    if row is not None:
+        con.execute(f"DROP {row[0].upper()} library;")
+    for statement in DROP_SCHEMA:
+        con.execute(statement)
+    set_version(con, 0)
+
+
+def enable_change_log(con: sqlite3.Connection) -> None:
+    """Start logging the changed songs (see CREATE_CHANGE_LOG), if not yet."""
+    if con.execute(CHECK_CHANGE_LOG).fetchone():
+        return
+    for statement in CREATE_CHANGE_LOG:
+        con.execute(statement)
+    con.execute(FILL_CHANGE_LOG)
+
+
+def create_schema(con: sqlite3.Connection) -> None:
+    """Create the current schema in an empty database."""
+    for statement in CREATE_TABLES:
+        con.execute(statement)
+    con.execute(CREATE_VIEW)
+    con.execute(CREATE_SCAN_STATE)
+    for statement in CREATE_INDEXES + CREATE_TRIGGERS:
+        con.execute(statement)
+    create_search_index(con)
+
+
+def migrate_v1(con: sqlite3.Connection) -> None:
+    """Add what the first schema got over time, as `init --upgrade` did."""
+    con.execute(CREATE_SCAN_STATE)
+    add_columns(con, "library", V1_ADDED_COLUMNS)
+    add_columns(con, "scan_state", SCAN_STATE_ADDED_COLUMNS)
+
+
+def migrate_v2(con: sqlite3.Connection) -> None:
+    """Split `library` into `songs`, `artists` and `albums`."""
+    for statement in DROP_V1:
+        con.execute(statement)
+    for statement in CREATE_TABLES:
+        con.execute(statement)
+    # Built before the indexes and triggers, which makes it much faster
+    for statement in COPY_V1:
+        con.execute(statement)
+    con.execute(CREATE_VIEW)
+    for statement in CREATE_INDEXES + CREATE_TRIGGERS:
+        con.execute(statement)
+    if create_search_index(con):
+        con.execute(REBUILD_SEARCH_INDEX)
+
+
+def migrate_v3(con: sqlite3.Connection) -> None:
+    add_columns(con, "songs", V3_ADDED_COLUMNS)
+
+
+# MIGRATIONS[i] brings a database from version i to i + 1
+MIGRATIONS: Tuple[Callable[[sqlite3.Connection], None], ...] = (
+    migrate_v1,
+    migrate_v2,
+    migrate_v3,
+)
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def upgrade(con: sqlite3.Connection) -> None:
+    """Bring the database up to the current schema, creating it if it is
+    empty. Cheap when it already is, so every operation writing to the
+    library starts with it.
+
+    Runs in the current transaction, or in its own one (committed with
+    `con`), so that concurrent upgrades wait for each other and a failed
+    one leaves the database as it was.
+    """
+    if get_version(con) == SCHEMA_VERSION:
+        return
+    if not con.in_transaction:
+        con.execute("BEGIN IMMEDIATE;")
+    version = get_version(con)  # It may have been upgraded while we waited
+    if version > SCHEMA_VERSION:
+        raise CommandError(
+            f"the database has schema version {version}, newer than this"
+            f" version of musiclib supports ({SCHEMA_VERSION}). Upgrade musiclib"
+        )
+    if version == 0 and not library_exists(con):
+        create_schema(con)
+    else:
+        for migrate in MIGRATIONS[version:]:
+            logging.info("upgrading the database to schema version %d", version + 1)
+            migrate(con)
+            version += 1
+    set_version(con, SCHEMA_VERSION)
+
+
+def add_columns(
+    con: sqlite3.Connection, table: str, columns: Iterable[Tuple[str, str]]
+) -> None:
+    """Add the `(name, definition)` columns missing from `table`."""
+    existing = {row[1] for row in con.execute(GET_COLUMNS.format(table=table))}
+    for name, definition in columns:
+        if name not in existing:
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition};")
+
+
+def create_search_index(con: sqlite3.Connection) -> bool:
+    """Create the full-text index of the library, if SQLite supports it.
+
+    Returns whether it was created.
+    """
+    try:
+        for statement in CREATE_SEARCH_INDEX:
+            con.execute(statement)
+    except sqlite3.OperationalError as err:
+        logging.warning("full-text search not available: %s", err)
+        return False
+    return True
@@ -1,7 +1,22 @@
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
+import io
 import sqlite3
-from typing import List, NamedTuple, Optional
-import json
-from ._types import Song, SongList
+from json.encoder import encode_basestring_ascii
+import attr
+from ._db import connection
+from ._stats import timed_iter
+from ._types import Song, SongList, ColumnarSongList, ColumnWidths
 
 # [SQL statements]
 
@@ -10,45 +25,154 @@ SELECT_ALL = """
     ORDER BY title ASC, artist ASC;
     """
 
-SELECT_FORMAT = """
-    SELECT
-        MAX(LENGTH(title)),
-        MAX(LENGTH(artist)),
-        MAX(IFNULL(LENGTH(album), 0)),
-        MAX(IFNULL(LENGTH(download_url), 0))
-    FROM library;
+SELECT_SONGS = """
+    SELECT title, artist, album, download_url FROM library
     """
 
 # [/SQL statements]
 
+SORT_KEYS = ("title", "artist", "album", "download_url")
+DEFAULT_SORT = ("title", "artist")
+GLOB_CHARS = frozenset("*?[")
 
-def do_list(database: str, fetch_format_info: bool = True) -> SongList:
-    con = sqlite3.connect(database)
-    cur = con.execute(SELECT_ALL)
-    song_list = SongList()
-    s = cur.fetchone()
-    while s:
-        song_list.songs.append(
-            Song(title=s[0], artist=s[1], album=s[2], download_url=s[3])
-        )
-        s = cur.fetchone()
+# Rows fetched from the database at a time when streaming
+FETCH_SIZE = 512
+
+
+def parse_sort(text: str) -> Tuple[str, ...]:
+    """Parse a comma-separated list of sort keys, each optionally prefixed
+    with `-` or `~` for descending order (`~` as it is not taken for an
+    option on the command line). Descending keys are returned with `-`."""
+    keys = []
+    for key in text.split(","):
+        key = key.strip()
+        if not key:
+            continue
+        column = key[1:] if key[:1] in ("-", "~") else key
+        if column not in SORT_KEYS:
+            raise ValueError(
+                f"unknown sort key: {key}. Choose from {', '.join(SORT_KEYS)}"
+            )
+        keys.append("-" + column if column != key else key)
+    return tuple(keys)
+
+
+@attr.s(auto_attribs=True, slots=True, frozen=True)
+class Query:
+    """Which songs to list, and in which order.
+
+    `title`, `artist` and `album` match values starting with the given text,
+    or, if it has any of `*?[`, the whole value against it as a glob
+    (case-sensitive in both cases, so the indexes can be used).
+    `has_url` keeps only songs with (True) or without (False) a URL.
+    """
+
+    title: Optional[str] = None
+    artist: Optional[str] = None
+    album: Optional[str] = None
+    has_url: Optional[bool] = None
+    sort: Tuple[str, ...] = DEFAULT_SORT
+    limit: Optional[int] = None
+    offset: int = 0
+
+    def to_sql(self) -> Tuple[str, Dict[str, Any]]:
+        """Compile the query to a parameterized SELECT statement."""
+        conditions = []
+        params: Dict[str, Any] = {}
+        for field in ("title", "artist", "album"):
+            pattern = getattr(self, field)
+            if pattern is None:
+                continue
+            if not GLOB_CHARS.intersection(pattern):
+                pattern += "*"
+            if field == "album":
+                # Turns the LEFT JOIN with `albums` into a JOIN, so that
+                # their names can be looked up in their index
+                conditions.append("album IS NOT NULL")
+            conditions.append(f"{field} GLOB :{field}")
+            params[field] = pattern
+        if self.has_url is not None:
+            conditions.append(
+                "download_url IS NOT NULL" if self.has_url else "download_url IS NULL"
+            )
+        clauses = [SELECT_SONGS.strip()]
+        if conditions:
+            clauses.append("WHERE " + " AND ".join(conditions))
+        order = []
+        for key in self.sort or DEFAULT_SORT:
+            column = key.lstrip("-")
+            if column not in SORT_KEYS:
+                raise ValueError(f"unknown sort key: {key}")
+            order.append(f"{column} {'DESC' if key.startswith('-') else 'ASC'}")
+        clauses.append("ORDER BY " + ", ".join(order))
+        if self.limit is not None or self.offset:
+            clauses.append("LIMIT :limit OFFSET :offset")
+            params["limit"] = -1 if self.limit is None else self.limit
+            params["offset"] = self.offset
+        return "\n    ".join(clauses) + ";", params
+
+
+AnySongList = Union[SongList, ColumnarSongList]
+
+
+def do_list(
+    database: str,
+    fetch_format_info: bool = True,
+    query: Optional[Query] = None,
+    columnar: bool = False,
+) -> AnySongList:
+    """Fetch the songs matching `query` (by default, every song). With
+    `fetch_format_info`, the column widths are computed in the same pass.
+    With `columnar`, a `ColumnarSongList` is returned, which takes much less
+    memory for many songs."""
+    return collect(iter_songs(database, query), fetch_format_info, columnar)
+
+
+def collect(
+    songs: Iterable[Song], fetch_format_info: bool = True, columnar: bool = False
+) -> AnySongList:
+    """Build a `SongList` (or with `columnar`, a `ColumnarSongList`) from
+    `songs`, computing the column widths as they are added if
+    `fetch_format_info`."""
+    song_list: AnySongList = ColumnarSongList() if columnar else SongList()
+    widths = ColumnWidths.of(0, 0, 0, 0)
+    for song in songs:
+        song_list.append(song)
+        if fetch_format_info:
+            widths.update(song)
     if fetch_format_info:
-        if song_list:
-            cur = con.execute(SELECT_FORMAT)
-            fi = cur.fetchone()
-        else:
-            fi = (0, 0, 0, 0)
         (
             song_list.max_title,
             song_list.max_artist,
             song_list.max_album,
             song_list.max_dlurl,
-        ) = fi
-    con.close()
+        ) = widths.widths
     return song_list
 
 
-def format_list(song_list: SongList) -> None:
+def iter_songs(database: str, query: Optional[Query] = None) -> Iterator[Song]:
+    """Yield the songs matching `query` (by default, every song), without
+    loading them all in memory."""
+    with connection(database) as con:
+        yield from timed_iter("list: query", query_songs(con, query))
+
+
+def query_songs(
+    con: sqlite3.Connection, query: Optional[Query] = None
+) -> Iterator[Song]:
+    """Like `iter_songs`, on an open connection."""
+    if query is None:
+        cur = con.execute(SELECT_ALL)
+    else:
+        cur = con.execute(*query.to_sql())
+    rows = cur.fetchmany(FETCH_SIZE)
+    while rows:
+        for s in rows:
+            yield Song(title=s[0], artist=s[1], album=s[2], download_url=s[3])
+        rows = cur.fetchmany(FETCH_SIZE)
+
+
+def format_list(song_list: AnySongList) -> None:
     if not song_list.has_format_info():
         raise ValueError("song list must have format info to be formatted")
     TITLE = "TITLE"
@@ -69,23 +193,73 @@ def format_list(song_list: SongList) -> None:
     )
     for song in song_list.songs:
         print(
-            "{s.title:{t_l}} | {s.artist:{ar_l}} | {s.album:{al_l}}".format(
-                s=song, t_l=title_len, ar_l=artist_len, al_l=album_len
+            "{s.title:{t_l}} | {s.artist:{ar_l}} | {al:{al_l}}".format(
+                s=song,
+                al=song.album or "",
+                t_l=title_len,
+                ar_l=artist_len,
+                al_l=album_len,
             )
         )
 
 
-def to_json(song_list: SongList, compact: bool = False) -> str:
-    doc = [
-        {
-            "title": song.title,
-            "artist": song.artist,
-            "album": song.album,
-            "download_url": song.download_url,
-        }
-        for song in song_list.songs
-    ]
+def format_list_unaligned(songs: Iterable[Song]) -> None:
+    """Like `format_list`, but without padding the columns, so each song is
+    printed as soon as it is read."""
+    print("TITLE | ARTIST | ALBUM")
+    for song in songs:
+        print(f"{song.title} | {song.artist} | {song.album or ''}")
+
+
+def _json_string(value: Optional[str]) -> str:
+    return "null" if value is None else encode_basestring_ascii(value)
+
+
+def song_to_json(song: Song, compact: bool = False) -> str:
+    """Same as `json.dumps` of the song as a dict (with sorted keys and an
+    indent of 2 unless `compact`), without building the dict."""
+    title, artist, album, download_url = map(_json_string, song)
     if compact:
-        return json.dumps(doc, indent=None, separators=(",", ":"))
+        return (
+            f'{{"title":{title},"artist":{artist},"album":{album},'
+            f'"download_url":{download_url}}}'
+        )
     else:
-        return json.dumps(doc, indent=2, sort_keys=True)
+        return (
+            f'{{\n  "album": {album},\n  "artist": {artist},\n'
+            f'  "download_url": {download_url},\n  "title": {title}\n}}'
+        )
+
+
+def write_json(songs: Iterable[Song], file: TextIO, compact: bool = False) -> None:
+    """Write `songs` to `file` as a JSON array, one song at a time.
+
+    The output is the same as `to_json`.
+    """
+    if compact:
+        start, sep, end = "[", ",", "]"
+    else:
+        # Each object is nested one level deeper inside the array
+        start, sep, end = "[\n  ", ",\n  ", "\n]"
+    first = True
+    for song in songs:
+        doc = song_to_json(song, compact)
+        if not compact:
+            doc = doc.replace("\n", "\n  ")
+        file.write(start if first else sep)
+        file.write(doc)
+        first = False
+    file.write("[]" if first else end)
+
+
+def write_ndjson(songs: Iterable[Song], file: TextIO) -> None:
+    """Write `songs` to `file` as newline-delimited JSON, one song per line."""
+    for song in songs:
+        file.write(song_to_json(song, compact=True))
+        file.write("\n")
+
+
+def to_json(song_list: AnySongList, compact: bool = False) -> str:
+    buf = io.StringIO()
+    write_json(song_list.songs, buf, compact)
+    return buf.getvalue()
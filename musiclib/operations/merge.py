@@ -0,0 +1,258 @@
+"""Merge the songs of another library database into this one.
+
+The other database is attached, and its songs are copied with a few
+set-based statements, through a temporary table. Songs missing here are
+added, without their file path and download state, which belong to the
+host of the other library. For songs in both, the download URL of the
+other one is taken if this one has none, or, with PREFER_NEWER, if it was
+set more recently. Nothing is deleted.
+
+If the other library has a change log (see `init --change-log`), the last
+change merged from it is recorded in `merge_state`, and an incremental
+merge only reads the songs changed since.
+"""
+import logging
+import os
+import sqlite3
+from typing import NamedTuple
+from ._db import connection
+from ._stats import stage
+from .init import SCHEMA_VERSION, upgrade
+from ..exceptions import CommandError
+
+# [SQL statements]
+
+ATTACH = """
+    ATTACH DATABASE :path AS other;
+    """
+
+DETACH = """
+    DETACH DATABASE other;
+    """
+
+GET_OTHER_VERSION = """
+    PRAGMA other.user_version;
+    """
+
+CHECK_OTHER_CHANGE_LOG = """
+    SELECT 1 FROM other.sqlite_master
+    WHERE type = 'table' AND name = 'song_changes'
+    LIMIT 1;
+    """
+
+# The last change ever logged, even if the song changed again since
+GET_OTHER_LAST_CHANGE = """
+    SELECT IFNULL(MAX(seq), 0) FROM other.sqlite_sequence
+    WHERE name = 'song_changes';
+    """
+
+# The last change merged from every library with a change log, by path
+CREATE_MERGE_STATE = """
+    CREATE TABLE IF NOT EXISTS merge_state (
+        source TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL
+    );
+    """
+
+GET_MERGE_STATE = """
+    SELECT seq FROM merge_state WHERE source = :source;
+    """
+
+SET_MERGE_STATE = """
+    INSERT OR REPLACE INTO merge_state (source, seq) VALUES (:source, :seq);
+    """
+
+# `song_id` is the id of the same song here, if any
+CREATE_SOURCE_TABLE = """
+    CREATE TEMP TABLE merge_source (
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        album TEXT,
+        download_url TEXT,
+        download_url_updated REAL,
+        audio_hash TEXT,
+        song_id INTEGER UNIQUE
+    );
+    """
+
+STAGE_SONGS = """
+    INSERT INTO merge_source (
+        title, artist, album, download_url, download_url_updated, audio_hash,
+        song_id
+    )
+    SELECT s.title, a.name, al.name, s.download_url, s.download_url_updated,
+        s.audio_hash, here.id
+    FROM other.songs AS s
+    JOIN other.artists AS a ON a.id = s.artist_id
+    LEFT JOIN other.albums AS al ON al.id = s.album_id
+    LEFT JOIN main.artists AS here_artist ON here_artist.name = a.name
+    LEFT JOIN main.songs AS here
+    ON here.title = s.title AND here.artist_id = here_artist.id
+    {filter};
+    """
+
+STAGE_ALL_SONGS = STAGE_SONGS.format(filter="")
+
+STAGE_CHANGED_SONGS = STAGE_SONGS.format(
+    filter="WHERE s.id IN (SELECT song_id FROM other.song_changes WHERE seq > :since)"
+)
+
+ADD_NAMES = (
+    """
+    INSERT OR IGNORE INTO artists (name)
+    SELECT artist FROM merge_source WHERE song_id IS NULL;
+    """,
+    """
+    INSERT OR IGNORE INTO albums (name)
+    SELECT album FROM merge_source
+    WHERE song_id IS NULL AND album IS NOT NULL;
+    """,
+)
+
+ADD_SONGS = """
+    INSERT INTO songs (
+        title, artist_id, album_id, download_url, download_url_updated, audio_hash
+    )
+    SELECT new.title, artists.id, albums.id, new.download_url,
+        new.download_url_updated, new.audio_hash
+    FROM merge_source AS new
+    JOIN artists ON artists.name = new.artist
+    LEFT JOIN albums ON albums.name = new.album
+    WHERE new.song_id IS NULL;
+    """
+
+# Songs without a URL here take the other one. With :newer, so do songs
+# whose URL was set less recently here (never, for URLs set before it was
+# recorded). A new URL invalidates the download state, as in `url set`.
+MERGE_URLS = """
+    UPDATE songs
+    SET (download_url, download_url_updated, download_status, download_attempts) = (
+        SELECT new.download_url, new.download_url_updated, NULL, 0
+        FROM merge_source AS new WHERE new.song_id = songs.id
+    )
+    WHERE id IN (
+        SELECT new.song_id FROM merge_source AS new
+        JOIN songs AS here ON here.id = new.song_id
+        WHERE new.download_url IS NOT NULL
+        AND here.download_url IS NOT new.download_url
+        AND (
+            here.download_url IS NULL
+            OR (:newer AND IFNULL(new.download_url_updated, 0)
+                > IFNULL(here.download_url_updated, 0))
+        )
+    );
+    """
+
+# Songs in both whose URLs still differ
+COUNT_CONFLICTS = """
+    SELECT COUNT(*) FROM merge_source AS new
+    JOIN songs AS here ON here.id = new.song_id
+    WHERE new.download_url IS NOT NULL
+    AND here.download_url IS NOT new.download_url;
+    """
+
+DROP_SOURCE_TABLE = """
+    DROP TABLE IF EXISTS temp.merge_source;
+    """
+
+# [/SQL statements]
+
+# Which URL a song in both libraries keeps, when they differ
+KEEP_EXISTING = "keep"
+PREFER_NEWER = "newer"
+RULES = (KEEP_EXISTING, PREFER_NEWER)
+
+
+class MergeResult(NamedTuple):
+    songs: int  # Read from the other library
+    added: int
+    updated: int  # Songs that took the URL of the other library
+    conflicting: int  # Songs that kept a URL different from the other one
+    incremental: bool
+
+
+def merge(
+    database: str, other: str, prefer: str = KEEP_EXISTING, incremental: bool = False
+) -> MergeResult:
+    """Merge the songs of the library `other` into `database`, in one
+    transaction.
+
+    `prefer` is the rule for the songs of both with different URLs (see
+    RULES). With `incremental`, only the songs changed since the last merge
+    from `other` are read, which needs a change log in `other`.
+    """
+    if prefer not in RULES:
+        raise ValueError(f"unknown rule: {prefer}. Choose from {', '.join(RULES)}")
+    # ATTACH would create it
+    if not os.path.isfile(other):
+        raise CommandError(f"no such database: {other}")
+    if os.path.exists(database) and os.path.samefile(database, other):
+        raise CommandError("cannot merge a database into itself")
+    with connection(database) as con:
+        with con:
+            upgrade(con)
+        con.execute(ATTACH, {"path": other})
+        try:
+            return merge_attached(con, other, prefer, incremental)
+        finally:
+            con.execute(DETACH)
+
+
+def merge_attached(
+    con: sqlite3.Connection, other: str, prefer: str, incremental: bool
+) -> MergeResult:
+    """Like `merge`, with `other` attached to `con` as `other`."""
+    version = con.execute(GET_OTHER_VERSION).fetchone()[0]
+    if version != SCHEMA_VERSION:
+        raise CommandError(
+            f"{other} has schema version {version}, not {SCHEMA_VERSION}."
+            " Run `init --upgrade` on it with this version of musiclib first"
+        )
+    source = os.path.abspath(other)
+    con.execute(CREATE_SOURCE_TABLE)
+    try:
+        with stage("merge: commit"), con:
+            has_log = con.execute(CHECK_OTHER_CHANGE_LOG).fetchone() is not None
+            if incremental and not has_log:
+                raise CommandError(
+                    f"{other} has no change log. Enable it with"
+                    f" `musiclib -d {other} init --upgrade --change-log`"
+                )
+            since = None
+            if has_log:
+                # Read before the songs: a change made in between is merged
+                # again next time, rather than missed
+                last = con.execute(GET_OTHER_LAST_CHANGE).fetchone()[0]
+                con.execute(CREATE_MERGE_STATE)
+                row = con.execute(GET_MERGE_STATE, {"source": source}).fetchone()
+                if incremental and row is not None:
+                    if row[0] <= last:
+                        since = row[0]
+                    else:
+                        logging.warning(
+                            "the change log of %s was reset; merging every song",
+                            other,
+                        )
+            with stage("merge: stage rows") as staged:
+                if since is None:
+                    staged.items = con.execute(STAGE_ALL_SONGS).rowcount
+                else:
+                    staged.items = con.execute(
+                        STAGE_CHANGED_SONGS, {"since": since}
+                    ).rowcount
+            with stage("merge: add songs") as added:
+                for statement in ADD_NAMES:
+                    con.execute(statement)
+                added.items = con.execute(ADD_SONGS).rowcount
+            with stage("merge: update URLs") as updated:
+                updated.items = con.execute(
+                    MERGE_URLS, {"newer": prefer == PREFER_NEWER}
+                ).rowcount
+            conflicting = con.execute(COUNT_CONFLICTS).fetchone()[0]
+            if has_log:
+                con.execute(SET_MERGE_STATE, {"source": source, "seq": last})
+    finally:
+        con.execute(DROP_SOURCE_TABLE)
+    return MergeResult(
+        staged.items, added.items, updated.items, conflicting, since is not None
+    )
@@ -0,0 +1,187 @@
+import os
+import sqlite3
+import logging
+import itertools
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from ._db import connection
+from ._pool import IO_JOBS, bounded_map_unordered
+from ._progress import Progress
+from .init import upgrade
+from ..exceptions import CommandError
+
+SELECT_PATHS = """
+    SELECT title, artist, album, path FROM library
+    WHERE path IS NOT NULL;
+    """
+
+COUNT_WITHOUT_PATH = """
+    SELECT COUNT(*) FROM library
+    WHERE path IS NULL;
+    """
+
+DELETE_SONG = """
+    DELETE FROM songs
+    WHERE title = :title
+    AND artist_id = (SELECT id FROM artists WHERE name = :artist)
+    AND path = :path;
+    """
+
+DELETE_SCAN_STATE = """
+    DELETE FROM scan_state
+    WHERE path = :path;
+    """
+
+CREATE_GONE_TABLE = """
+    CREATE TEMP TABLE gone_files (path TEXT PRIMARY KEY);
+    """
+
+INSERT_GONE = """
+    INSERT OR IGNORE INTO gone_files (path) VALUES (:path);
+    """
+
+# Other files last read with the tags of the song at a gone path: a song only
+# records the path it was last seen at, but may have copies
+FIND_COPIES = """
+    SELECT library.path, copy.path
+    FROM gone_files AS gone
+    JOIN library ON library.path = gone.path
+    JOIN scan_state AS copy
+    ON copy.title = library.title AND copy.artist = library.artist
+    WHERE copy.path NOT IN (SELECT path FROM gone_files)
+    ORDER BY copy.path;
+    """
+
+DROP_GONE_TABLE = """
+    DROP TABLE IF EXISTS temp.gone_files;
+    """
+
+MOVE_SONGS = """
+    UPDATE songs SET path = :copy WHERE path = :path;
+    """
+
+# Rows deleted per transaction
+DELETE_BATCH_SIZE = 1000
+
+
+class Entry(NamedTuple):
+    title: str
+    artist: str
+    album: Optional[str]
+    path: str
+
+
+def _exists(entry: Entry) -> Tuple[Entry, Optional[bool]]:
+    """Check whether the file of `entry` exists; None if it cannot be known."""
+    try:
+        os.stat(entry.path)
+    except (FileNotFoundError, NotADirectoryError):
+        return entry, False
+    except OSError as err:
+        logging.warning("cannot check %s: %s", entry.path, err)
+        return entry, None
+    return entry, True
+
+
+def find_copies(con: sqlite3.Connection, paths: Iterable[str]) -> Dict[str, str]:
+    """Map the `paths` of files that are gone to an existing copy of their
+    song (a file read with the same title and artist), if there is one."""
+    con.execute(CREATE_GONE_TABLE)
+    try:
+        con.executemany(INSERT_GONE, ({"path": p} for p in paths))
+        candidates = con.execute(FIND_COPIES).fetchall()
+    finally:
+        con.execute(DROP_GONE_TABLE)
+    copies: Dict[str, str] = {}
+    for path, copy in candidates:
+        if path not in copies and os.path.isfile(copy):
+            copies[path] = copy
+    return copies
+
+
+def move_songs(con: sqlite3.Connection, copies: Dict[str, str]) -> None:
+    """Point the songs at the paths of `copies` to the copies (see
+    `find_copies`). Does not commit."""
+    for path, copy in copies.items():
+        logging.info("%s is gone; keeping its song for %s", path, copy)
+    con.executemany(
+        MOVE_SONGS, ({"path": path, "copy": copy} for path, copy in copies.items())
+    )
+
+
+def find_missing(
+    con: sqlite3.Connection,
+    jobs: int = IO_JOBS,
+    progress: Optional[Progress] = None,
+) -> Tuple[List[Entry], int]:
+    """Return the songs of the library whose file is missing, and the number
+    of files checked.
+
+    Files are only stat'ed (their tags are not read), on `jobs` threads.
+    Files that cannot be checked (e.g. permission denied) are kept.
+    """
+    entries = [Entry(*row) for row in con.execute(SELECT_PATHS)]
+    if progress is not None:
+        progress.total = len(entries)
+    missing = []
+    checked = 0
+    for entry, exists in bounded_map_unordered(_exists, entries, jobs, threads=True):
+        checked += 1
+        if exists is False:
+            missing.append(entry)
+        if progress is not None:
+            progress.update()
+    return missing, checked
+
+
+def delete(con: sqlite3.Connection, entries: Iterable[Entry]) -> None:
+    """Delete `entries` from the library and the scan cache, committing every
+    `DELETE_BATCH_SIZE` rows."""
+    entries = iter(entries)
+    while True:
+        batch = [e._asdict() for e in itertools.islice(entries, DELETE_BATCH_SIZE)]
+        if not batch:
+            return
+        with con:
+            con.executemany(DELETE_SONG, batch)
+            con.executemany(DELETE_SCAN_STATE, batch)
+
+
+def purge(
+    database: str,
+    jobs: int = IO_JOBS,
+    dry_run: bool = False,
+    force: bool = False,
+    progress: Optional[Progress] = None,
+) -> List[Entry]:
+    """Remove the songs whose file no longer exists from the library.
+
+    Returns the songs that were (or, with `dry_run`, would be) removed.
+    If every file is missing, nothing is removed unless `force` is set:
+    it is more likely that the music directory is not mounted.
+    Songs added before paths were recorded are never removed, and songs with
+    another file still there (see `find_copies`) are kept, with its path.
+    """
+    with connection(database) as con:
+        with con:
+            upgrade(con)
+        missing, checked = find_missing(con, jobs, progress)
+        without_path = con.execute(COUNT_WITHOUT_PATH).fetchone()[0]
+        if without_path:
+            logging.warning(
+                "%d songs have no recorded path and were not checked"
+                " (add them again to record it)",
+                without_path,
+            )
+        if missing and len(missing) == checked and not force:
+            raise CommandError(
+                f"all {checked} files are missing; is the music directory"
+                " mounted? Use --force to remove them anyway"
+            )
+        copies = find_copies(con, (entry.path for entry in missing))
+        missing = [entry for entry in missing if entry.path not in copies]
+        if not dry_run:
+            with con:
+                move_songs(con, copies)
+                con.executemany(DELETE_SCAN_STATE, ({"path": p} for p in copies))
+            delete(con, missing)
+    return missing
@@ -1,12 +1,14 @@
-import sqlite3
+from ._db import connection
 from ._types import Song, SongList, SongDict
-from ._metadata_analyser import get_metadata
+from ._metadata_analyser import get_metadata_many
+from .init import upgrade
 from typing import Iterable, Generator
 import logging
 
 DIRECT_DELETE = """
-    DELETE FROM library
-    WHERE title = :title AND artist = :artist
+    DELETE FROM songs
+    WHERE title = :title
+    AND artist_id = (SELECT id FROM artists WHERE name = :artist)
     """
 
 CREATE_TEMP_TABLE = """
@@ -22,30 +24,33 @@ INSERT_INTO_TEMP = """
     """
 
 CHECK_MISSING = """
-    SELECT title, artist FROM to_be_deleted
-    WHERE (title, artist) NOT IN (
-        SELECT title, artist FROM library
+    SELECT title, artist FROM to_be_deleted AS old
+    WHERE NOT EXISTS (
+        SELECT 1 FROM library
+        WHERE library.title = old.title AND library.artist = old.artist
     );
     """
 
 DELETE_SONGS = """
-    DELETE FROM library WHERE (title, artist) IN (
-        SELECT title, artist FROM to_be_deleted
+    DELETE FROM songs WHERE id IN (
+        SELECT library.id FROM to_be_deleted AS old
+        JOIN library
+        ON library.title = old.title AND library.artist = old.artist
     );
     """
 
-def remove(database: str, *music_files: str, verbose: int = 0, warn_missing: bool = False) -> None:
+def remove(database: str, *music_files: str, verbose: int = 0, warn_missing: bool = False, jobs: int = 1) -> None:
     music_files = set(music_files)
-    gen = (get_metadata(f).as_dict() for f in music_files)
-    con = sqlite3.connect(database)
-    with con:
-        if warn_missing:
-            con.execute(CREATE_TEMP_TABLE)
-            con.executemany(INSERT_INTO_TEMP, gen)
-            cur = con.execute(CHECK_MISSING)
-            for (title, artist) in cur.fetchall():
-                logging.warning('duplicated: "%s" from "%s"', title, artist)
-            con.execute(DELETE_SONGS)
-        else:
-            con.executemany(DIRECT_DELETE, gen)
-    con.close()
\ No newline at end of file
+    gen = (data.as_dict() for _, data in get_metadata_many(music_files, jobs))
+    with connection(database) as con:
+        with con:
+            upgrade(con)
+            if warn_missing:
+                con.execute(CREATE_TEMP_TABLE)
+                con.executemany(INSERT_INTO_TEMP, gen)
+                cur = con.execute(CHECK_MISSING)
+                for (title, artist) in cur.fetchall():
+                    logging.warning('duplicated: "%s" from "%s"', title, artist)
+                con.execute(DELETE_SONGS)
+            else:
+                con.executemany(DIRECT_DELETE, gen)
\ No newline at end of file
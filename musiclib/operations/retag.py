@@ -0,0 +1,98 @@
+import collections
+import logging
+from typing import Counter, Iterable, Iterator, NamedTuple, Optional, Tuple
+from ._db import connection
+from ._types import Song
+from ._id3 import read_tags, write_tags
+from ._metadata_analyser import set_metadata
+from ._pool import bounded_map_unordered
+from ._progress import Progress
+from .init import upgrade
+
+# Files of the library: the ones songs were added from, and the downloaded ones
+SELECT_FILES = """
+    SELECT title, artist, album, path FROM library
+    WHERE path IS NOT NULL
+    UNION
+    SELECT title, artist, album, download_path FROM library
+    WHERE download_status = 'done' AND download_path IS NOT NULL;
+    """
+
+# Outcomes of `tag_file`
+UNCHANGED = "unchanged"
+IN_PLACE = "in place"
+REWRITTEN = "rewritten"
+FAILED = "failed"
+
+
+class Retagged(NamedTuple):
+    path: str
+    song: Song
+    outcome: str
+    error: Optional[str] = None
+
+
+def tag_file(file: str, song: Song) -> str:
+    """Write the title, artist and album of `song` to `file`.
+
+    Nothing is written if the tags of the file already match (only its tag
+    header is read to check it). Otherwise the tag is rewritten in place if
+    it has room for the new frames, or else the whole file is rewritten by
+    eyed3. Returns which of these happened.
+    """
+    current = read_tags(file)
+    if current is not None and (current.title, current.artist, current.album) == (
+        song.title,
+        song.artist,
+        song.album,
+    ):
+        return UNCHANGED
+    if write_tags(file, song):
+        return IN_PLACE
+    set_metadata(file, song)
+    return REWRITTEN
+
+
+def _tag_file(item: Tuple[str, Song]) -> Retagged:
+    path, song = item
+    try:
+        return Retagged(path, song, tag_file(path, song))
+    except Exception as err:
+        # Only the message: the exception may not be picklable
+        return Retagged(path, song, FAILED, str(err))
+
+
+def tag_files(items: Iterable[Tuple[str, Song]], jobs: int = 1) -> Iterator[Retagged]:
+    """Tag every `(file, song)` of `items` (see `tag_file`) using `jobs`
+    workers, yielding the results as they are ready. A failed file is
+    reported in its result and the rest go on."""
+    return bounded_map_unordered(_tag_file, items, jobs)
+
+
+def retag(
+    database: str, jobs: int = 1, progress: Optional[Progress] = None
+) -> Counter[str]:
+    """Write the metadata in the database back to the files of the library.
+
+    Returns how many files had each outcome (see `tag_file`, and FAILED).
+    """
+    with connection(database) as con:
+        with con:
+            upgrade(con)
+        items = [
+            (path, Song(title=title, artist=artist, album=album))
+            for title, artist, album, path in con.execute(SELECT_FILES)
+        ]
+    if progress is not None:
+        progress.total = len(items)
+    outcomes: Counter[str] = collections.Counter()
+    for result in tag_files(items, jobs):
+        outcomes[result.outcome] += 1
+        if result.outcome == FAILED:
+            logging.error("failed to tag %s: %s", result.path, result.error)
+        if progress is not None:
+            progress.update(
+                failed=1 if result.outcome == FAILED else 0,
+                skipped=1 if result.outcome == UNCHANGED else 0,
+            )
+    return outcomes
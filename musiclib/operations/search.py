@@ -0,0 +1,65 @@
+import sqlite3
+from typing import Iterator, Optional
+from ._db import connection
+from ._types import Song
+from .init import CHECK_SEARCH_INDEX, REBUILD_SEARCH_INDEX
+from ..exceptions import CommandError
+
+# [SQL statements]
+
+SEARCH = """
+    SELECT library.title, library.artist, library.album, library.download_url
+    FROM library_fts JOIN library ON library.id = library_fts.rowid
+    WHERE library_fts MATCH :query
+    ORDER BY rank
+    LIMIT :limit;
+    """
+
+# [/SQL statements]
+
+
+def to_match_expression(text: str) -> str:
+    """Turn free text into an FTS5 query matching songs that have words
+    starting with every word of `text`, in any of title, artist or album."""
+    words = text.split()
+    return " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def search(
+    database: str, text: str, limit: Optional[int] = None, raw: bool = False
+) -> Iterator[Song]:
+    """Yield the songs matching `text`, best matches first.
+
+    Every word of `text` must start a word of the song's title, artist or
+    album. With `raw`, `text` is used as an FTS5 query as is.
+    """
+    with connection(database) as con:
+        yield from search_songs(con, text, limit, raw)
+
+
+def search_songs(
+    con: sqlite3.Connection, text: str, limit: Optional[int] = None, raw: bool = False
+) -> Iterator[Song]:
+    """Like `search`, on an open connection."""
+    query = text if raw else to_match_expression(text)
+    if not query:
+        return
+    if not con.execute(CHECK_SEARCH_INDEX).fetchone():
+        raise CommandError(
+            "the database has no search index. Run `init --upgrade` to build it"
+        )
+    try:
+        cur = con.execute(
+            SEARCH, {"query": query, "limit": -1 if limit is None else limit}
+        )
+    except sqlite3.OperationalError as err:
+        raise CommandError(f"invalid search query: {err}") from err
+    for s in cur:
+        yield Song(title=s[0], artist=s[1], album=s[2], download_url=s[3])
+
+
+def rebuild(database: str) -> None:
+    """Rebuild the search index from scratch."""
+    with connection(database) as con:
+        with con:
+            con.execute(REBUILD_SEARCH_INDEX)
@@ -0,0 +1,325 @@
+"""Library daemon answering requests over a Unix domain socket.
+
+The daemon keeps one connection to the database open, so its page cache
+and prepared statements stay warm between requests, and requests skip the
+interpreter startup and imports of a command.
+
+The protocol is JSON lines: every request is one JSON object on one line,
+answered by one line. A connection may send any number of requests.
+
+    {"id": 1, "op": "list", "args": {"artist": "Queen", "limit": 10}}
+    {"id": 1, "ok": true, "result": [{"title": ..., "artist": ..., ...}]}
+    {"id": 2, "ok": false, "error": "unknown operation: foo"}
+
+`id` is optional and returned as is. The operations and their arguments are
+the methods `op_*` of `Library`.
+"""
+import inspect
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional
+from ._db import connect
+from ..exceptions import CommandError
+
+if TYPE_CHECKING:
+    # Not imported at run time, so that the client stays light
+    from ._types import Song
+
+# Longest request accepted, in bytes
+MAX_REQUEST_SIZE = 1 << 24
+
+
+# How JSON types are named in errors
+JSON_TYPES = {str: "a string", int: "an integer", bool: "a boolean", list: "a list"}
+
+
+def check_type(name: str, value: Any, kind: type, optional: bool = False) -> None:
+    """Raise ValueError unless the argument `name` of a request is a `kind`
+    (or null, if `optional`). A list must be a list of strings."""
+    if value is None and optional:
+        return
+    if (
+        not isinstance(value, kind)
+        or (kind is int and isinstance(value, bool))
+        or (kind is list and not all(isinstance(v, str) for v in value))
+    ):
+        expected = "a list of strings" if kind is list else JSON_TYPES[kind]
+        raise ValueError(
+            f"{name} must be {expected}{' or null' if optional else ''}"
+        )
+
+
+def song_json(song: "Song") -> Dict[str, Optional[str]]:
+    return {
+        "title": song.title,
+        "artist": song.artist,
+        "album": song.album,
+        "download_url": song.download_url,
+    }
+
+
+class Library:
+    """Answers requests on one connection to `database`.
+
+    Requests are handled one at a time: they are short, except `add`.
+    """
+
+    def __init__(self, database: str):
+        self.con = connect(database, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        self.con.close()
+
+    def handle(self, request: Any) -> Dict[str, Any]:
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "a request must be a JSON object"}
+        response: Dict[str, Any] = {}
+        if "id" in request:
+            response["id"] = request["id"]
+        op = request.get("op")
+        args = request.get("args") or {}
+        if not isinstance(args, dict):
+            response.update(ok=False, error="args must be a JSON object")
+            return response
+        method: Optional[Callable[..., Any]] = getattr(
+            self, f"op_{str(op).replace('.', '_')}", None
+        )
+        if method is None:
+            response.update(ok=False, error=f"unknown operation: {op}")
+            return response
+        try:
+            inspect.signature(method).bind(**args)
+        except TypeError as err:
+            response.update(ok=False, error=f"invalid arguments: {err}")
+            return response
+        try:
+            with self.lock:
+                result = method(**args)
+        except (CommandError, ValueError) as err:
+            response.update(ok=False, error=str(err))
+        except Exception as err:
+            logging.exception("failed to handle %s", op)
+            response.update(ok=False, error=f"internal error: {err}")
+        else:
+            response.update(ok=True, result=result)
+        return response
+
+    def op_ping(self) -> str:
+        return "pong"
+
+    def op_list(
+        self,
+        title: Optional[str] = None,
+        artist: Optional[str] = None,
+        album: Optional[str] = None,
+        has_url: Optional[bool] = None,
+        sort: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> List[Dict[str, Optional[str]]]:
+        """Like the `list` command. `sort` is as in `--sort`."""
+        from . import list as op_list
+
+        for name, value in (
+            ("title", title),
+            ("artist", artist),
+            ("album", album),
+            ("sort", sort),
+        ):
+            check_type(name, value, str, optional=True)
+        check_type("has_url", has_url, bool, optional=True)
+        check_type("limit", limit, int, optional=True)
+        check_type("offset", offset, int)
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be at least 1")
+        if offset < 0:
+            raise ValueError("offset must be at least 0")
+        query = op_list.Query(
+            title=title,
+            artist=artist,
+            album=album,
+            has_url=has_url,
+            sort=op_list.parse_sort(sort) if sort else op_list.DEFAULT_SORT,
+            limit=limit,
+            offset=offset,
+        )
+        return [song_json(s) for s in op_list.query_songs(self.con, query)]
+
+    def op_search(
+        self, text: str, limit: Optional[int] = None, raw: bool = False
+    ) -> List[Dict[str, Optional[str]]]:
+        from .search import search_songs
+
+        check_type("text", text, str)
+        check_type("limit", limit, int, optional=True)
+        check_type("raw", raw, bool)
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be at least 1")
+        return [song_json(s) for s in search_songs(self.con, text, limit, raw)]
+
+    def op_add(
+        self,
+        files: Iterable[str],
+        warn_duplicates: bool = True,
+        use_cache: bool = True,
+        extensions: Optional[Iterable[str]] = None,
+        audio_hash: bool = False,
+    ) -> Dict[str, int]:
+        """Like the `add` command. `files` must be absolute paths."""
+        from .add import add_files
+
+        check_type("files", files, list)
+        check_type("extensions", extensions, list, optional=True)
+        for name, value in (
+            ("warn_duplicates", warn_duplicates),
+            ("use_cache", use_cache),
+            ("audio_hash", audio_hash),
+        ):
+            check_type(name, value, bool)
+        if any(not os.path.isabs(f) for f in files):
+            raise ValueError("paths must be absolute")
+        stats = add_files(
+            self.con,
+            files,
+            warn_duplicates=warn_duplicates,
+            use_cache=use_cache,
+            extensions=extensions,
+            audio_hash=audio_hash,
+        )
+        return {
+            "total": stats.total,
+            "cached": stats.cached,
+            "unreadable": stats.unreadable,
+        }
+
+    def op_url_get(self, format: str = "youtube-dl") -> str:
+        """The output of `url get`."""
+        from . import url as op_url
+
+        buf = io.StringIO()
+        if format == "youtube-dl":
+            op_url.write_ytdl(self.con, buf)
+        elif format == "raw":
+            op_url.write_raw(self.con, buf)
+        else:
+            raise ValueError(f"unknown format: {format}")
+        return buf.getvalue()
+
+    def op_url_set(self, text: str, format: str = "template") -> Dict[str, Any]:
+        """Like `url set`, with the contents of the file. Returns the fields
+        of its `ImportResult`."""
+        from . import url as op_url
+
+        check_type("text", text, str)
+        if format not in op_url.FORMATS:
+            raise ValueError(f"unknown format: {format}")
+        try:
+            result = op_url.set_urls(self.con, io.StringIO(text), format)
+        except op_url.MalformedFile as err:
+            raise CommandError(f"failed to parse file: {err}") from err
+        return result._asdict()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "Server"
+
+    def handle(self) -> None:
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_SIZE + 1)
+            if not line:
+                return
+            if len(line) > MAX_REQUEST_SIZE:
+                response = {"ok": False, "error": "request too long"}
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+                return
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as err:
+                response = {"ok": False, "error": f"invalid JSON: {err}"}
+            else:
+                response = self.server.library.handle(request)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, library: Library):
+        self.library = library
+        super().__init__(path, _Handler)
+
+
+def _remove_stale_socket(path: str) -> None:
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise CommandError(f"a daemon is already listening on {path}")
+
+
+def serve(database: str, path: str) -> None:
+    """Answer requests on the Unix socket `path` until interrupted
+    (KeyboardInterrupt)."""
+    _remove_stale_socket(path)
+    library = Library(database)
+    old_umask = os.umask(0o077)  # Only the owner may connect
+    try:
+        server = Server(path, library)
+    finally:
+        os.umask(old_umask)
+    try:
+        logging.info("listening on %s", path)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+        library.close()
+
+
+class Client:
+    """Connection to a daemon started by `serve`."""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(path)
+        except OSError as err:
+            self.sock.close()
+            raise CommandError(f"cannot connect to the daemon on {path}: {err}")
+        self.file = self.sock.makefile("rwb")
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def request(self, op: str, **args: Any) -> Any:
+        """Send a request and return its result. Errors raise CommandError."""
+        self.file.write(json.dumps({"op": op, "args": args}).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise CommandError("the daemon closed the connection")
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise CommandError(response.get("error", "request failed"))
+        return response.get("result")
@@ -1,8 +1,16 @@
-import sqlite3
+import itertools
+import json
+import logging
+import re
 import shlex
-from typing import TextIO, BinaryIO, Generator, Dict, Optional
+import sqlite3
+import time
+from typing import TextIO, BinaryIO, Generator, Dict, Iterable, List, NamedTuple
 
-from . import download
+from .._db import DEFAULT_BATCH_SIZE, connection
+from .._stats import stage, timed_iter
+from .._types import ColumnWidths
+from ..init import upgrade
 __all__ = ['download']
 
 class MalformedFile(Exception):
@@ -26,14 +34,135 @@ MAKE_TEMPLATE = """
     ORDER BY title ASC, artist ASC;
     """
 
-SET_URL = """
-    UPDATE library
-    SET download_url = :url
-    WHERE title = :title AND artist = :artist;
+# Lines of an import, by song. When a song is on several lines, the last one
+# wins, and `conflict` is set if they disagree.
+CREATE_IMPORT_TABLE = """
+    CREATE TEMP TABLE url_import (
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        url TEXT,
+        line INTEGER NOT NULL,
+        conflict INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (title, artist)
+    );
+    """
+
+INSERT_IMPORT = """
+    INSERT INTO url_import (title, artist, url, line)
+    VALUES (:title, :artist, :url, :line)
+    ON CONFLICT (title, artist) DO UPDATE
+    SET conflict = conflict OR url IS NOT excluded.url,
+        url = excluded.url,
+        line = excluded.line;
+    """
+
+# A new URL invalidates the download state of the song, and is timestamped
+# (for `merge`). The CROSS JOIN
+# keeps the import table first: SQLite has no statistics about it,
+# and would rather scan every song.
+APPLY_IMPORT = """
+    UPDATE songs
+    SET download_url = new.url,
+        download_status = CASE
+            WHEN songs.download_url IS new.url THEN download_status ELSE NULL
+        END,
+        download_attempts = CASE
+            WHEN songs.download_url IS new.url THEN download_attempts ELSE 0
+        END,
+        download_url_updated = CASE
+            WHEN songs.download_url IS new.url THEN download_url_updated ELSE :now
+        END
+    FROM url_import AS new
+    CROSS JOIN artists ON artists.name = new.artist
+    WHERE songs.title = new.title AND songs.artist_id = artists.id;
+    """
+
+# UPDATE ... FROM needs SQLite 3.33
+APPLY_IMPORT_LEGACY = """
+    UPDATE songs
+    SET (
+        download_url, download_status, download_attempts, download_url_updated
+    ) = (
+        SELECT new.url,
+            CASE WHEN songs.download_url IS new.url
+                THEN songs.download_status ELSE NULL END,
+            CASE WHEN songs.download_url IS new.url
+                THEN songs.download_attempts ELSE 0 END,
+            CASE WHEN songs.download_url IS new.url
+                THEN songs.download_url_updated ELSE :now END
+        FROM url_import AS new
+        JOIN artists ON artists.name = new.artist
+        WHERE new.title = songs.title AND artists.id = songs.artist_id
+    )
+    WHERE EXISTS (
+        SELECT 1 FROM url_import AS new
+        JOIN artists ON artists.name = new.artist
+        WHERE new.title = songs.title AND artists.id = songs.artist_id
+    );
+    """
+
+SELECT_UNMATCHED = """
+    SELECT line, title, artist FROM url_import AS new
+    WHERE NOT EXISTS (
+        SELECT 1 FROM library
+        WHERE library.title = new.title AND library.artist = new.artist
+    )
+    ORDER BY line;
     """
 
+SELECT_CONFLICTS = """
+    SELECT line, title, artist FROM url_import
+    WHERE conflict
+    ORDER BY line;
+    """
+
+DROP_IMPORT_TABLE = """
+    DROP TABLE IF EXISTS temp.url_import;
+    """
+
+# Formats of the files of `template` and `set`
+TEMPLATE = "template"
+TSV = "tsv"
+NDJSON = "ndjson"
+FORMATS = (TEMPLATE, TSV, NDJSON)
+
+TSV_HEADER = "title\tartist\tdownload_url"
+_TSV_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+_TSV_UNESCAPES = {v: k for k, v in _TSV_ESCAPES.items()}
+_TSV_ESCAPED = re.compile(r"[\\\t\n\r]")
+_TSV_UNESCAPED = re.compile(r"\\[\\tnr]")
+
+# A template line of three words quoted like `shlex.quote` does (as written
+# by `template`), which can be parsed without shlex, which is slow. In such
+# words, every single quote is a delimiter.
+_WORD = r"((?:'[^']*'|[^\s'\"\\#]+)+)"
+_QUOTED_LINE = re.compile(rf"\s*{_WORD}\s+{_WORD}\s+{_WORD}\s*")
+
+# A line of a URL file: its number and song, and the URL
+ImportLine = Dict[str, object]
+
+
+class LineRef(NamedTuple):
+    line: int
+    title: str
+    artist: str
+
+
+class ImportResult(NamedTuple):
+    """Outcome of `import_urls`. `unmatched` are the lines naming no song of
+    the library; `conflicting`, the last line of the songs given different
+    URLs on several lines (the one applied)."""
+
+    lines: int
+    updated: int
+    unmatched: List[LineRef]
+    conflicting: List[LineRef]
+
 def get_ytdl(database: str, file: TextIO) -> None:
-    con = sqlite3.connect(database)
+    with connection(database) as con:
+        write_ytdl(con, file)
+
+def write_ytdl(con: sqlite3.Connection, file: TextIO) -> None:
     cur = con.execute(GET_ALL_URLS)
     r = cur.fetchone()
     while r:
@@ -49,51 +178,168 @@ def get_ytdl(database: str, file: TextIO) -> None:
         r = cur.fetchone()
 
 def get_raw(database: str, file: TextIO) -> None:
-    con = sqlite3.connect(database)
+    with connection(database) as con:
+        write_raw(con, file)
+
+def write_raw(con: sqlite3.Connection, file: TextIO) -> None:
     cur = con.execute(GET_RAW)
     r = cur.fetchone()
     while r:
         file.write(f'{r[0]}\n')
         r = cur.fetchone()
 
-def template(database: str, file: TextIO) -> None:
-    con = sqlite3.connect(database)
-    cur = con.execute(MAKE_TEMPLATE)
+def template(database: str, file: TextIO, align: bool = True, format: str = TEMPLATE) -> None:
+    """Write a template for `set_from_file`, in `format`. Without `align`, the
+    columns are not padded and each line is written as soon as it is read
+    (TSV and NDJSON are never padded)."""
     TITLE_PLACEHOLDER = "<title>"
     ARTIST_PLACEHOLDER = "<artist>"
     URL_PLACEHOLDER = "<download url>"
-    title_len = len(TITLE_PLACEHOLDER)
-    artist_len = len(ARTIST_PLACEHOLDER)
-    res = []
-    r = cur.fetchone()
-    while r:
-        title = shlex.quote(r[0])
-        artist = shlex.quote(r[1])
-        url = shlex.quote(r[2])
-        title_len = max(title_len, len(title))
-        artist_len = max(artist_len, len(artist))
-        res.append((title, artist, url))
-        r = cur.fetchone()
+    with connection(database) as con:
+        cur = con.execute(MAKE_TEMPLATE)
+        if format == TSV:
+            file.write(f"{TSV_HEADER}\n")
+            for r in cur:
+                file.write("\t".join(map(_tsv_escape, r)) + "\n")
+            return
+        if format == NDJSON:
+            for title, artist, url in cur:
+                doc = {"title": title, "artist": artist, "download_url": url or None}
+                file.write(json.dumps(doc) + "\n")
+            return
+        rows = (tuple(shlex.quote(v) for v in r) for r in cur)
+        if not align:
+            file.write(f"# {TITLE_PLACEHOLDER} {ARTIST_PLACEHOLDER} {URL_PLACEHOLDER}\n")
+            for r in rows:
+                file.write(f"{r[0]} {r[1]} {r[2]}\n")
+            return
+        widths = ColumnWidths.of(len(TITLE_PLACEHOLDER), len(ARTIST_PLACEHOLDER))
+        res = []
+        for r in rows:
+            widths.update(r)
+            res.append(r)
+    title_len, artist_len = widths.widths
     file.write("# {t:{t_l}} {a:{a_l}} {u}\n".format(
         t=TITLE_PLACEHOLDER, t_l=title_len - 2, a=ARTIST_PLACEHOLDER, a_l=artist_len, u=URL_PLACEHOLDER))
     for r in res:
         file.write("{r[0]:{t_l}} {r[1]:{a_l}} {r[2]}\n".format(
             r=r, t_l=title_len, a_l=artist_len
         ))
-    con.close()
 
-def get_lines(file: TextIO) -> Generator[Dict[str, Optional[str]], None, None]:
-    for line in file:
+def _tsv_escape(value: str) -> str:
+    return _TSV_ESCAPED.sub(lambda m: _TSV_ESCAPES[m.group()], value)
+
+def _tsv_unescape(value: str) -> str:
+    if "\\" not in value:
+        return value
+    return _TSV_UNESCAPED.sub(lambda m: _TSV_UNESCAPES[m.group()], value)
+
+def get_lines(file: TextIO) -> Generator[ImportLine, None, None]:
+    for number, line in enumerate(file, 1):
+        match = _QUOTED_LINE.fullmatch(line)
+        if match is not None:
+            title, artist, url = (w.replace("'", "") for w in match.groups())
+            yield {'title': title, 'artist': artist, 'url': url if url else None, 'line': number}
+            continue
         try:
             parsed_line = shlex.split(line, comments=True)
             if not parsed_line:
                 continue
             title, artist, url = parsed_line
-            yield {'title': title, 'artist': artist, 'url': url if url else None}
+            yield {'title': title, 'artist': artist, 'url': url if url else None, 'line': number}
         except ValueError:
-            raise MalformedFile(f"line `{line}` is incomplete")
+            raise MalformedFile(f"line {number} `{line.rstrip()}` is incomplete")
 
-def set_from_file(database: str, file: TextIO) -> None:
-    con = sqlite3.connect(database)
+def get_lines_tsv(file: TextIO) -> Generator[ImportLine, None, None]:
+    """Lines of a TSV file (title, artist and URL, with an optional header).
+    Tabs, newlines and backslashes in values are escaped as \\t, \\n, \\r
+    and \\\\."""
+    for number, line in enumerate(file, 1):
+        line = line.rstrip("\r\n")
+        if not line or (number == 1 and line == TSV_HEADER):
+            continue
+        fields = line.split("\t")
+        if len(fields) != 3:
+            raise MalformedFile(f"line {number} has {len(fields)} fields instead of 3")
+        title, artist, url = map(_tsv_unescape, fields)
+        yield {'title': title, 'artist': artist, 'url': url or None, 'line': number}
+
+def get_lines_ndjson(file: TextIO) -> Generator[ImportLine, None, None]:
+    """Lines of a file of JSON objects with a title, an artist and a
+    download_url (which may be null or missing), one per line, like the
+    output of `list --ndjson`."""
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            doc = json.loads(line)
+        except ValueError as err:
+            raise MalformedFile(f"line {number}: {err}") from None
+        if not isinstance(doc, dict) or "title" not in doc or "artist" not in doc:
+            raise MalformedFile(f"line {number}: not an object with a title and an artist")
+        title, artist, url = doc["title"], doc["artist"], doc.get("download_url")
+        if not all(isinstance(v, str) for v in (title, artist, url or "")):
+            raise MalformedFile(f"line {number}: values must be strings")
+        yield {'title': title, 'artist': artist, 'url': url or None, 'line': number}
+
+LINE_READERS = {TEMPLATE: get_lines, TSV: get_lines_tsv, NDJSON: get_lines_ndjson}
+
+def set_from_file(database: str, file: TextIO, format: str = TEMPLATE) -> ImportResult:
+    with connection(database) as con:
+        return set_urls(con, file, format)
+
+def set_urls(con: sqlite3.Connection, file: TextIO, format: str = TEMPLATE) -> ImportResult:
+    """Set the URLs of the songs in `file` (in `format`), in a single
+    transaction: nothing is set if the file is malformed."""
+    return import_urls(con, LINE_READERS[format](file))
+
+def import_urls(
+    con: sqlite3.Connection,
+    lines: Iterable[ImportLine],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> ImportResult:
+    """Set the URLs of `lines` in one transaction.
+
+    The lines are loaded into a temporary table, `batch_size` at a time,
+    then applied with a single UPDATE joining it with the library.
+    """
+    lines = timed_iter("url set: parse", lines)
+    count = 0
     with con:
-        con.executemany(SET_URL, get_lines(file))
\ No newline at end of file
+        upgrade(con)
+    con.execute(CREATE_IMPORT_TABLE)
+    try:
+        with stage("url set: commit"), con:
+            while True:
+                batch = list(itertools.islice(lines, batch_size))
+                if not batch:
+                    break
+                with stage("url set: stage rows", len(batch)):
+                    con.executemany(INSERT_IMPORT, batch)
+                count += len(batch)
+            with stage("url set: update") as update:
+                apply = (
+                    APPLY_IMPORT
+                    if sqlite3.sqlite_version_info >= (3, 33, 0)
+                    else APPLY_IMPORT_LEGACY
+                )
+                updated = con.execute(apply, {"now": time.time()}).rowcount
+                update.items = updated
+            with stage("url set: report"):
+                unmatched = [LineRef(*r) for r in con.execute(SELECT_UNMATCHED)]
+                conflicting = [LineRef(*r) for r in con.execute(SELECT_CONFLICTS)]
+    finally:
+        con.execute(DROP_IMPORT_TABLE)
+    return ImportResult(count, updated, unmatched, conflicting)
+
+def report_import(result: ImportResult) -> None:
+    for line, title, artist in result.unmatched:
+        logging.warning('line %d: no song "%s" from "%s"', line, title, artist)
+    for line, title, artist in result.conflicting:
+        logging.warning(
+            'line %d: "%s" from "%s" is on several lines with different URLs;'
+            " this one was applied",
+            line,
+            title,
+            artist,
+        )
\ No newline at end of file
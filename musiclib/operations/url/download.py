@@ -1,55 +1,427 @@
 import sqlite3
 import logging
 import os.path
-import glob
-from .._metadata_analyser import set_metadata
+import shutil
+import threading
+import contextlib
+import hashlib
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+from urllib.parse import urlparse, unquote
+from .._db import connection
 from .._types import Song
+from .._pool import bounded_map_unordered
+from .._progress import Progress
+from .. import _stats
+from ..init import upgrade
+from ..retag import tag_file
 from ...exceptions import RequiresYtdlError
 
-SELECT_ALL_DATA = """
-    SELECT title, artist, album, download_url
+# Tracks to download: never downloaded, possibly done (if the file is
+# missing, see `do_download`) and failed ones whose retry delay has elapsed
+TRACKS_FILTER = """
+    download_url IS NOT NULL AND (
+        :force
+        OR download_status IS NULL
+        OR download_status = 'done'
+        OR (
+            download_status = 'failed'
+            AND NOT :only_missing
+            AND download_last_attempt + MIN(
+                :retry_delay * (1 << MIN(download_attempts - 1, 20)),
+                :max_retry_delay
+            ) <= :now
+        )
+    )
+    """
+
+SELECT_TRACKS = f"""
+    SELECT title, artist, album, download_url, download_status, download_path
     FROM library
-    WHERE download_url IS NOT NULL;
+    WHERE {TRACKS_FILTER};
     """
 
-SELECT_COUNT = """
+SELECT_COUNT = f"""
     SELECT COUNT(*)
     FROM library
-    WHERE download_url IS NOT NULL;
+    WHERE {TRACKS_FILTER};
+    """
+
+MARK_DONE = """
+    UPDATE songs
+    SET download_status = 'done',
+        download_path = :path,
+        download_hash = :hash,
+        download_attempts = 0,
+        download_last_attempt = :now,
+        download_error = NULL
+    WHERE title = :title
+    AND artist_id = (SELECT id FROM artists WHERE name = :artist);
+    """
+
+MARK_FAILED = """
+    UPDATE songs
+    SET download_status = 'failed',
+        download_attempts = download_attempts + 1,
+        download_last_attempt = :now,
+        download_error = :error
+    WHERE title = :title
+    AND artist_id = (SELECT id FROM artists WHERE name = :artist);
+    """
+
+# Delay before retrying a failed track on a later run, doubled after every
+# failed run (in seconds)
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 24 * 60 * 60
+
+# Delay before retrying a failed download within a run, doubled after every
+# attempt (in seconds)
+RETRY_BACKOFF = 1
+
+# Output templates, relative to the output directory, by name. Fields in
+# braces are from the library (title, artist, album), the `%(...)s` ones
+# from youtube-dl. Sharding by artist (and album) keeps directories small.
+LAYOUTS = {
+    "flat": "%(title)s-%(id)s.%(ext)s",
+    "artist": "{artist}/{title}.%(ext)s",
+    "album": "{artist}/{album}/{title}.%(ext)s",
+}
+DEFAULT_LAYOUT = "flat"
+UNKNOWN_ALBUM = "Unknown album"
+
+# Anything with the subset of the `youtube_dl.YoutubeDL` interface used here:
+# a context manager built from an options dict (its copy is kept as
+# `params`, read on every download), with `extract_info` and
+# `add_post_processor`.
+DownloaderFactory = Callable[[Dict[str, Any]], Any]
+
+
+class Track(NamedTuple):
+    title: str
+    artist: str
+    album: Optional[str]
+    download_url: str
+    status: Optional[str] = None
+    path: Optional[str] = None
+
+    def song(self) -> Song:
+        return Song(title=self.title, artist=self.artist, album=self.album)
+
+
+class LocalDownloader:
+    """Offline stand-in for `youtube_dl.YoutubeDL`.
+
+    "Downloads" local paths or file:// URLs by copying them to the
+    output template, so downloads can be checked without network access.
     """
 
-def change_extension(video_filename: str) -> str:
-    """Workaround to get audio-only extension, since youtube-dl
-        only outputs the filename before the post-processing.
+    def __init__(self, params: Dict[str, Any]):
+        self.params = dict(params)
+        self.postprocessors: List[Any] = []
+
+    def __enter__(self) -> "LocalDownloader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def extract_info(self, url: str, download: bool = True) -> Dict[str, Any]:
+        parsed = urlparse(url)
+        source = unquote(parsed.path) if parsed.scheme == "file" else url
+        name, ext = os.path.splitext(os.path.basename(source))
+        info = {"id": name, "title": name, "ext": ext.lstrip("."), "url": source}
+        if download:
+            filename = self.prepare_filename(info)
+            os.makedirs(os.path.dirname(filename) or os.curdir, exist_ok=True)
+            shutil.copyfile(source, filename)
+            for hook in self.params.get("progress_hooks", ()):
+                hook(
+                    {
+                        "status": "finished",
+                        "filename": filename,
+                        "total_bytes": os.path.getsize(filename),
+                    }
+                )
+            processed = dict(info, filepath=filename)
+            for pp in self.postprocessors:
+                _, processed = pp.run(processed)
+        return info
+
+    def prepare_filename(self, info: Dict[str, Any]) -> str:
+        template = self.params.get("outtmpl", "%(title)s-%(id)s.%(ext)s")
+        return template % info
+
+    def add_post_processor(self, pp: Any) -> None:
+        pp.set_downloader(self)
+        self.postprocessors.append(pp)
+
+
+class FinalPath:
+    """youtube-dl postprocessor recording the path of the downloaded file.
+
+    Added after the others (e.g. the audio extraction, which changes the
+    extension), it gets the path of the final file, so there is no need to
+    guess it from the name before post-processing.
     """
-    name = os.path.splitext(video_filename)[0]
-    globbed_filename = glob.escape(name) + '.*'
-    return glob.glob(globbed_filename)[0]
 
-def do_download(database: str):
+    def __init__(self) -> None:
+        self.path: Optional[str] = None
+
+    def set_downloader(self, downloader: Any) -> None:
+        pass
+
+    def run(self, info: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+        self.path = info["filepath"]
+        return [], info
+
+
+def _path_component(value: str) -> str:
+    value = value.replace("/", "_").replace(os.sep, "_").replace("\0", "_")
+    if value in ("", ".", ".."):
+        value = "_"
+    return value.replace("%", "%%")  # Literal in the youtube-dl template
+
+
+def resolve_layout(layout: str) -> str:
+    """The output template of `layout`: a name from LAYOUTS, or a template
+    with the same fields. Raises ValueError for an invalid template."""
+    template = LAYOUTS.get(layout, layout)
+    try:
+        template.format(title="", artist="", album="")
+    except KeyError as err:
+        raise ValueError(f"invalid layout {layout!r}: unknown field {err}") from None
+    except (IndexError, ValueError) as err:
+        raise ValueError(f"invalid layout {layout!r}: {err}") from None
+    if os.path.isabs(template):
+        raise ValueError(f"invalid layout {layout!r}: must be a relative path")
+    return template
+
+
+def output_template(template: str, directory: str, track: Track) -> str:
+    """The youtube-dl output template of `track`, under `directory`."""
+    return os.path.join(
+        directory,
+        template.format(
+            title=_path_component(track.title),
+            artist=_path_component(track.artist),
+            album=_path_component(track.album or UNKNOWN_ALBUM),
+        ),
+    )
+
+
+def file_hash(filename: str) -> str:
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def tag_and_hash(filename: str, song: Song) -> str:
+    with _stats.stage("download: tag"):
+        tag_file(filename, song)
+    with _stats.stage("download: hash"):
+        return file_hash(filename)
+
+
+def youtube_dl_factory() -> DownloaderFactory:
     try:
         import youtube_dl
     except ModuleNotFoundError as mnf_err:
         raise RequiresYtdlError from mnf_err
-    con = sqlite3.connect(database)
-    total = con.execute(SELECT_COUNT).fetchone()[0]
+    return youtube_dl.YoutubeDL
+
+
+def do_download(
+    database: str,
+    jobs: int = 1,
+    downloader: Optional[DownloaderFactory] = None,
+    only_missing: bool = False,
+    force: bool = False,
+    retries: int = 2,
+    output_dir: Optional[str] = None,
+    layout: str = DEFAULT_LAYOUT,
+):
+    """Download the URLs in the database and tag the resulting files.
+
+    See `download_tracks`. `downloader` defaults to `youtube_dl.YoutubeDL`.
+    """
+    if downloader is None:
+        downloader = youtube_dl_factory()
+    with connection(database) as con:
+        download_tracks(
+            con, downloader, jobs, only_missing, force, retries, output_dir, layout
+        )
+
+
+def download_tracks(
+    con: sqlite3.Connection,
+    downloader: DownloaderFactory,
+    jobs: int = 1,
+    only_missing: bool = False,
+    force: bool = False,
+    retries: int = 2,
+    output_dir: Optional[str] = None,
+    layout: str = DEFAULT_LAYOUT,
+):
+    """Download the URLs in the database of `con` and tag the resulting files.
+
+    The state of every track is kept in the database, so an interrupted run
+    can be resumed: tracks already downloaded (whose file still exists) are
+    skipped, and failed ones are retried on later runs after a delay that
+    doubles on every failure. With `only_missing`, failed tracks are not
+    retried; with `force`, everything is downloaded again.
+    A failed download is retried `retries` times within the run.
+
+    Downloads run on `jobs` threads, each with its own `downloader` (e.g.
+    `youtube_dl.YoutubeDL`, or `LocalDownloader`). Tags are written by a
+    separate thread, so downloads do not wait for them. A failed track is
+    reported and the rest go on.
+
+    Files are written under `output_dir` (by default, the working
+    directory) following `layout` (see `resolve_layout`). The path of every
+    file is taken from youtube-dl once it is post-processed, and recorded.
+    """
+    template = resolve_layout(layout)
+    output_dir = os.path.abspath(output_dir or os.curdir)
+    with con:
+        upgrade(con)
+    params = {
+        "force": force,
+        "only_missing": only_missing,
+        "retry_delay": RETRY_DELAY,
+        "max_retry_delay": MAX_RETRY_DELAY,
+        "now": time.time(),
+    }
+    total = con.execute(SELECT_COUNT, params).fetchone()[0]
+    progress = Progress(total, unit="tracks")
+
+    def hook(d: Dict[str, Any]) -> None:
+        if d["status"] == "finished":
+            local.fetched = time.perf_counter()
+            progress.add_bytes(d.get("total_bytes") or d.get("downloaded_bytes") or 0)
+
     ytdl_opts = {
         'format': 'bestaudio/best',
         'postprocessors': [{
             'key': 'FFmpegExtractAudio',
             'preferredcodec': 'mp3'
-        }]
+        }],
+        'quiet': True,
+        'noprogress': True,
+        'progress_hooks': [hook],
     }
-    with youtube_dl.YoutubeDL(ytdl_opts) as ytdl:
-        cur = con.execute(SELECT_ALL_DATA)
-        res = cur.fetchone()
-        count = 1
-        while res:
-            title, artist, album, download_url = res
-            #logging.info("%d of %d: %s - %s", count, total, title, artist)
-            print("%d of %d: %s - %s" % (count, total, title, artist))
-            info = ytdl.extract_info(download_url, download=True)
-            filename = change_extension(ytdl.prepare_filename(info))
-            set_metadata(filename, Song(title=title, artist=artist, album=album))
-            res = cur.fetchone()
-            count += 1
\ No newline at end of file
+    local = threading.local()
+    lock = threading.Lock()
+    # (track, filename, hash, error) of every tagged track. Only this thread
+    # writes them to the database.
+    finished: queue.Queue = queue.Queue()
+
+    def record(track: Track, error: Optional[BaseException], **values) -> None:
+        with _stats.stage("download: record"), con:
+            if error is None:
+                con.execute(
+                    MARK_DONE, {**track._asdict(), **values, "now": time.time()}
+                )
+            else:
+                con.execute(
+                    MARK_FAILED,
+                    {**track._asdict(), "error": str(error), "now": time.time()},
+                )
+        progress.update(
+            failed=1 if error else 0, message=f"{track.title} - {track.artist}"
+        )
+
+    def record_finished() -> None:
+        while True:
+            try:
+                track, filename, hash_, err = finished.get_nowait()
+            except queue.Empty:
+                return
+            if err is not None:
+                logging.error(
+                    'failed to tag "%s" from "%s": %s', track.title, track.artist, err
+                )
+            record(track, err, path=os.path.abspath(filename), hash=hash_)
+
+    with contextlib.ExitStack() as instances:
+
+        def fetch(track: Track) -> Tuple[Track, Optional[str], Optional[Exception]]:
+            ytdl = getattr(local, "ytdl", None)
+            if ytdl is None:
+                with lock:
+                    ytdl = local.ytdl = instances.enter_context(downloader(ytdl_opts))
+                local.final = FinalPath()
+                ytdl.add_post_processor(local.final)
+            final = local.final
+            ytdl.params["outtmpl"] = output_template(template, output_dir, track)
+            for attempt in range(retries + 1):
+                try:
+                    final.path = None
+                    local.fetched = None
+                    start = time.perf_counter()
+                    ytdl.extract_info(track.download_url, download=True)
+                    if final.path is None:
+                        raise RuntimeError("no file was downloaded")
+                    if _stats.enabled():
+                        # The download ends with the last progress hook, then
+                        # the file is post-processed (e.g. by ffmpeg)
+                        end = time.perf_counter()
+                        fetched = local.fetched or end
+                        _stats.record("download: fetch", fetched - start)
+                        _stats.record("download: post-process", end - fetched)
+                    return track, final.path, None
+                except Exception as err:
+                    if attempt == retries:
+                        logging.error(
+                            'failed to download "%s" from "%s": %s',
+                            track.title,
+                            track.artist,
+                            err,
+                        )
+                        return track, None, err
+                    time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+        def tagged(track: Track, filename: str, future: Future) -> None:
+            err = future.exception()
+            finished.put((track, filename, None if err else future.result(), err))
+
+        def pending() -> Generator[Track, None, None]:
+            for row in con.execute(SELECT_TRACKS, params):
+                track = Track(*row)
+                if (
+                    not force
+                    and track.status == "done"
+                    and track.path
+                    and os.path.exists(track.path)
+                ):
+                    progress.update(skipped=1)
+                    continue
+                yield track
+
+        with ThreadPoolExecutor(max_workers=1) as tagger:
+            for track, filename, err in bounded_map_unordered(
+                fetch, pending(), jobs, threads=True
+            ):
+                record_finished()
+                if filename is None:
+                    record(track, err)
+                    continue
+                tagger.submit(tag_and_hash, filename, track.song()).add_done_callback(
+                    lambda future, track=track, filename=filename: tagged(
+                        track, filename, future
+                    )
+                )
+        record_finished()
+    progress.close()
@@ -0,0 +1,448 @@
+"""Keep the library in sync with directories as files change.
+
+Changes are read from inotify on Linux, or else found by comparing
+snapshots of the size and modification time of every file. They are
+collected until the directories have been quiet for a while (so that a file
+being copied is only read once it is complete), then applied in a single
+transaction: songs whose file was deleted or moved away are removed, and
+new, modified or moved-in files go through the scan of `add`. A modified
+file only replaces the song at its path if its tags changed: otherwise the
+song keeps its id, URL and download state.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import sqlite3
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import attr
+from ._db import DEFAULT_BATCH_SIZE, connection
+from ._files import iter_music_files, normalize_extensions, walk
+from ._progress import Progress
+from .add import get_generator, insert_songs, scan
+from .init import upgrade
+from .purge import find_copies, move_songs
+from ..exceptions import CommandError
+
+# [SQL statements]
+
+DELETE_SONGS_AT = """
+    DELETE FROM songs WHERE path = :path;
+    """
+
+# The changed files (with NULL tags if they are unreadable now)
+CREATE_CHANGED_TABLE = """
+    CREATE TEMP TABLE changed_files (
+        path TEXT NOT NULL,
+        title TEXT,
+        artist TEXT
+    );
+    """
+
+INSERT_CHANGED = """
+    INSERT INTO changed_files (path, title, artist)
+    VALUES (:path, :title, :artist);
+    """
+
+# Songs at a changed path that no changed file has the tags of anymore.
+# Checked against every changed file, so that two files swapping their
+# tags keep both songs.
+STALE_SONGS = """
+    FROM songs
+    WHERE path IN (SELECT path FROM changed_files)
+    AND id NOT IN (
+        SELECT library.id FROM changed_files AS new
+        JOIN library
+        ON library.title = new.title AND library.artist = new.artist
+    )
+    """
+
+SELECT_STALE_PATHS = f"""
+    SELECT DISTINCT path {STALE_SONGS};
+    """
+
+DELETE_STALE_SONGS = f"""
+    DELETE {STALE_SONGS};
+    """
+
+DROP_CHANGED_TABLE = """
+    DROP TABLE IF EXISTS temp.changed_files;
+    """
+
+DELETE_SCAN_STATE_AT = """
+    DELETE FROM scan_state WHERE path = :path;
+    """
+
+# Paths under a directory: '0' is the character after '/'
+SELECT_SONG_PATHS_UNDER = """
+    SELECT DISTINCT path FROM songs
+    WHERE path > :dir || '/' AND path < :dir || '0';
+    """
+
+DELETE_SCAN_STATE_UNDER = """
+    DELETE FROM scan_state WHERE path > :dir || '/' AND path < :dir || '0';
+    """
+
+# [/SQL statements]
+
+# Seconds without any change before the collected changes are applied, and
+# longest delay before applying them while changes keep coming
+DEFAULT_DELAY = 1.0
+MAX_DELAY = 30.0
+
+# Seconds between snapshots when polling
+DEFAULT_POLL_INTERVAL = 2.0
+
+# Kinds of change
+CHANGED = "changed"
+REMOVED = "removed"
+
+# A change: its kind, the absolute path, and whether it is a directory
+Change = Tuple[str, str, bool]
+
+
+@attr.s(auto_attribs=True, slots=True)
+class Changes:
+    """Changes collected since they were last applied. Only the last change
+    of every path matters."""
+
+    changed: Set[str] = attr.Factory(set)
+    removed: Set[str] = attr.Factory(set)
+    removed_dirs: Set[str] = attr.Factory(set)
+
+    def record(self, kind: str, path: str, is_dir: bool = False) -> None:
+        if kind == CHANGED:
+            self.changed.add(path)
+            self.removed.discard(path)
+            self.removed_dirs.discard(path)
+        else:
+            self.changed.discard(path)
+            (self.removed_dirs if is_dir else self.removed).add(path)
+
+    def __bool__(self) -> bool:
+        return bool(self.changed or self.removed or self.removed_dirs)
+
+
+class PollingWatcher:
+    """Finds changes by comparing snapshots of the files under `roots`,
+    taken every `interval` seconds."""
+
+    def __init__(
+        self,
+        roots: Iterable[str],
+        extensions: Tuple[str, ...],
+        interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        self.roots = list(roots)
+        self.extensions = extensions
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        visited: Set[Tuple[int, int]] = set()
+        for root in self.roots:
+            for path in walk(root, self.extensions, visited):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout: float) -> List[Change]:
+        time.sleep(self.interval)
+        snapshot = self.take_snapshot()
+        changes = [
+            (CHANGED, path, False)
+            for path, state in snapshot.items()
+            if self.snapshot.get(path) != state
+        ]
+        changes.extend(
+            (REMOVED, path, False) for path in self.snapshot if path not in snapshot
+        )
+        self.snapshot = snapshot
+        return changes
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Reads changes under `roots` from inotify (Linux only), watching every
+    directory as it appears."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = (
+        IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+    )
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, roots: Iterable[str], extensions: Tuple[str, ...]):
+        libc_name = ctypes.util.find_library("c")
+        try:
+            self.libc = ctypes.CDLL(libc_name, use_errno=True)
+            init1 = self.libc.inotify_init1
+        except (OSError, AttributeError) as err:
+            raise OSError(errno.ENOSYS, "inotify is not available") from err
+        self.fd = init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.roots = list(roots)
+        self.extensions = extensions
+        self.dirs: Dict[int, str] = {}
+        for root in self.roots:
+            self.add_tree(root)
+
+    def add_tree(self, top: str) -> None:
+        """Watch `top` and every directory under it."""
+        for directory, _, _ in os.walk(top):
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), self.MASK
+            )
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    raise OSError(
+                        err,
+                        "too many inotify watches; increase"
+                        " fs.inotify.max_user_watches",
+                    )
+                logging.warning(
+                    "cannot watch %s: %s", directory, os.strerror(err)
+                )
+                continue
+            self.dirs[wd] = directory
+
+    def remove_tree(self, top: str) -> None:
+        for wd, directory in list(self.dirs.items()):
+            if directory == top or directory.startswith(top + os.sep):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+    def read(self, timeout: float) -> List[Change]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        changes: List[Change] = []
+        pos = 0
+        while pos + self.EVENT.size <= len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, pos)
+            pos += self.EVENT.size
+            name = os.fsdecode(data[pos : pos + length].rstrip(b"\0"))
+            pos += length
+            changes.extend(self.translate(wd, mask, name))
+        return changes
+
+    def translate(self, wd: int, mask: int, name: str) -> List[Change]:
+        if mask & self.IN_Q_OVERFLOW:
+            logging.warning("too many changes at once; rescanning everything")
+            return [(CHANGED, root, True) for root in self.roots]
+        if mask & self.IN_IGNORED:
+            self.dirs.pop(wd, None)
+            return []
+        directory = self.dirs.get(wd)
+        if directory is None:
+            return []
+        if mask & self.IN_DELETE_SELF:
+            if directory in self.roots:
+                raise CommandError(f"watched directory removed: {directory}")
+            return []
+        path = os.path.join(directory, name)
+        if mask & self.IN_ISDIR:
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self.add_tree(path)
+                return [(CHANGED, path, True)]
+            if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                self.remove_tree(path)
+                return [(REMOVED, path, True)]
+            return []
+        if os.path.splitext(name)[1].lower() not in self.extensions:
+            return []
+        if mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+            return [(CHANGED, path, False)]
+        if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+            return [(REMOVED, path, False)]
+        return []  # Created: added once written (IN_CLOSE_WRITE)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def apply_changes(
+    con: sqlite3.Connection,
+    changes: Changes,
+    extensions: Tuple[str, ...],
+    jobs: int = 1,
+    warn_duplicates: bool = True,
+    audio_hash: bool = False,
+    progress: Optional[Progress] = None,
+) -> None:
+    """Apply `changes` to the library, in one transaction (unless there are
+    more than `DEFAULT_BATCH_SIZE` changed files).
+
+    Changed files are read first. The songs at their paths whose title and
+    artist no file has anymore are removed, so that a song whose tags
+    changed does not stay in the library under its old tags; the others are
+    updated in place. Songs that lost their file but have a copy elsewhere
+    (see `purge.find_copies`) are kept, with the path of the copy.
+    """
+    removed = set(changes.removed)
+    changed = []
+    for path in changes.changed:
+        if os.path.exists(path):
+            changed.append(path)
+        else:
+            removed.add(path)
+    # A file created in a new directory is found by walking it too
+    changed_dirs = {p for p in changed if os.path.isdir(p)}
+    music_files = iter_music_files(
+        (p for p in changed if not _in_any(p, changed_dirs)), extensions
+    )
+    songs = list(
+        get_generator(scan(con, music_files, jobs, audio_hash=audio_hash), 0)
+    )
+    # Not committed here: `insert_songs` commits it with the first batch
+    gone = set(removed)
+    for d in changes.removed_dirs:
+        cur = con.execute(SELECT_SONG_PATHS_UNDER, {"dir": d})
+        gone.update(row[0] for row in cur)
+    con.execute(CREATE_CHANGED_TABLE)
+    try:
+        con.executemany(
+            INSERT_CHANGED,
+            (
+                {"path": p, "title": None, "artist": None}
+                for p in changed
+                if not os.path.isdir(p)
+            ),
+        )
+        con.executemany(INSERT_CHANGED, songs)
+        stale = [row[0] for row in con.execute(SELECT_STALE_PATHS)]
+        copies = find_copies(con, gone.union(stale))
+        move_songs(con, copies)
+        con.execute(DELETE_STALE_SONGS)
+    finally:
+        con.execute(DROP_CHANGED_TABLE)
+    con.executemany(DELETE_SONGS_AT, ({"path": p} for p in gone if p not in copies))
+    con.executemany(DELETE_SCAN_STATE_AT, ({"path": p} for p in removed))
+    con.executemany(
+        DELETE_SCAN_STATE_UNDER, ({"dir": d} for d in changes.removed_dirs)
+    )
+    insert_songs(con, songs, warn_duplicates, DEFAULT_BATCH_SIZE, progress)
+
+
+def _in_any(path: str, directories: Set[str]) -> bool:
+    """Whether `path` is under one of `directories`."""
+    parent = os.path.dirname(path)
+    while directories and parent != path:
+        if parent in directories:
+            return True
+        path, parent = parent, os.path.dirname(parent)
+    return False
+
+
+def make_watcher(
+    roots: List[str], extensions: Tuple[str, ...], poll: Optional[float] = None
+):
+    """An inotify watcher, or a polling one if `poll` (the interval) is given
+    or inotify is not available."""
+    if poll is None:
+        try:
+            return InotifyWatcher(roots, extensions)
+        except OSError as err:
+            logging.warning("%s; polling for changes instead", err)
+            poll = DEFAULT_POLL_INTERVAL
+    return PollingWatcher(roots, extensions, poll)
+
+
+def watch(
+    database: str,
+    *directories: str,
+    extensions: Optional[Iterable[str]] = None,
+    poll: Optional[float] = None,
+    delay: float = DEFAULT_DELAY,
+    jobs: int = 1,
+    warn_duplicates: bool = True,
+    audio_hash: bool = False,
+    progress: Optional[Progress] = None,
+) -> None:
+    """Apply the changes to the music files under `directories` to the
+    library as they happen, until interrupted.
+
+    Changes are applied once there has been none for `delay` seconds (or
+    after MAX_DELAY seconds of continuous changes), and reported to
+    `progress`. If applying them fails, the error is logged and watching
+    goes on. When interrupted (KeyboardInterrupt), the pending changes are
+    applied before returning. Changes made while not watching are not seen: run `add` (which
+    skips unchanged files) and `purge` to catch up with them.
+    """
+
+    def apply(changes: Changes) -> None:
+        message = (
+            f"{len(changes.changed)} changed,"
+            f" {len(changes.removed) + len(changes.removed_dirs)} removed"
+        )
+        try:
+            apply_changes(
+                con, changes, extensions, jobs, warn_duplicates, audio_hash, progress
+            )
+        except Exception:
+            con.rollback()
+            logging.exception("failed to apply changes (%s)", message)
+            return
+        if progress is not None:
+            progress.checkpoint(message)
+
+    extensions = normalize_extensions(extensions)
+    roots = []
+    for directory in directories:
+        if not os.path.isdir(directory):
+            raise CommandError(f"not a directory: {directory}")
+        roots.append(os.path.abspath(directory))
+
+    with connection(database) as con:
+        with con:
+            upgrade(con)
+        watcher = make_watcher(roots, extensions, poll)
+        pending = Changes()
+        first = last = 0.0
+        try:
+            while True:
+                changes = watcher.read(delay)
+                now = time.monotonic()
+                if changes:
+                    if not pending:
+                        first = now
+                    last = now
+                    for kind, path, is_dir in changes:
+                        pending.record(kind, path, is_dir)
+                if pending and (now - last >= delay or now - first >= MAX_DELAY):
+                    apply(pending)
+                    pending = Changes()
+        except KeyboardInterrupt:
+            if pending:
+                apply(pending)
+        finally:
+            watcher.close()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The synthetic files of the benchmarks (see benchmarks/synth.py)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "benchmarks"))
@@ -0,0 +1,80 @@
+"""Adding files to the library."""
+import logging
+
+import synth
+from musiclib.operations import add, init
+from musiclib.operations._db import connection
+from musiclib.operations._types import Song
+
+
+def library_titles(database):
+    with connection(database) as con:
+        return sorted(row[0] for row in con.execute("SELECT title FROM library;"))
+
+
+def test_add_skips_missing_files(tmp_path, caplog):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    present = str(tmp_path / "a.mp3")
+    synth.write_stub(present, Song(title="A", artist="Artist", album=None))
+    missing = str(tmp_path / "missing.mp3")
+
+    with caplog.at_level(logging.WARNING):
+        stats = add.add(database, missing, present)
+
+    assert (stats.total, stats.unreadable) == (2, 1)
+    assert library_titles(database) == ["A"]
+    assert any(
+        r.getMessage().startswith("skipped") and missing in r.getMessage()
+        for r in caplog.records
+    )
+
+
+def test_add_skips_unreadable_files(tmp_path):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    synth.write_stub(
+        str(tmp_path / "a.mp3"), Song(title="A", artist="Artist", album=None)
+    )
+    (tmp_path / "junk.mp3").write_bytes(b"not audio")
+
+    stats = add.add(database, str(tmp_path))
+
+    assert (stats.total, stats.unreadable) == (2, 1)
+    assert library_titles(database) == ["A"]
+
+
+def same_audio_warnings(caplog):
+    return [r.getMessage() for r in caplog.records if "same audio" in r.getMessage()]
+
+
+def test_same_audio_reported_once(tmp_path, caplog):
+    # Every stub has the same audio data
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    synth.write_stub(str(tmp_path / "b.mp3"), Song(title="B", artist="X", album=None))
+    add.add(database, str(tmp_path / "b.mp3"), audio_hash=True)
+    copies = [str(tmp_path / "a1.mp3"), str(tmp_path / "a2.mp3")]
+    for path in copies:
+        synth.write_stub(path, Song(title="A", artist="X", album=None))
+
+    with caplog.at_level(logging.WARNING):
+        add.add(database, *copies, audio_hash=True)
+
+    assert same_audio_warnings(caplog) == [
+        'same audio: "A" from "X" as "B" from "X"'
+    ]
+
+
+def test_same_audio_not_reported_for_the_same_file(tmp_path, caplog):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    path = str(tmp_path / "a.mp3")
+    synth.write_stub(path, Song(title="A", artist="X", album=None))
+    add.add(database, path, audio_hash=True)
+    synth.write_stub(path, Song(title="A (retagged)", artist="X", album=None))
+
+    with caplog.at_level(logging.WARNING):
+        add.add(database, path, audio_hash=True)
+
+    assert same_audio_warnings(caplog) == []
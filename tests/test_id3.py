@@ -0,0 +1,67 @@
+"""Writing tags in place with `_id3.write_tags`, read back by eyed3."""
+import eyed3
+import pytest
+
+import synth
+from musiclib.operations import _id3
+from musiclib.operations._types import Song
+
+OLD_SONG = Song(title="Old title", artist="Old artist", album="Old album")
+
+
+def write_stub(path, version, padding=256):
+    with open(path, "wb") as f:
+        f.write(synth.id3v2_tag(OLD_SONG, version, filler=100, padding=padding))
+        f.write(synth.MPEG_FRAME * 4)
+    return str(path)
+
+
+@pytest.mark.parametrize("version", [3, 4])
+@pytest.mark.parametrize(
+    "song",
+    [
+        Song(title="New title", artist="Café Tacvba", album="Ré"),
+        Song(title="Песня", artist="東京事変", album="Ελληνικά"),
+        Song(title="No album", artist="Artist", album=None),
+    ],
+)
+def test_write_tags_round_trip(tmp_path, version, song):
+    path = write_stub(tmp_path / "song.mp3", version)
+    with open(path, "rb") as f:
+        before = f.read()
+
+    assert _id3.write_tags(path, song)
+
+    with open(path, "rb") as f:
+        after = f.read()
+    # Rewritten in place: same size, same audio
+    assert len(after) == len(before)
+    assert after.endswith(synth.MPEG_FRAME * 4)
+    tag = eyed3.load(path).tag
+    assert tag.version == (2, version, 0)
+    assert (tag.title, tag.artist, tag.album) == (song.title, song.artist, song.album)
+    # The other frames are kept
+    assert [p.owner_id for p in tag.privates] == [b"musiclib-bench"]
+    assert _id3.read_tags(path) == song
+
+
+@pytest.mark.parametrize("version", [3, 4])
+def test_write_tags_without_room(tmp_path, version):
+    path = write_stub(tmp_path / "song.mp3", version, padding=0)
+    with open(path, "rb") as f:
+        before = f.read()
+
+    song = OLD_SONG._replace(title="A much longer title " * 4)
+    assert not _id3.write_tags(path, song)
+
+    with open(path, "rb") as f:
+        assert f.read() == before
+
+
+def test_write_tags_without_id3v2(tmp_path):
+    path = tmp_path / "song.mp3"
+    synth.write_stub(str(path), OLD_SONG, version=1)
+    before = path.read_bytes()
+
+    assert not _id3.write_tags(str(path), Song(title="T", artist="A", album=None))
+    assert path.read_bytes() == before
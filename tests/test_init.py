@@ -0,0 +1,99 @@
+"""Migrations of the library schema."""
+import sqlite3
+
+import pytest
+
+from musiclib.exceptions import CommandError
+from musiclib.operations import init, search
+from musiclib.operations._db import connection
+
+# The schema before versions were recorded (version 0), as the first
+# `init` created it
+BASELINE_SCHEMA = """
+    CREATE TABLE library (
+        title TEXT,
+        artist TEXT,
+        album TEXT,
+        download_url TEXT DEFAULT NULL,
+        PRIMARY KEY (title, artist)
+    );
+    """
+
+BASELINE_SONGS = [
+    ("Song 1", "Artist 1", "Album 1", "https://example.com/1"),
+    ("Song 2", "Artist 1", "Album 1", None),
+    ("Song 3", "Artist 2", None, "https://example.com/3"),
+    ("Çà et là", "Artiste", "Über", "https://example.com/4"),
+    (None, "Artist 3", None, None),
+]
+
+
+def make_baseline(database):
+    con = sqlite3.connect(database)
+    con.executescript(BASELINE_SCHEMA)
+    with con:
+        con.executemany("INSERT INTO library VALUES (?, ?, ?, ?);", BASELINE_SONGS)
+    con.close()
+
+
+def library_rows(con):
+    return sorted(
+        con.execute("SELECT title, artist, album, download_url FROM library;")
+    )
+
+
+def test_upgrade_baseline(tmp_path):
+    database = str(tmp_path / "library.db")
+    make_baseline(database)
+
+    init.init(database, upgrade_existing=True)
+
+    with connection(database) as con:
+        assert init.get_version(con) == init.SCHEMA_VERSION == 3
+        # NULL titles were allowed in version 0
+        expected = sorted(
+            (title or "", artist, album, url)
+            for title, artist, album, url in BASELINE_SONGS
+        )
+        assert library_rows(con) == expected
+        con.execute("INSERT INTO library_fts (library_fts) VALUES ('integrity-check');")
+        titles = sorted(s.title for s in search.search_songs(con, "artist 1"))
+        assert titles == ["Song 1", "Song 2"]
+        assert [s.download_url for s in search.search_songs(con, "ca uber")] == [
+            "https://example.com/4"
+        ]
+        columns = {row[1] for row in con.execute("PRAGMA table_info(songs);")}
+        assert {"download_status", "audio_hash", "download_url_updated"} <= columns
+
+
+def test_upgrade_is_idempotent(tmp_path):
+    database = str(tmp_path / "library.db")
+    make_baseline(database)
+    init.init(database, upgrade_existing=True)
+    with connection(database) as con:
+        before = library_rows(con)
+
+    init.init(database, upgrade_existing=True)
+
+    with connection(database) as con:
+        assert init.get_version(con) == init.SCHEMA_VERSION
+        assert library_rows(con) == before
+
+
+def test_init_creates_current_schema(tmp_path):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    with connection(database) as con:
+        assert init.get_version(con) == init.SCHEMA_VERSION
+        assert library_rows(con) == []
+    with pytest.raises(CommandError):
+        init.init(database)
+
+
+def test_newer_schema_is_refused(tmp_path):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    with connection(database) as con:
+        init.set_version(con, init.SCHEMA_VERSION + 1)
+    with pytest.raises(CommandError, match="newer"):
+        init.init(database, upgrade_existing=True)
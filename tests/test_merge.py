@@ -0,0 +1,116 @@
+"""Merging another library into this one."""
+import pytest
+
+from musiclib.exceptions import CommandError
+from musiclib.operations import add, init, merge
+from musiclib.operations._db import connection
+
+SET_URL = """
+    UPDATE songs SET download_url = :url, download_url_updated = :updated
+    WHERE title = :title;
+    """
+
+
+def make_library(path, titles, change_log=False):
+    database = str(path)
+    init.init(database, change_log=change_log)
+    with connection(database) as con:
+        songs = (
+            {"title": t, "artist": "A", "album": None, "path": None, "audio_hash": None}
+            for t in titles
+        )
+        add.insert_songs(con, songs, warn_duplicates=False)
+    return database
+
+
+def set_url(database, title, url, updated):
+    with connection(database) as con:
+        with con:
+            con.execute(SET_URL, {"title": title, "url": url, "updated": updated})
+
+
+def urls(database):
+    with connection(database) as con:
+        rows = con.execute("SELECT title, download_url FROM library;")
+        return dict(rows)
+
+
+def merge_state(database):
+    with connection(database) as con:
+        return con.execute("SELECT source, seq FROM merge_state;").fetchall()
+
+
+def test_merge_adds_songs_and_missing_urls(tmp_path):
+    here = make_library(tmp_path / "here.db", ["a", "b"])
+    other = make_library(tmp_path / "other.db", ["b", "c"])
+    set_url(here, "b", "here-b", 2.0)
+    set_url(other, "b", "other-b", 3.0)
+    set_url(other, "c", "other-c", 1.0)
+
+    result = merge.merge(here, other)
+
+    assert result == merge.MergeResult(
+        songs=2, added=1, updated=0, conflicting=1, incremental=False
+    )
+    assert urls(here) == {"a": None, "b": "here-b", "c": "other-c"}
+
+    result = merge.merge(here, other, prefer=merge.PREFER_NEWER)
+
+    assert (result.added, result.updated, result.conflicting) == (0, 1, 0)
+    assert urls(here)["b"] == "other-b"
+
+
+def test_incremental_merge(tmp_path):
+    here = make_library(tmp_path / "here.db", [])
+    other = make_library(tmp_path / "other.db", ["a", "b", "c"], change_log=True)
+    source = str(tmp_path / "other.db")
+
+    # No watermark yet: every song is read, and the last change recorded
+    first = merge.merge(here, other, incremental=True)
+    assert (first.songs, first.added, first.incremental) == (3, 3, False)
+    ((recorded, seq),) = merge_state(here)
+    assert recorded == source
+
+    set_url(other, "b", "new-b", 1.0)
+    second = merge.merge(here, other, merge.PREFER_NEWER, incremental=True)
+
+    assert second == merge.MergeResult(
+        songs=1, added=0, updated=1, conflicting=0, incremental=True
+    )
+    assert urls(here)["b"] == "new-b"
+    watermark = merge_state(here)
+    assert watermark[0][1] > seq
+
+    # Nothing changed since
+    third = merge.merge(here, other, merge.PREFER_NEWER, incremental=True)
+    assert (third.songs, third.incremental) == (0, True)
+    assert merge_state(here) == watermark
+
+
+def test_change_log_reset(tmp_path, caplog):
+    here = make_library(tmp_path / "here.db", [])
+    other = make_library(tmp_path / "other.db", ["a"], change_log=True)
+    merge.merge(here, other, incremental=True)
+    with connection(here) as con:
+        with con:
+            con.execute("UPDATE merge_state SET seq = seq + 100;")
+
+    result = merge.merge(here, other, incremental=True)
+
+    assert (result.songs, result.incremental) == (1, False)
+    assert "was reset" in caplog.text
+
+
+def test_incremental_merge_needs_a_change_log(tmp_path):
+    here = make_library(tmp_path / "here.db", [])
+    other = make_library(tmp_path / "other.db", ["a"])
+
+    with pytest.raises(CommandError, match="no change log"):
+        merge.merge(here, other, incremental=True)
+    assert urls(here) == {}
+
+
+def test_merge_into_itself(tmp_path):
+    here = make_library(tmp_path / "here.db", ["a"])
+    with pytest.raises(CommandError, match="itself"):
+        merge.merge(here, here)
@@ -0,0 +1,101 @@
+"""Removing the songs whose file is gone."""
+import os
+
+import pytest
+
+import synth
+from musiclib.exceptions import CommandError
+from musiclib.operations import add, init, purge
+from musiclib.operations._db import connection
+from musiclib.operations._types import Song
+
+
+def library_paths(database):
+    with connection(database) as con:
+        return dict(con.execute("SELECT title, path FROM library;"))
+
+
+def make_library(tmp_path, titles):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    files = {}
+    for title in titles:
+        files[title] = str(tmp_path / f"{title}.mp3")
+        synth.write_stub(files[title], Song(title=title, artist="Artist", album=None))
+    add.add(database, *files.values())
+    return database, files
+
+
+def test_purge_removes_missing_songs(tmp_path):
+    database, files = make_library(tmp_path, ["a", "b", "c"])
+    os.remove(files["b"])
+
+    removed = purge.purge(database, jobs=2)
+
+    assert [(e.title, e.path) for e in removed] == [("b", files["b"])]
+    assert sorted(library_paths(database)) == ["a", "c"]
+    with connection(database) as con:
+        cached = {row[0] for row in con.execute("SELECT path FROM scan_state;")}
+    assert cached == {files["a"], files["c"]}
+
+
+def test_dry_run_removes_nothing(tmp_path):
+    database, files = make_library(tmp_path, ["a", "b"])
+    os.remove(files["b"])
+
+    removed = purge.purge(database, dry_run=True)
+
+    assert [e.title for e in removed] == ["b"]
+    assert sorted(library_paths(database)) == ["a", "b"]
+
+
+def test_all_files_missing(tmp_path):
+    database, files = make_library(tmp_path, ["a", "b"])
+    for path in files.values():
+        os.remove(path)
+
+    with pytest.raises(CommandError, match="all 2 files are missing"):
+        purge.purge(database)
+    assert sorted(library_paths(database)) == ["a", "b"]
+
+    removed = purge.purge(database, force=True)
+    assert sorted(e.title for e in removed) == ["a", "b"]
+    assert library_paths(database) == {}
+
+
+def test_songs_without_path_are_kept(tmp_path):
+    database, files = make_library(tmp_path, ["a", "b", "c"])
+    with connection(database) as con:
+        with con:
+            con.execute("UPDATE songs SET path = NULL WHERE title = 'a';")
+    os.remove(files["a"])
+    os.remove(files["b"])
+
+    removed = purge.purge(database)
+
+    assert [e.title for e in removed] == ["b"]
+    assert library_paths(database) == {"a": None, "c": files["c"]}
+
+
+def test_purge_keeps_songs_with_a_copy(tmp_path):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    (tmp_path / "sub").mkdir()
+    original = str(tmp_path / "a.mp3")
+    copy = str(tmp_path / "sub" / "a_copy.mp3")
+    for path in (original, copy):
+        synth.write_stub(path, Song(title="A", artist="Artist", album=None))
+    synth.write_stub(
+        str(tmp_path / "b.mp3"), Song(title="B", artist="Artist", album=None)
+    )
+    add.add(database, original, copy, str(tmp_path / "b.mp3"))
+    assert library_paths(database)["A"] == copy
+    os.remove(copy)
+
+    removed = purge.purge(database, jobs=1)
+
+    assert removed == []
+    assert library_paths(database)["A"] == original
+    with connection(database) as con:
+        cached = [row[0] for row in con.execute("SELECT path FROM scan_state;")]
+    assert copy not in cached
@@ -0,0 +1,47 @@
+"""Requests to the library daemon, handled without a socket."""
+import pytest
+
+from musiclib.operations import init, serve
+
+
+@pytest.fixture
+def library(tmp_path):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    library = serve.Library(database)
+    yield library
+    library.close()
+
+
+def test_ping(library):
+    assert library.handle({"id": 1, "op": "ping"}) == {
+        "id": 1,
+        "ok": True,
+        "result": "pong",
+    }
+
+
+@pytest.mark.parametrize(
+    "op, args, error",
+    [
+        ("list", {"limit": "x"}, "limit must be an integer or null"),
+        ("list", {"limit": True}, "limit must be an integer or null"),
+        ("list", {"limit": 0}, "limit must be at least 1"),
+        ("list", {"offset": None}, "offset must be an integer"),
+        ("list", {"title": 1}, "title must be a string or null"),
+        ("list", {"has_url": "yes"}, "has_url must be a boolean or null"),
+        ("search", {"text": ["a"]}, "text must be a string"),
+        ("add", {"files": "/a.mp3"}, "files must be a list of strings"),
+        ("add", {"files": [1]}, "files must be a list of strings"),
+        ("add", {"files": [], "use_cache": 1}, "use_cache must be a boolean"),
+        ("url.set", {"text": {}}, "text must be a string"),
+    ],
+)
+def test_arguments_of_the_wrong_type(library, op, args, error):
+    assert library.handle({"op": op, "args": args}) == {"ok": False, "error": error}
+
+
+def test_unknown_arguments(library):
+    response = library.handle({"op": "list", "args": {"colour": "red"}})
+    assert not response["ok"]
+    assert response["error"].startswith("invalid arguments")
@@ -0,0 +1,191 @@
+"""Setting download URLs from a file (`url set`)."""
+import io
+import json
+import shlex
+import sqlite3
+
+import pytest
+
+from musiclib.operations import add, init
+from musiclib.operations import url as op_url
+from musiclib.operations._db import connection
+
+SONGS = [
+    ("Plain", "Artist"),
+    ("With spaces", "Some artist"),
+    ("It's", "O'Brien"),
+    ('Say "hi"', "Back\\slash"),
+    ("Tab\there", "Ünïcödé 日本"),
+    ("# not a comment", "-dash"),
+]
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    with connection(database) as con:
+        songs = (
+            {"title": t, "artist": a, "album": None, "path": None, "audio_hash": None}
+            for t, a in SONGS
+        )
+        add.insert_songs(con, songs, warn_duplicates=False)
+    return database
+
+
+def urls(database):
+    with connection(database) as con:
+        rows = con.execute("SELECT title, artist, download_url FROM library;")
+        return {(title, artist): url for title, artist, url in rows}
+
+
+def set_urls(database, text, format=op_url.TEMPLATE):
+    return op_url.set_from_file(database, io.StringIO(text), format)
+
+
+@pytest.mark.parametrize("format", op_url.FORMATS)
+def test_template_round_trip(database, tmp_path, format):
+    out = io.StringIO()
+    op_url.template(database, out, align=False, format=format)
+    # Fill in a URL for every song, as a user would
+    expected = {song: f"https://example.com/{i}" for i, song in enumerate(SONGS)}
+    text = out.getvalue()
+    for (title, artist), url in expected.items():
+        if format == op_url.TEMPLATE:
+            line = f"{shlex.quote(title)} {shlex.quote(artist)} ''"
+            text = text.replace(line, line[:-2] + shlex.quote(url))
+        elif format == op_url.TSV:
+            line = "\t".join(map(op_url._tsv_escape, (title, artist))) + "\t\n"
+            text = text.replace(line, line[:-1] + url + "\n")
+        else:
+            line = json.dumps(
+                {"title": title, "artist": artist, "download_url": None}
+            )
+            text = text.replace(line, line.replace("null", json.dumps(url)))
+
+    result = set_urls(database, text, format)
+
+    assert (result.lines, result.updated) == (len(SONGS), len(SONGS))
+    assert (result.unmatched, result.conflicting) == ([], [])
+    assert urls(database) == expected
+
+
+@pytest.mark.parametrize("format", op_url.FORMATS)
+def test_empty_template_sets_nothing(database, format):
+    out = io.StringIO()
+    op_url.template(database, out, format=format)
+
+    result = set_urls(database, out.getvalue(), format)
+
+    # Every song is matched, and keeps no URL
+    assert (result.lines, result.updated) == (len(SONGS), len(SONGS))
+    assert set(urls(database).values()) == {None}
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_unmatched_and_conflicting_lines(database, monkeypatch, legacy):
+    if legacy:
+        # UPDATE ... FROM is only used from SQLite 3.33
+        monkeypatch.setattr(sqlite3, "sqlite_version_info", (3, 32, 0))
+    text = "\n".join(
+        [
+            "# title artist url",
+            "Plain Artist https://example.com/old",
+            "Missing Artist https://example.com/missing",
+            "'With spaces' 'Some artist' https://example.com/same",
+            "Plain Artist https://example.com/new",
+            "'With spaces' 'Some artist' https://example.com/same",
+            "",
+        ]
+    )
+
+    result = set_urls(database, text)
+
+    assert result.lines == 5
+    assert result.updated == 2
+    assert result.unmatched == [op_url.LineRef(3, "Missing", "Artist")]
+    assert result.conflicting == [op_url.LineRef(5, "Plain", "Artist")]
+    assert urls(database)[("Plain", "Artist")] == "https://example.com/new"
+    assert urls(database)[("With spaces", "Some artist")] == "https://example.com/same"
+
+
+def test_new_url_resets_download_state(database):
+    set_urls(database, "Plain Artist https://example.com/1\n")
+    with connection(database) as con:
+        with con:
+            con.execute(
+                "UPDATE songs SET download_status = 'done', download_attempts = 2;"
+            )
+
+    set_urls(database, "Plain Artist https://example.com/1\nIt\\'s O\\'Brien x\n")
+    with connection(database) as con:
+        assert con.execute(
+            "SELECT download_status, download_attempts FROM library"
+            " WHERE title = 'Plain';"
+        ).fetchone() == ("done", 2)
+
+    set_urls(database, "Plain Artist https://example.com/2\n")
+    with connection(database) as con:
+        row = con.execute(
+            "SELECT download_status, download_attempts, download_url_updated"
+            " FROM songs WHERE title = 'Plain';"
+        ).fetchone()
+    assert row[:2] == (None, 0)
+    assert row[2] is not None
+
+
+def test_malformed_file_sets_nothing(database):
+    text = "Plain Artist https://example.com/1\n'Unterminated Artist x\n"
+    with pytest.raises(op_url.MalformedFile, match="line 2"):
+        set_urls(database, text)
+    assert set(urls(database).values()) == {None}
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "Plain Artist url",
+        "  Plain   Artist\turl  \n",
+        "'With spaces' 'Some artist' ''\n",
+        "'It'\"'\"'s' 'O'\"'\"'Brien' url\n",
+        "It\\'s O\\'Brien url\n",
+        "\"Say \\\"hi\\\"\" 'Back\\slash' url\n",
+        "a'b'c d e # a comment\n",
+        "a b c#d\n",
+        "'# not a comment' -dash u\n",
+        "'Tab\there' 'Ünïcödé 日本' u\n",
+        "# only a comment\n",
+        "   \n",
+    ],
+)
+def test_fast_path_matches_shlex(line):
+    """The regular expression for quoted lines must parse them as shlex."""
+    words = shlex.split(line, comments=True)
+    expected = []
+    if words:
+        title, artist, url = words
+        expected = [{"title": title, "artist": artist, "url": url or None, "line": 1}]
+    assert list(op_url.get_lines(io.StringIO(line))) == expected
+
+
+def test_fast_path_matches_shlex_on_quoted_values():
+    values = [title for title, _ in SONGS] + [artist for _, artist in SONGS] + [""]
+    lines = [
+        f"{shlex.quote(a)} {shlex.quote(b)} {shlex.quote(c)}\n"
+        for a in values
+        for b in values
+        for c in ("", "https://example.com/a?b=c&d='e'")
+        if a and b
+    ]
+    for number, (line, parsed) in enumerate(
+        zip(lines, op_url.get_lines(io.StringIO("".join(lines)))), 1
+    ):
+        if '"' not in line:  # shlex.quote quotes single quotes with them
+            assert op_url._QUOTED_LINE.fullmatch(line), line
+        title, artist, url = shlex.split(line, comments=True)
+        assert parsed == {
+            "title": title,
+            "artist": artist,
+            "url": url or None,
+            "line": number,
+        }
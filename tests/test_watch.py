@@ -0,0 +1,87 @@
+"""Applying the changes collected by `watch`."""
+import os
+
+import synth
+from musiclib.operations import add, init, watch
+from musiclib.operations._db import connection
+from musiclib.operations._types import Song
+
+
+def make_library(tmp_path, titles):
+    database = str(tmp_path / "library.db")
+    init.init(database)
+    files = {}
+    for title in titles:
+        files[title] = str(tmp_path / f"{title}.mp3")
+        synth.write_stub(files[title], Song(title=title, artist="A", album=None))
+    add.add(database, *files.values())
+    with connection(database) as con:
+        with con:
+            con.execute("UPDATE songs SET download_url = 'u:' || title;")
+    return database, files
+
+
+def apply(database, *changes):
+    pending = watch.Changes()
+    for kind, path in changes:
+        pending.record(kind, path)
+    with connection(database) as con:
+        watch.apply_changes(con, pending, (".mp3",))
+
+
+def library(database):
+    with connection(database) as con:
+        return {
+            title: (id, url, path)
+            for id, title, url, path in con.execute(
+                "SELECT id, title, download_url, path FROM library;"
+            )
+        }
+
+
+def test_modified_files_keep_their_songs(tmp_path):
+    database, files = make_library(tmp_path, ["same", "retag", "p", "q"])
+    before = library(database)
+    os.utime(files["same"], ns=(1, 1))
+    synth.write_stub(files["retag"], Song(title="retagged", artist="A", album=None))
+    # Swapping tags
+    synth.write_stub(files["p"], Song(title="q", artist="A", album=None))
+    synth.write_stub(files["q"], Song(title="p", artist="A", album=None))
+
+    apply(database, *((watch.CHANGED, f) for f in files.values()))
+
+    after = library(database)
+    assert after["same"] == before["same"]
+    assert after["p"] == before["p"][:2] + (files["q"],)
+    assert after["q"] == before["q"][:2] + (files["p"],)
+    assert "retag" not in after
+    assert after["retagged"][1:] == (None, files["retag"])
+
+
+def test_removed_file_with_a_copy(tmp_path):
+    database, files = make_library(tmp_path, ["a", "b"])
+    copy = str(tmp_path / "a_copy.mp3")
+    synth.write_stub(copy, Song(title="a", artist="A", album=None))
+    add.add(database, copy)
+    before = library(database)
+    os.remove(copy)
+    os.remove(files["b"])
+
+    apply(database, (watch.REMOVED, copy), (watch.REMOVED, files["b"]))
+
+    after = library(database)
+    assert after == {"a": before["a"][:2] + (files["a"],)}
+
+
+def test_new_directory_with_files(tmp_path, caplog):
+    database, _ = make_library(tmp_path, [])
+    directory = tmp_path / "new"
+    (directory / "sub").mkdir(parents=True)
+    path = str(directory / "sub" / "n.mp3")
+    synth.write_stub(path, Song(title="n", artist="A", album=None))
+
+    # As inotify reports them: the directory, then the file written in it
+    apply(database, (watch.CHANGED, str(directory)), (watch.CHANGED, path))
+
+    assert library(database)["n"][2] == path
+    assert "duplicate" not in caplog.text